@@ -6,6 +6,11 @@ signal error_detected(error_code: int, message: String)
 signal mic_level_changed(level: float, active: bool)
 
 const VOSK_SAMPLE_FORMAT := "16kHz mono PCM16LE"
+# The level meter only needs an estimate, so raw capture samples every Nth frame.
+const LEVEL_SAMPLE_STRIDE := 4
+# How long raw capture waits for the service to accept its format before
+# converting to PCM16 here instead.
+const AUDIO_FORMAT_ACK_TIMEOUT_SECONDS := 1.0
 
 @export var capture_bus_name := "MicCapture"
 @export var target_sample_rate := 16000
@@ -14,6 +19,11 @@ const VOSK_SAMPLE_FORMAT := "16kHz mono PCM16LE"
 @export var silence_timeout_seconds := 0.6
 @export var stop_on_silence := false
 @export var no_audio_timeout_seconds := 3.0
+## Send the capture buffer as-is (stereo float32 at the mix rate) and let the
+## speech service resample it, instead of converting it here sample by sample.
+## Needs NumPy in the service; audio is converted here instead if the service
+## rejects the format or does not acknowledge it.
+@export var send_raw_capture := false
 
 var _ws_client: VoskWebSocketClient
 var _mic_player: AudioStreamPlayer
@@ -29,6 +39,10 @@ var _mic_error_reported := false
 var _packet_count := 0
 var _no_audio_seconds := 0.0
 var _waiting_for_connection := false
+var _raw_capture_active := false
+var _awaiting_format_ack := false
+var _format_ack_seconds := 0.0
+var _held_frames := PackedVector2Array()
 
 func _ready() -> void:
 	set_process(false)
@@ -64,6 +78,7 @@ func start_streaming(ws_client: VoskWebSocketClient) -> bool:
 		set_process(false)
 		return false
 	_reset_detection_state()
+	_declare_audio_format()
 	set_process(true)
 	print("VoskMicStreamer: microphone capture started.")
 	return true
@@ -78,6 +93,10 @@ func start_listening(ws_client: VoskWebSocketClient, grammar: Array[String]) ->
 
 func stop_streaming() -> void:
 	set_process(false)
+	if _ws_client and _ws_client.audio_format_acknowledged.is_connected(_on_audio_format_acknowledged):
+		_ws_client.audio_format_acknowledged.disconnect(_on_audio_format_acknowledged)
+	_awaiting_format_ack = false
+	_held_frames.clear()
 	if _mic_player:
 		_mic_player.stop()
 		_mic_player.queue_free()
@@ -91,11 +110,21 @@ func _process(delta: float) -> void:
 	if _waiting_for_connection:
 		if _ws_client.is_open():
 			_waiting_for_connection = false
+			if _raw_capture_active:
+				# The client declares float32 again on reconnect; the service
+				# may have been restarted without NumPy, so wait for its ack.
+				_raw_capture_active = false
+				_awaiting_format_ack = true
+				_format_ack_seconds = 0.0
 		else:
 			return
 	if not _ws_client.is_open():
 		_waiting_for_connection = true
 		return
+	if _awaiting_format_ack:
+		_format_ack_seconds += delta
+		if _format_ack_seconds >= AUDIO_FORMAT_ACK_TIMEOUT_SECONDS:
+			_fall_back_to_pcm16("the speech service did not acknowledge the audio format")
 	var frames_available := _capture_effect.get_frames_available()
 	if frames_available <= 0:
 		_track_no_audio(delta)
@@ -104,17 +133,73 @@ func _process(delta: float) -> void:
 	var frames := _capture_effect.get_buffer(frames_available)
 	if frames.is_empty():
 		return
+	if _awaiting_format_ack:
+		# Until the service accepts float32, it would read these as PCM16.
+		_held_frames.append_array(frames)
+		return
+	_send_frames(frames)
+
+func _send_frames(frames: PackedVector2Array) -> void:
+	if _raw_capture_active:
+		_update_silence_detector(_frames_rms(frames), frames.size())
+		# Vector2 components are float32 in standard (single-precision) builds.
+		_send_packet(frames.to_byte_array(), frames.size(), frames.size())
+		return
 	var mono_samples := _to_mono_samples(frames)
-	_update_silence_detector(mono_samples)
+	_update_silence_detector(_calculate_rms(mono_samples), mono_samples.size())
 	var resampled := _resample_to_target(mono_samples)
 	if resampled.size() > 0:
-		var pcm_bytes := _to_pcm16le(resampled)
-		_packet_count += 1
-		print(
-			"VoskMicStreamer: sending packet %d (frames=%d, resampled=%d, bytes=%d)"
-			% [_packet_count, frames.size(), resampled.size(), pcm_bytes.size()]
-		)
-		_ws_client.send_bytes(pcm_bytes)
+		_send_packet(_to_pcm16le(resampled), frames.size(), resampled.size())
+
+func _send_packet(payload: PackedByteArray, frame_count: int, sample_count: int) -> void:
+	_packet_count += 1
+	print(
+		"VoskMicStreamer: sending packet %d (frames=%d, samples=%d, bytes=%d)"
+		% [_packet_count, frame_count, sample_count, payload.size()]
+	)
+	_ws_client.send_bytes(payload)
+
+func _declare_audio_format() -> void:
+	if not _ws_client:
+		return
+	_raw_capture_active = false
+	_held_frames.clear()
+	if not send_raw_capture:
+		_awaiting_format_ack = false
+		_ws_client.set_audio_format(target_sample_rate, "int16", 1)
+		return
+	if not _ws_client.audio_format_acknowledged.is_connected(_on_audio_format_acknowledged):
+		_ws_client.audio_format_acknowledged.connect(_on_audio_format_acknowledged)
+	_awaiting_format_ack = true
+	_format_ack_seconds = 0.0
+	_ws_client.set_audio_format(int(_input_sample_rate), "float32", 2)
+
+func _on_audio_format_acknowledged(ok: bool, error: String) -> void:
+	if not _ws_client:
+		return
+	if not ok:
+		if _awaiting_format_ack or _raw_capture_active:
+			_fall_back_to_pcm16(error)
+		return
+	if not _awaiting_format_ack:
+		return
+	_awaiting_format_ack = false
+	_raw_capture_active = true
+	_flush_held_frames()
+
+func _fall_back_to_pcm16(reason: String) -> void:
+	push_warning("VoskMicStreamer: sending PCM16 instead of raw capture (%s)." % reason)
+	_awaiting_format_ack = false
+	_raw_capture_active = false
+	_ws_client.set_audio_format(target_sample_rate, "int16", 1)
+	_flush_held_frames()
+
+func _flush_held_frames() -> void:
+	if _held_frames.is_empty():
+		return
+	var held := _held_frames
+	_held_frames = PackedVector2Array()
+	_send_frames(held)
 
 func _ensure_capture_bus() -> bool:
 	_capture_bus_index = _find_bus_index(capture_bus_name)
@@ -253,13 +338,12 @@ func _to_pcm16le(samples: PackedFloat32Array) -> PackedByteArray:
 		pcm.encode_s16(i * 2, value)
 	return pcm
 
-func _update_silence_detector(samples: PackedFloat32Array) -> void:
-	if samples.is_empty() or _input_sample_rate <= 0:
+func _update_silence_detector(rms: float, sample_count: int) -> void:
+	if sample_count <= 0 or _input_sample_rate <= 0:
 		return
-	var rms := _calculate_rms(samples)
 	var active := rms >= silence_threshold
 	mic_level_changed.emit(rms, active)
-	var duration := float(samples.size()) / float(_input_sample_rate)
+	var duration := float(sample_count) / float(_input_sample_rate)
 	if active:
 		_has_speech = true
 		_speech_seconds += duration
@@ -278,6 +362,15 @@ func _calculate_rms(samples: PackedFloat32Array) -> float:
 		sum += sample * sample
 	return sqrt(sum / float(samples.size()))
 
+func _frames_rms(frames: PackedVector2Array) -> float:
+	var sum := 0.0
+	var count := 0
+	for i in range(0, frames.size(), LEVEL_SAMPLE_STRIDE):
+		var sample := (frames[i].x + frames[i].y) * 0.5
+		sum += sample * sample
+		count += 1
+	return sqrt(sum / float(count))
+
 func _request_final() -> void:
 	if _ws_client:
 		_ws_client.send_json({"type": "final"})
@@ -4,17 +4,21 @@ extends Node
 signal service_ready
 signal service_started(pid: int, path: String)
 signal unavailable(reason: String)
+signal status_changed(state: String, status: Dictionary)
 
 const WS_URL := "ws://127.0.0.1:2700"
 const CONNECT_TIMEOUT_SECONDS := 2.0
 const MAX_RETRIES := 6
 const BACKOFF_BASE_SECONDS := 0.25
 const BACKOFF_MAX_SECONDS := 2.0
+const STATUS_POLL_SECONDS := 0.5
+const MODEL_LOAD_TIMEOUT_SECONDS := 120.0
 
 var _service_pid := -1
 var _is_ready := false
 var _is_starting := false
 var _is_failed := false
+var _last_status: Dictionary = {}
 
 func _ready() -> void:
 	ensure_service_ready()
@@ -25,6 +29,9 @@ func is_ready() -> bool:
 func can_enter_listening() -> bool:
 	return _is_ready
 
+func get_last_status() -> Dictionary:
+	return _last_status
+
 func wait_until_ready() -> void:
 	if _is_ready:
 		return
@@ -40,9 +47,10 @@ func _start_or_connect() -> void:
 	if _is_ready:
 		_is_starting = false
 		return
-	var running := await _probe_websocket(CONNECT_TIMEOUT_SECONDS)
-	if running:
-		_mark_ready()
+	var state := await _probe_websocket(CONNECT_TIMEOUT_SECONDS)
+	if not state.is_empty():
+		_apply_service_state(state)
+		_is_starting = false
 		return
 	_start_service_process()
 	if _is_failed:
@@ -68,20 +76,24 @@ func _start_service_process() -> void:
 func _wait_for_ready_with_backoff() -> void:
 	for attempt in range(MAX_RETRIES):
 		print("Vosk websocket probe attempt %d/%d url=%s" % [attempt + 1, MAX_RETRIES, WS_URL])
-		if await _probe_websocket(CONNECT_TIMEOUT_SECONDS):
-			_mark_ready()
+		var state := await _probe_websocket(CONNECT_TIMEOUT_SECONDS)
+		if not state.is_empty():
+			_apply_service_state(state)
 			return
 		var delay: float = min(BACKOFF_BASE_SECONDS * pow(2.0, float(attempt)), BACKOFF_MAX_SECONDS)
 		await get_tree().create_timer(delay).timeout
 	push_warning("Vosk service did not become ready after retries.")
 	_mark_unavailable("connect_failed")
 
-func _probe_websocket(timeout_seconds: float) -> bool:
+# Returns "" when the socket cannot be opened. Otherwise polls the service's
+# status until it has finished loading the model and returns its state
+# ("warming", "ready" or "failed"), or "timeout".
+func _probe_websocket(timeout_seconds: float) -> String:
 	var peer := WebSocketPeer.new()
 	var err := peer.connect_to_url(WS_URL)
 	if err != OK:
 		print("Vosk websocket connect_to_url failed url=%s err=%s" % [WS_URL, err])
-		return false
+		return ""
 	print("Vosk websocket connect_to_url succeeded url=%s" % WS_URL)
 	var elapsed := 0.0
 	while elapsed < timeout_seconds:
@@ -89,15 +101,52 @@ func _probe_websocket(timeout_seconds: float) -> bool:
 		var state := peer.get_ready_state()
 		if state == WebSocketPeer.STATE_OPEN:
 			print("Vosk websocket state open url=%s" % WS_URL)
+			var service_state := await _poll_service_status(peer)
 			peer.close()
-			return true
+			return service_state
 		if state == WebSocketPeer.STATE_CLOSED:
 			print("Vosk websocket state closed before open url=%s" % WS_URL)
-			return false
+			return ""
 		await get_tree().create_timer(0.1).timeout
 		elapsed += 0.1
 	peer.close()
-	return false
+	return ""
+
+func _poll_service_status(peer: WebSocketPeer) -> String:
+	var elapsed := 0.0
+	var since_request := STATUS_POLL_SECONDS
+	while elapsed < MODEL_LOAD_TIMEOUT_SECONDS:
+		if since_request >= STATUS_POLL_SECONDS:
+			peer.send_text(JSON.stringify({"type": "status"}))
+			since_request = 0.0
+		peer.poll()
+		if peer.get_ready_state() == WebSocketPeer.STATE_CLOSED:
+			return ""
+		while peer.get_available_packet_count() > 0:
+			var parsed: Variant = JSON.parse_string(peer.get_packet().get_string_from_utf8())
+			if typeof(parsed) != TYPE_DICTIONARY or parsed.get("type", "") != "status":
+				continue
+			var service_state := str(parsed.get("state", ""))
+			_last_status = parsed
+			status_changed.emit(service_state, parsed)
+			if service_state != "loading":
+				print("Vosk service %s timings=%s" % [service_state, parsed.get("timings", {})])
+				return service_state
+		await get_tree().create_timer(0.1).timeout
+		elapsed += 0.1
+		since_request += 0.1
+	push_warning("Vosk service is still loading after %.0fs." % MODEL_LOAD_TIMEOUT_SECONDS)
+	return "timeout"
+
+func _apply_service_state(state: String) -> void:
+	match state:
+		"failed":
+			push_warning("Vosk service failed to load: %s" % _last_status.get("error", "unknown error"))
+			_mark_unavailable("model_failed")
+		"timeout":
+			_mark_unavailable("load_timeout")
+		_:
+			_mark_ready()
 
 func _mark_ready() -> void:
 	if _is_ready:
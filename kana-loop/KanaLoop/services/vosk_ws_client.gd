@@ -6,6 +6,7 @@ signal on_final(text: String)
 signal on_error(message: String)
 signal grammar_acknowledged(success: bool)
 signal grammar_acknowledged_detail(ok: bool, error: String, grammar: Array)
+signal audio_format_acknowledged(ok: bool, error: String)
 signal connected
 signal disconnected(code: int, reason: String)
 
@@ -14,12 +15,31 @@ const DEFAULT_PORT := 2700
 const RECONNECT_BASE_SECONDS := 0.25
 const RECONNECT_MAX_SECONDS := 2.0
 
+## Partial results the service should send: "all", "changes" or "off".
+@export var partial_mode := "changes"
+## Upper bound on partials per second; 0 leaves the rate uncapped.
+@export var max_partials_per_second := 0.0
+## Ask the service to skip decoding silent frames (needs numpy in the service).
+## Opt-in: a threshold too high for the microphone drops quiet speech.
+@export var server_vad := false
+## RMS level (0..1) the service's voice gate treats as speech.
+@export var server_vad_energy_threshold := 0.01
+## What the service does when audio arrives faster than it decodes:
+## "block", "drop_oldest" or "signal" (drop new audio and report it).
+@export var ingest_overflow := "block"
+## Audio the service may have queued before the overflow policy applies.
+@export var ingest_max_queued_ms := 2000
+## Merge the per-tick microphone packets into chunks of at least this size
+## before decoding; 0 decodes each packet as it arrives.
+@export var ingest_min_chunk_ms := 60
+
 var _peer: WebSocketPeer
 var _ws_url := ""
 var _connected := false
 var _stop_requested := false
 var _reconnect_delay := RECONNECT_BASE_SECONDS
 var _next_reconnect_at_msec := 0
+var _audio_format: Dictionary = {}
 
 func _ready() -> void:
 	set_process(false)
@@ -69,6 +89,40 @@ func send_grammar(words: Array[String]) -> bool:
 		"grammar": words,
 	})
 
+func send_partial_policy(mode: String, max_per_second: float = 0.0) -> bool:
+	return send_json({
+		"type": "partial_policy",
+		"mode": mode,
+		"max_per_second": max_per_second,
+	})
+
+func send_ingest_policy(overflow: String, max_queued_ms: int, min_chunk_ms: int) -> bool:
+	return send_json({
+		"type": "ingest_policy",
+		"overflow": overflow,
+		"max_queued_ms": max_queued_ms,
+		"min_chunk_ms": min_chunk_ms,
+	})
+
+## Declares the format of the audio sent with send_bytes. The service resamples
+## and converts it, and the declaration is repeated after every reconnect.
+func set_audio_format(sample_rate: int, encoding: String = "int16", channels: int = 1) -> void:
+	_audio_format = {
+		"type": "audio_format",
+		"sample_rate": sample_rate,
+		"encoding": encoding,
+		"channels": channels,
+	}
+	if _is_open():
+		send_json(_audio_format)
+
+func send_vad(enabled: bool, energy_threshold: float = 0.01) -> bool:
+	return send_json({
+		"type": "vad",
+		"enabled": enabled,
+		"energy_threshold": energy_threshold,
+	})
+
 func send_grammar_and_wait(words: Array[String]) -> bool:
 	if words.is_empty():
 		return true
@@ -89,6 +143,13 @@ func _process(_delta: float) -> void:
 		if not _connected:
 			_connected = true
 			_reset_reconnect()
+			if partial_mode != "all" or max_partials_per_second > 0.0:
+				send_partial_policy(partial_mode, max_partials_per_second)
+			if server_vad:
+				send_vad(true, server_vad_energy_threshold)
+			send_ingest_policy(ingest_overflow, ingest_max_queued_ms, ingest_min_chunk_ms)
+			if not _audio_format.is_empty():
+				send_json(_audio_format)
 			connected.emit()
 		_read_packets()
 		return
@@ -144,6 +205,31 @@ func _handle_typed_payload(payload: Dictionary) -> void:
 		grammar_acknowledged.emit(ok)
 		grammar_acknowledged_detail.emit(ok, error_text, grammar_payload)
 		return
+	if payload_type == "error":
+		on_error.emit("Speech service error: %s" % str(payload.get("error", "")))
+		return
+	if payload_type == "vad_ack":
+		if not bool(payload.get("ok", false)):
+			push_warning("Speech service voice gate unavailable: %s" % str(payload.get("error", "")))
+		return
+	if payload_type == "audio_format_ack":
+		var format_ok := bool(payload.get("ok", false))
+		var format_error := str(payload.get("error", ""))
+		if not format_ok:
+			push_warning("Speech service rejected the audio format: %s" % format_error)
+		audio_format_acknowledged.emit(format_ok, format_error)
+		return
+	if payload_type == "ingest_policy_ack":
+		if not bool(payload.get("ok", false)):
+			on_error.emit("Ingest policy rejected: %s" % str(payload.get("error", "")))
+		return
+	if payload_type == "overflow":
+		push_warning("Speech service fell behind; dropped %d bytes of audio so far." % int(payload.get("dropped_bytes", 0)))
+		return
+	if payload_type == "partial_policy_ack":
+		if not bool(payload.get("ok", false)):
+			on_error.emit("Partial policy rejected: %s" % str(payload.get("error", "")))
+		return
 	on_error.emit("Unhandled payload type: %s" % payload_type)
 
 func _extract_result_payload(payload: Dictionary) -> Dictionary:
@@ -1,16 +1,17 @@
 import os
 import sys
-import srt
-import datetime
 import json
+import threading
+import time
 
-import requests
-from urllib.request import urlretrieve
-from zipfile import ZipFile
 from re import match
 from pathlib import Path
 from .vosk_cffi import ffi as _ffi
-from tqdm import tqdm
+
+try:
+    from orjson import loads as _loads
+except ImportError:
+    _loads = json.loads
 
 # Remote location of the models and local folders
 MODEL_PRE_URL = "https://alphacephei.com/vosk/models/"
@@ -18,6 +19,25 @@ MODEL_LIST_URL = MODEL_PRE_URL + "model-list.json"
 MODEL_DIRS = [os.getenv("VOSK_MODEL_PATH"), Path("/usr/share/vosk"),
         Path.home() / "AppData/Local/vosk", Path.home() / ".cache/vosk"]
 
+MODEL_CATALOG_PATH = Path(os.getenv("VOSK_MODEL_CATALOG")
+        or Path.home() / ".cache/vosk/model-catalog.json")
+MODEL_CATALOG_VERSION = 1
+# File sets a complete model has: an HCLG graph, or the HCLr/Gr pair of
+# models built for runtime grammars. Anything less is a partial copy.
+MODEL_LAYOUTS = [
+    ["am/final.mdl", "conf/mfcc.conf", "graph/HCLG.fst"],
+    ["am/final.mdl", "conf/mfcc.conf", "graph/Gr.fst", "graph/HCLr.fst"],
+]
+CHECKSUM_BLOCK_SIZE = 1 << 20
+
+# requests, tqdm, srt and the download helpers are imported where they are
+# used: applications that ship their model never need them, and importing
+# them at load time slowed every start of the bundled speech service.
+
+def _model_list():
+    import requests
+    return requests.get(MODEL_LIST_URL, timeout=10).json()
+
 def open_dll():
     dlldir = os.path.abspath(os.path.dirname(__file__))
     if sys.platform == "win32":
@@ -33,16 +53,17 @@ def open_dll():
     else:
         raise TypeError("Unsupported platform")
 
+_dll_open_start = time.perf_counter()
 _c = open_dll()
+# Reported by the speech service's startup profile.
+dll_open_seconds = time.perf_counter() - _dll_open_start
 
 def list_models():
-    response = requests.get(MODEL_LIST_URL, timeout=10)
-    for model in response.json():
+    for model in _model_list():
         print(model["name"])
 
 def list_languages():
-    response = requests.get(MODEL_LIST_URL, timeout=10)
-    languages = {m["lang"] for m in response.json()}
+    languages = {m["lang"] for m in _model_list()}
     for lang in languages:
         print (lang)
 
@@ -62,56 +83,56 @@ class Model:
     def vosk_model_find_word(self, word):
         return _c.vosk_model_find_word(self._handle, word.encode("utf-8"))
 
-    def get_model_path(self, model_name, lang):
+    @classmethod
+    def get_model_path(cls, model_name, lang):
         if model_name is None:
-            model_path = self.get_model_by_lang(lang)
+            model_path = cls.get_model_by_lang(lang)
         else:
-            model_path = self.get_model_by_name(model_name)
+            model_path = cls.get_model_by_name(model_name)
         return str(model_path)
 
-    def get_model_by_name(self, model_name):
-        for directory in MODEL_DIRS:
-            if directory is None or not Path(directory).exists():
-                continue
-            model_file_list = os.listdir(directory)
-            model_file = [model for model in model_file_list if model == model_name]
-            if model_file != []:
-                return Path(directory, model_file[0])
-        response = requests.get(MODEL_LIST_URL, timeout=10)
-        result_model = [model["name"] for model in response.json() if model["name"] == model_name]
+    @classmethod
+    def get_model_by_name(cls, model_name):
+        model = model_catalog.find(model_name=model_name)
+        if model is not None:
+            return Path(model["path"])
+        # Not on disk: only now ask the model list, and download it.
+        directory = MODEL_DIRS[-1]
+        result_model = [model["name"] for model in _model_list() if model["name"] == model_name]
         if result_model == []:
             print("model name %s does not exist" % (model_name))
             sys.exit(1)
         else:
-            self.download_model(Path(directory, result_model[0]))
+            cls.download_model(Path(directory, result_model[0]))
             return Path(directory, result_model[0])
 
-    def get_model_by_lang(self, lang):
-        for directory in MODEL_DIRS:
-            if directory is None or not Path(directory).exists():
-                continue
-            model_file_list = os.listdir(directory)
-            model_file = [model for model in model_file_list if
-                    match(r"vosk-model(-small)?-{}".format(lang), model)]
-            if model_file != []:
-                return Path(directory, model_file[0])
-        response = requests.get(MODEL_LIST_URL, timeout=10)
-        result_model = [model["name"] for model in response.json() if
+    @classmethod
+    def get_model_by_lang(cls, lang):
+        model = model_catalog.find(lang=lang)
+        if model is not None:
+            return Path(model["path"])
+        directory = MODEL_DIRS[-1]
+        result_model = [model["name"] for model in _model_list() if
                 model["lang"] == lang and model["type"] == "small" and model["obsolete"] == "false"]
         if result_model == []:
             print("lang %s does not exist" % (lang))
             sys.exit(1)
         else:
-            self.download_model(Path(directory, result_model[0]))
+            cls.download_model(Path(directory, result_model[0]))
             return Path(directory, result_model[0])
 
-    def download_model(self, model_name):
+    @classmethod
+    def download_model(cls, model_name):
+        from tqdm import tqdm
+        from urllib.request import urlretrieve
+        from zipfile import ZipFile
+
         if not (model_name.parent).exists():
             (model_name.parent).mkdir(parents=True)
         with tqdm(unit="B", unit_scale=True, unit_divisor=1024, miniters=1,
                 desc=(MODEL_PRE_URL + str(model_name.name) + ".zip").rsplit("/",
                     maxsplit=1)[-1]) as t:
-            reporthook = self.download_progress_hook(t)
+            reporthook = cls.download_progress_hook(t)
             urlretrieve(MODEL_PRE_URL + str(model_name.name) + ".zip",
                     str(model_name) + ".zip", reporthook=reporthook, data=None)
             t.total = t.n
@@ -119,7 +140,8 @@ class Model:
                 model_ref.extractall(model_name.parent)
             Path(str(model_name) + ".zip").unlink()
 
-    def download_progress_hook(self, t):
+    @staticmethod
+    def download_progress_hook(t):
         last_b = [0]
         def update_to(b=1, bsize=1, tsize=None):
             if tsize not in (None, -1):
@@ -129,6 +151,335 @@ class Model:
             return displayed
         return update_to
 
+def _resident_bytes():
+    # Linux only; elsewhere footprints carry the on-disk size alone.
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def _mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def _looks_like_model(path):
+    return path.name.startswith("vosk-model") or (path / "am").is_dir() \
+            or (path / "conf").is_dir()
+
+def _model_lang(name):
+    found = match(r"vosk-model(?:-small)?-(.+?)-\d", name)
+    return found.group(1) if found else None
+
+def _model_files(path):
+    """Relative path -> [size, mtime_ns] for every file in a model directory."""
+    files = {}
+    for f in sorted(Path(path).rglob("*")):
+        if f.is_file():
+            stat = f.stat()
+            files[f.relative_to(path).as_posix()] = [stat.st_size, stat.st_mtime_ns]
+    return files
+
+def _file_sizes(files):
+    return {name: size for name, (size, _) in files.items()}
+
+def _model_checksum(path, files):
+    import hashlib
+
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update(name.encode("utf-8") + b"\0")
+        with open(Path(path, name), "rb") as fh:
+            for block in iter(lambda: fh.read(CHECKSUM_BLOCK_SIZE), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+class ModelCatalog:
+    """Models found in a list of directories, cached on disk so that finding
+    one needs neither directory listings nor the network.
+
+    Each entry records the model's path, name, language, size and its
+    files' sizes and mtimes; cataloguing never reads a model's data. A
+    SHA-256 of the contents is added by the first deep validate() and kept
+    until files are added, removed or change size, or rebuild() records a
+    new one. Files whose mtimes alone changed keep it, so a deep check
+    still tells a copy of the model from a corrupted one. A directory is listed again only when its own
+    mtime changes (a model was added, removed or renamed). The cache file is
+    shared by catalogs over different directories.
+    """
+
+    def __init__(self, roots=None, path=MODEL_CATALOG_PATH):
+        if roots is None:
+            roots = MODEL_DIRS
+        self.roots = list(dict.fromkeys(str(Path(root).expanduser().absolute())
+                for root in roots if root is not None))
+        self.path = None if path is None else Path(path)
+        self._lock = threading.Lock()
+        self._data = None
+
+    def models(self):
+        """Entries for every model in the catalog's directories, in order."""
+        with self._lock:
+            data = self._current()
+            return [data["models"][path] for root in self.roots
+                    for path in data["roots"][root]["models"]]
+
+    def find(self, model_name=None, lang=None):
+        """The first model with this name, or whose name is for this
+        language; None if there is none on disk."""
+        for model in self.models():
+            if model_name is not None and model["name"] == model_name:
+                return model
+            if model_name is None and match(r"vosk-model(-small)?-{}".format(lang), model["name"]):
+                return model
+        return None
+
+    def entry(self, model_path):
+        """The entry for one model directory, inside the catalog's
+        directories or not, brought up to date if its files changed."""
+        path = str(Path(model_path).absolute())
+        with self._lock:
+            data = self._current()
+            entry = self._catalog_model(Path(path), data["models"].get(path))
+            if data["models"].get(path) is not entry:
+                data["models"][path] = entry
+                self._write()
+            return entry
+
+    def validate(self, model_path, deep=False):
+        """Returns what is wrong with a model directory: missing or empty
+        files, an unfinished download and, with deep, contents that no
+        longer match the recorded checksum. An empty list means it looks
+        complete. Only deep reads the model's data; the first deep check of
+        a model, or of one whose file set or sizes changed, records the
+        checksum that later ones compare against."""
+        path = Path(model_path).absolute()
+        if not path.is_dir():
+            return ["%s is not a directory" % path]
+        problems = []
+        if Path(str(path) + ".zip").exists():
+            # download_model() deletes the archive once it is extracted.
+            problems.append("%s.zip is still next to the model: its download "
+                    "or extraction did not finish" % path.name)
+        with self._lock:
+            data = self._current()
+            recorded = data["models"].get(str(path))
+            entry = self._catalog_model(path, recorded)
+            changed = entry is not recorded
+            if deep:
+                checksum = _model_checksum(path, entry["files"])
+                if entry["sha256"] is None:
+                    entry["sha256"] = checksum
+                    changed = True
+                elif checksum != entry["sha256"]:
+                    # Same files and sizes but different bytes: the disk, not
+                    # an update, changed the model (or rebuild() was not run
+                    # after a deliberate change).
+                    problems.append("contents no longer match the checksum "
+                            "recorded for them; the model files are corrupt")
+            if changed:
+                data["models"][str(path)] = entry
+                self._write()
+        # Judge against the layout the model's graph says it has.
+        layout = next((layout for layout in MODEL_LAYOUTS if layout[-1] in entry["files"]),
+                MODEL_LAYOUTS[0])
+        missing = [name for name in layout if entry["files"].get(name, [0])[0] == 0]
+        if missing:
+            problems.append("missing or empty: " + ", ".join(missing))
+        return problems
+
+    def rebuild(self, model_path):
+        """Catalogs a model directory afresh and records the checksum of its
+        current contents, for use after deliberately changing its files.
+        Returns the new entry."""
+        path = Path(model_path).absolute()
+        with self._lock:
+            data = self._current()
+            entry = self._catalog_model(path)
+            entry["sha256"] = _model_checksum(path, entry["files"])
+            data["models"][str(path)] = entry
+            self._write()
+        return entry
+
+    def _current(self):
+        # Called with the lock held.
+        if self._data is None:
+            self._data = self._read()
+        changed = False
+        for root in self.roots:
+            stamp = _mtime_ns(root)
+            listed = self._data["roots"].get(root)
+            if listed is None or listed["mtime_ns"] != stamp:
+                self._data["roots"][root] = {"mtime_ns": stamp, "models": self._scan(root, stamp)}
+                changed = True
+        if changed:
+            self._write()
+        return self._data
+
+    def _scan(self, root, stamp):
+        paths = []
+        if stamp is not None:
+            for child in sorted(Path(root).iterdir()):
+                if child.is_dir() and _looks_like_model(child):
+                    path = str(child)
+                    self._data["models"][path] = self._catalog_model(child,
+                            self._data["models"].get(path))
+                    paths.append(path)
+        return paths
+
+    @staticmethod
+    def _catalog_model(path, recorded=None):
+        files = _model_files(path)
+        if recorded is not None:
+            if recorded["files"] == files:
+                return recorded
+            if _file_sizes(recorded["files"]) == _file_sizes(files):
+                # Only mtimes moved (a copy, a restore, a touch): keep the
+                # checksum, which says what the files should still hold.
+                return dict(recorded, files=files)
+        return {
+            "name": path.name,
+            "path": str(path),
+            "lang": _model_lang(path.name),
+            "size": sum(size for size, _ in files.values()),
+            "files": files,
+            "sha256": None,
+        }
+
+    def _read(self):
+        data = None
+        if self.path is not None:
+            try:
+                with open(self.path, encoding="utf-8") as fh:
+                    data = json.load(fh)
+            except (OSError, ValueError):
+                pass
+        if data is None or data.get("version") != MODEL_CATALOG_VERSION:
+            data = {"version": MODEL_CATALOG_VERSION, "roots": {}, "models": {}}
+        return data
+
+    def _write(self):
+        if self.path is None:
+            return
+        listed = {path for root in self._data["roots"].values() for path in root["models"]}
+        # Models given by path outside any listed directory are kept while
+        # they exist.
+        self._data["models"] = {path: model for path, model in self._data["models"].items()
+                if path in listed or Path(path).is_dir()}
+        tmp = self.path.with_name("%s.%d.part" % (self.path.name, os.getpid()))
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump(self._data, fh, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError:
+            # Without a writable cache the catalog still works; it is just
+            # rebuilt by every process.
+            pass
+
+# Used by Model to find models by name or language.
+model_catalog = ModelCatalog()
+
+class ModelRegistry:
+    """Models shared by everything in one process, keyed by resolved path.
+
+    acquire() hands every caller the same Model and counts references;
+    release() frees it once the last reference is dropped. Recognizers keep
+    their own reference inside libvosk, so releasing a model does not break
+    recognizers created from it.
+    """
+
+    def __init__(self):
+        # _lock guards the entries and is never held across a load, so
+        # footprints() answers at once; _load_lock serializes the loads,
+        # which keeps each model's resident-memory delta free of others.
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._entries = {}
+
+    @staticmethod
+    def resolve(model_path=None, model_name=None, lang=None):
+        if model_path is None:
+            model_path = Model.get_model_path(model_name, lang)
+        return str(Path(model_path).resolve())
+
+    def acquire(self, model_path=None, model_name=None, lang=None):
+        key = self.resolve(model_path, model_name, lang)
+        with self._lock:
+            entry = self._entries.get(key)
+            loader = entry is None
+            if loader:
+                entry = self._entries[key] = {"path": key, "model": None, "refs": 0,
+                        "loading": True, "_loaded": threading.Event(), "_error": None}
+            entry["refs"] += 1
+        if loader:
+            try:
+                with self._load_lock:
+                    loaded = self._load(key)
+            except BaseException as error:
+                with self._lock:
+                    entry["_error"] = error
+                    del self._entries[key]
+                raise
+            else:
+                with self._lock:
+                    entry.update(loaded, loading=False)
+            finally:
+                entry["_loaded"].set()
+        else:
+            # Another caller is loading this model; share its result.
+            entry["_loaded"].wait()
+            if entry["_error"] is not None:
+                raise entry["_error"]
+        return entry["model"]
+
+    def release(self, model):
+        """Drops one reference to a model returned by acquire(). The model
+        must not be used by this caller afterwards."""
+        with self._lock:
+            for key, entry in self._entries.items():
+                if entry["model"] is model and model is not None:
+                    entry["refs"] -= 1
+                    if entry["refs"] == 0:
+                        del self._entries[key]
+                    return
+        raise ValueError("Model was not acquired from this registry")
+
+    def preload(self, model_paths):
+        """Loads each model and holds a reference until release(); returns
+        the models in order."""
+        return [self.acquire(model_path) for model_path in model_paths]
+
+    def footprints(self):
+        """Per-model reference count, load time, on-disk size and, on Linux,
+        the resident memory the process grew by while loading it. Models
+        still loading are listed with loading set and no sizes yet."""
+        with self._lock:
+            return [
+                {key: value for key, value in entry.items()
+                        if key != "model" and not key.startswith("_")}
+                for entry in self._entries.values()
+            ]
+
+    @staticmethod
+    def _load(path):
+        resident = _resident_bytes()
+        start = time.perf_counter()
+        model = Model(path)
+        load_seconds = time.perf_counter() - start
+        after = _resident_bytes()
+        return {
+            "model": model,
+            "load_seconds": round(load_seconds, 3),
+            "resident_bytes": None if resident is None else max(0, after - resident),
+            "disk_bytes": sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file()),
+        }
+
+# Shared by the transcriber and the speech service when they run in one process.
+model_registry = ModelRegistry()
+
 class SpkModel:
 
     def __init__(self, model_path):
@@ -142,7 +493,12 @@ class SpkModel:
 
 class KaldiRecognizer:
 
+    # AcceptWaveform takes any contiguous buffer, not just bytes; callers can
+    # check this before handing over memoryviews or NumPy arrays.
+    accepts_buffers = True
+
     def __init__(self, *args):
+        self._sample_rate = args[1] if len(args) > 1 else 16000
         if len(args) == 2:
             self._handle = _c.vosk_recognizer_new(args[0]._handle, args[1])
         elif len(args) == 3 and isinstance(args[2], SpkModel):
@@ -156,10 +512,18 @@ class KaldiRecognizer:
 
         if self._handle == _ffi.NULL:
             raise Exception("Failed to create a recognizer")
+        self._forget_results()
 
     def __del__(self):
         _c.vosk_recognizer_free(self._handle)
 
+    def _forget_results(self):
+        self._partial_raw = None
+        self._partial_text = None
+        self._partial_dict = None
+        self._result_raw = None
+        self._result_dict = None
+
     def SetMaxAlternatives(self, max_alternatives):
         _c.vosk_recognizer_set_max_alternatives(self._handle, max_alternatives)
 
@@ -179,24 +543,99 @@ class KaldiRecognizer:
         _c.vosk_recognizer_set_grm(self._handle, grammar.encode("utf-8"))
 
     def AcceptWaveform(self, data):
+        """Feeds 16-bit PCM from bytes or any contiguous buffer (bytearray,
+        memoryview, array, NumPy int16 array) without copying it."""
+        if not isinstance(data, bytes):
+            data = _ffi.from_buffer(data)
         res = _c.vosk_recognizer_accept_waveform(self._handle, data, len(data))
         if res < 0:
             raise Exception("Failed to process waveform")
         return res
 
+    def AcceptWaveformFloat(self, data):
+        """Feeds float32 samples from a contiguous buffer, scaled like 16-bit
+        PCM (-32768..32767), not -1..1."""
+        samples = _ffi.from_buffer("float[]", data)
+        res = _c.vosk_recognizer_accept_waveform_f(self._handle, samples, len(samples))
+        if res < 0:
+            raise Exception("Failed to process waveform")
+        return res
+
+    def AcceptWaveformChunks(self, data, chunk_seconds=0.2, float_samples=False):
+        """Feeds a long buffer in one call, chunk by chunk, so the endpointer
+        still sees utterance boundaries. Returns the Result() of every
+        utterance completed along the way; the rest stays pending."""
+        if float_samples:
+            samples = _ffi.from_buffer("float[]", data)
+            accept = _c.vosk_recognizer_accept_waveform_f
+        else:
+            samples = _ffi.from_buffer("short[]", data)
+            accept = _c.vosk_recognizer_accept_waveform_s
+        chunk = max(1, int(self._sample_rate * chunk_seconds))
+        results = []
+        for offset in range(0, len(samples), chunk):
+            res = accept(self._handle, samples + offset, min(chunk, len(samples) - offset))
+            if res < 0:
+                raise Exception("Failed to process waveform")
+            if res:
+                results.append(self.Result())
+        return results
+
     def Result(self):
+        self._partial_raw = None
         return _ffi.string(_c.vosk_recognizer_result(self._handle)).decode("utf-8")
 
     def PartialResult(self):
         return _ffi.string(_c.vosk_recognizer_partial_result(self._handle)).decode("utf-8")
 
     def FinalResult(self):
+        self._partial_raw = None
         return _ffi.string(_c.vosk_recognizer_final_result(self._handle)).decode("utf-8")
 
+    def PartialResultChanged(self):
+        """Returns whether the partial result differs from the one seen by
+        the previous call. Only the raw bytes are compared; nothing is
+        decoded. The first call after a result or Reset() returns True."""
+        raw = _ffi.string(_c.vosk_recognizer_partial_result(self._handle))
+        if raw == self._partial_raw:
+            return False
+        self._partial_raw = raw
+        self._partial_text = None
+        self._partial_dict = None
+        return True
+
+    def LastPartialResult(self):
+        """The partial JSON seen by the last PartialResultChanged() call."""
+        if self._partial_text is None:
+            self._partial_text = self._partial_raw.decode("utf-8")
+        return self._partial_text
+
+    def PartialDict(self):
+        """The current partial result as a dict, parsed only when it changed.
+        The dict is cached; do not modify it."""
+        self.PartialResultChanged()
+        if self._partial_dict is None:
+            self._partial_dict = _loads(self._partial_raw)
+        return self._partial_dict
+
+    def ResultDict(self):
+        """Result() as a dict, parsed once per distinct result. The dict is
+        cached; do not modify it."""
+        self._partial_raw = None
+        raw = _ffi.string(_c.vosk_recognizer_result(self._handle))
+        if raw != self._result_raw:
+            self._result_raw = raw
+            self._result_dict = _loads(raw)
+        return self._result_dict
+
     def Reset(self):
+        self._forget_results()
         return _c.vosk_recognizer_reset(self._handle)
 
     def SrtResult(self, stream, words_per_line = 7):
+        import datetime
+        import srt
+
         results = []
 
         while True:
@@ -6,7 +6,8 @@ import sys
 import os
 
 from pathlib import Path
-from vosk import list_models, list_languages
+from vosk import list_models, list_languages, model_registry
+from vosk.transcriber.manifest import MANIFEST_NAME, Manifest
 from vosk.transcriber.transcriber import Transcriber
 
 parser = argparse.ArgumentParser(
@@ -15,8 +16,17 @@ parser.add_argument(
         "--model", "-m", type=str,
         help="model path")
 parser.add_argument(
-        "--server", "-s", const="ws://localhost:2700", action="store_const",
-        help="use server for recognition")
+        "--server", "-s", nargs="?", const="ws://localhost:2700",
+        help="use server for recognition, at this URL (default: ws://localhost:2700)")
+parser.add_argument(
+        "--server-protocol", default="vosk", choices=["vosk", "kanaloop"],
+        help="protocol of the server: upstream vosk-server or KanaLoop's vosk_service.py")
+parser.add_argument(
+        "--window", default=8, type=int,
+        help="audio chunks sent to the server ahead of its replies")
+parser.add_argument(
+        "--grammar", type=str,
+        help="comma-separated grammar sent to a kanaloop server before each file")
 parser.add_argument(
         "--list-models", default=False, action="store_true",
         help="list available models")
@@ -41,10 +51,46 @@ parser.add_argument(
 parser.add_argument(
         "--tasks", "-ts", default=10, type=int,
         help="number of parallel recognition tasks")
+parser.add_argument(
+        "--processes", "-p", default=0, type=int,
+        help="decode in this many worker processes, each loading the model once "
+        "(default: threads in one process)")
+parser.add_argument(
+        "--segment-seconds", default=60.0, type=float,
+        help="with --processes, split long files at silences into segments "
+        "of about this length and decode them in parallel (0: whole files)")
+parser.add_argument(
+        "--recursive", "-r", default=False, action="store_true",
+        help="transcribe a directory tree, mirroring it under the output directory")
+parser.add_argument(
+        "--manifest", type=str,
+        help="manifest of finished files, used to skip unchanged inputs when "
+        "transcribing a directory; --recursive keeps one by default in "
+        "%s in the output directory" % MANIFEST_NAME)
+parser.add_argument(
+        "--hash", default=False, action="store_true",
+        help="also record content hashes, so inputs whose mtime changed but "
+        "content did not are skipped")
+parser.add_argument(
+        "--force", default=False, action="store_true",
+        help="transcribe every input, even those the manifest lists as done")
 parser.add_argument(
         "--log-level", default="INFO",
         help="logging level")
 
+def is_excluded(path, args):
+    """Whether a file found by --recursive is not an input: anything under a
+    hidden directory or hidden itself (the manifest among them), a .part
+    file, or anything in an output directory nested in the input tree."""
+    if any(part.startswith(".") for part in path.relative_to(args.input).parts):
+        return True
+    if path.name.endswith(".part"):
+        return True
+    input_dir = Path(args.input).resolve()
+    output_dir = Path(args.output).resolve()
+    return (output_dir != input_dir and input_dir in output_dir.parents
+            and output_dir in path.resolve().parents)
+
 def main():
 
     args = parser.parse_args()
@@ -68,12 +114,16 @@ def main():
             "please specify an existing file/directory")
         sys.exit(1)
 
-    transcriber = Transcriber(args)
-
-    if Path(args.input).is_dir():
+    manifest = None
+    if Path(args.input).is_dir() and args.recursive:
+        task_list = [(fn, Path(args.output, fn.relative_to(args.input)).with_suffix(
+            "." + args.output_type)) for fn in sorted(Path(args.input).rglob("*"))
+            if fn.is_file() and not is_excluded(fn, args)]
+    elif Path(args.input).is_dir():
         task_list = [(Path(args.input, fn),
             Path(args.output,
-            Path(fn).stem).with_suffix("." + args.output_type)) for fn in os.listdir(args.input)]
+            Path(fn).stem).with_suffix("." + args.output_type)) for fn in os.listdir(args.input)
+            if Path(args.input, fn).is_file() and not fn.startswith(".")]
     elif Path(args.input).is_file():
         if args.output == "":
             task_list = [(Path(args.input), args.output)]
@@ -83,7 +133,27 @@ def main():
         logging.info("Wrong arguments")
         sys.exit(1)
 
-    transcriber.process_task_list(task_list)
+    if Path(args.input).is_dir() and (args.recursive or args.manifest):
+        # The model is named in the manifest by its directory name, which
+        # carries its version; a server is named by its URL.
+        model = args.server or Path(model_registry.resolve(model_path=args.model,
+                model_name=args.model_name, lang=args.lang)).name
+        manifest = Manifest(args.manifest or Path(args.output, MANIFEST_NAME),
+                args.input, model, args.output_type, use_hash=args.hash)
+        if not args.force:
+            total = len(task_list)
+            task_list = manifest.pending(task_list)
+            logging.info("{} of {} files are new or changed".format(len(task_list), total))
+        if not task_list:
+            return
+
+    transcriber = Transcriber(args, manifest)
+    try:
+        transcriber.process_task_list(task_list)
+    finally:
+        transcriber.close()
+        if manifest is not None:
+            manifest.close()
 
 if __name__ == "__main__":
     main()
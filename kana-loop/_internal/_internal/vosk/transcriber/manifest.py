@@ -0,0 +1,111 @@
+"""Remembers which inputs a batch run has already transcribed.
+
+The manifest is a JSON Lines log next to the outputs. A line is appended,
+and flushed to disk, as soon as each output has been written, so a run that
+is interrupted resumes where it stopped. Entries are keyed by the input's
+path relative to the input directory and record its size and mtime (plus a
+SHA-256 with use_hash), the model and the output type. An input is skipped
+while all of those still match and its output exists. The log is compacted
+to one line per input at the end of each run.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from pathlib import Path
+
+MANIFEST_NAME = ".transcriber-manifest.jsonl"
+HASH_BLOCK_SIZE = 1 << 20
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def write_atomic(path, text):
+    """Writes text to path so that readers see either the old file or the
+    complete new one, never a partial write."""
+    path = Path(path)
+    tmp = path.with_name(path.name + ".part")
+    with open(tmp, "w", encoding="utf-8") as fh:
+        fh.write(text)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+
+class Manifest:
+
+    def __init__(self, path, input_root, model, output_type, use_hash=False):
+        self.path = Path(path)
+        self.input_root = Path(input_root)
+        self.model = model
+        self.output_type = output_type
+        self.use_hash = use_hash
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._log = None
+        if self.path.exists():
+            with open(self.path, encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by an interrupted run.
+                        continue
+                    self.entries[entry["input"]] = entry
+
+    def key(self, input_file):
+        return Path(input_file).relative_to(self.input_root).as_posix()
+
+    def is_current(self, input_file, output_file):
+        entry = self.entries.get(self.key(input_file))
+        if entry is None or entry["model"] != self.model \
+                or entry["output_type"] != self.output_type \
+                or not Path(output_file).exists():
+            return False
+        stat = os.stat(input_file)
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry["mtime_ns"]:
+            return True
+        # Touched but maybe not changed: with hashes, compare the content.
+        return self.use_hash and entry.get("sha256") == file_sha256(input_file)
+
+    def pending(self, task_list):
+        """The tasks whose inputs are new or changed since their last run."""
+        return [task for task in task_list if not self.is_current(*task)]
+
+    def record(self, input_file, output_file):
+        stat = os.stat(input_file)
+        entry = {
+            "input": self.key(input_file),
+            "output": str(output_file),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "model": self.model,
+            "output_type": self.output_type,
+        }
+        if self.use_hash:
+            entry["sha256"] = file_sha256(input_file)
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.entries[entry["input"]] = entry
+            if self._log is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._log = open(self.path, "a", encoding="utf-8")
+            self._log.write(line)
+            self._log.flush()
+            os.fsync(self._log.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._log is None:
+                return
+            self._log.close()
+            self._log = None
+            write_atomic(self.path, "".join(json.dumps(entry, ensure_ascii=False) + "\n"
+                    for entry in self.entries.values()))
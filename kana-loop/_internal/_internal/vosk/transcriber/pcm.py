@@ -0,0 +1,196 @@
+"""Reads WAV and raw PCM files without ffmpeg.
+
+16 kHz mono 16-bit WAV, which is what KanaLoop records, and headerless .raw
+/ .pcm files (assumed to be in that format) are memory-mapped and handed to
+the recognizer without a copy. Other PCM WAVs (8/16/24/32-bit integer or
+32-bit float, any rate and channel count) are converted in Python, with
+NumPy when it is installed and the standard library's audioop otherwise.
+"""
+
+import mmap
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import audioop
+except ImportError:
+    audioop = None
+
+SAMPLE_RATE = 16000
+RAW_SUFFIXES = (".raw", ".pcm")
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Converted audio is resampled this many output seconds at a time, so long
+# files never need more than a block of float samples in memory.
+BLOCK_SECONDS = 10
+# Zero crossings on each side of the anti-aliasing filter used when
+# downsampling.
+FILTER_ZERO_CROSSINGS = 8
+
+class WavFormat:
+
+    def __init__(self, format_tag, channels, sample_rate, bits, data_offset, data_size):
+        self.format_tag = format_tag
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.bits = bits
+        self.data_offset = data_offset
+        self.data_size = data_size
+
+    @property
+    def native(self):
+        return (self.format_tag == WAVE_FORMAT_PCM and self.channels == 1
+                and self.sample_rate == SAMPLE_RATE and self.bits == 16)
+
+def parse_wav_header(buffer):
+    """Returns the WavFormat of a RIFF/WAVE file held in buffer, or None if
+    it is not a WAV file this module can read. Only chunk headers and the
+    fmt chunk are read."""
+    if len(buffer) < 12 or buffer[:4] != b"RIFF" or buffer[8:12] != b"WAVE":
+        return None
+    offset = 12
+    fmt = None
+    while offset + 8 <= len(buffer):
+        chunk_id, chunk_size = struct.unpack_from("<4sI", buffer, offset)
+        body = offset + 8
+        if chunk_id == b"fmt " and chunk_size >= 16:
+            fmt = struct.unpack_from("<HHIIHH", buffer, body)
+            if fmt[0] == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 26:
+                # The real format tag leads the sub-format GUID.
+                fmt = (struct.unpack_from("<H", buffer, body + 24)[0],) + fmt[1:]
+        elif chunk_id == b"data":
+            if fmt is None:
+                return None
+            format_tag, channels, sample_rate, _, _, bits = fmt
+            if format_tag not in (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT) or channels < 1:
+                return None
+            # Recorders that were cut off leave the size at 0 or 0xFFFFFFFF;
+            # the data then runs to the end of the file.
+            data_size = len(buffer) - body
+            if 0 < chunk_size < data_size:
+                data_size = chunk_size
+            frame_size = channels * bits // 8
+            if frame_size == 0:
+                return None
+            return WavFormat(format_tag, channels, sample_rate, bits, body,
+                    data_size - data_size % frame_size)
+        offset = body + chunk_size + chunk_size % 2
+    return None
+
+def _map(path):
+    with open(path, "rb") as fh:
+        return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+def open_pcm(path, convert=True):
+    """Returns 16 kHz mono 16-bit PCM for path as a buffer, or None if the
+    file needs ffmpeg. Native files come back as a memoryview of the mapped
+    file; other WAVs are converted by convert_pcm() if convert is set,
+    which raises ValueError for sample formats it cannot decode."""
+    path = str(path)
+    try:
+        mapped = _map(path)
+    except (OSError, ValueError):
+        # Missing, unreadable or empty files are left to ffmpeg to report.
+        return None
+    if path.lower().endswith(RAW_SUFFIXES):
+        return memoryview(mapped)[:len(mapped) - len(mapped) % 2]
+    wav = parse_wav_header(mapped)
+    if wav is None or not (wav.native or convert):
+        mapped.close()
+        return None
+    data = memoryview(mapped)[wav.data_offset:wav.data_offset + wav.data_size]
+    if wav.native:
+        return data
+    try:
+        return convert_pcm(data, wav)
+    finally:
+        data.release()
+        mapped.close()
+
+def convert_pcm(data, wav):
+    """Converts WAV samples to 16 kHz mono 16-bit PCM bytes, or returns None
+    when neither NumPy nor audioop can handle the format."""
+    # Checked up front, so no view of the samples is left alive when the
+    # caller unmaps the file.
+    _sample_width(wav)
+    if np is not None:
+        return _convert_numpy(data, wav)
+    if audioop is not None and wav.format_tag == WAVE_FORMAT_PCM and wav.channels <= 2:
+        return _convert_audioop(bytes(data), wav)
+    return None
+
+def _sample_width(wav):
+    """Bytes per sample, or ValueError for a sample format this module does
+    not decode (e.g. 12- or 20-bit PCM, or 16-bit float)."""
+    widths = (4, 8) if wav.format_tag == WAVE_FORMAT_IEEE_FLOAT else (1, 2, 3, 4)
+    if wav.bits % 8 or wav.bits // 8 not in widths:
+        kind = "float" if wav.format_tag == WAVE_FORMAT_IEEE_FLOAT else "PCM"
+        raise ValueError("unsupported WAV sample format: {}-bit {}".format(wav.bits, kind))
+    return wav.bits // 8
+
+def _convert_audioop(data, wav):
+    width = _sample_width(wav)
+    if width == 1:
+        # 8-bit WAV is unsigned.
+        data = audioop.bias(data, 1, -128)
+    if width != 2:
+        data = audioop.lin2lin(data, width, 2)
+    if wav.channels == 2:
+        data = audioop.tomono(data, 2, 0.5, 0.5)
+    if wav.sample_rate != SAMPLE_RATE:
+        data = audioop.ratecv(data, 2, 1, wav.sample_rate, SAMPLE_RATE, None)[0]
+    return data
+
+def _to_float_mono(data, wav):
+    """Decodes whole frames of WAV samples to float32 mono at int16 scale;
+    raises ValueError for sample widths it cannot decode."""
+    width = _sample_width(wav)
+    if wav.format_tag == WAVE_FORMAT_IEEE_FLOAT:
+        dtype = {4: "<f4", 8: "<f8"}[width]
+        samples = np.frombuffer(data, dtype).astype(np.float32) * 32768.0
+    elif width == 3:
+        raw = np.frombuffer(data, np.uint8).reshape(-1, 3).astype(np.int32)
+        samples = ((raw[:, 0] << 8 | raw[:, 1] << 16 | raw[:, 2] << 24) >> 16).astype(np.float32)
+    elif width == 1:
+        samples = (np.frombuffer(data, np.uint8).astype(np.float32) - 128.0) * 256.0
+    else:
+        dtype = {2: "<i2", 4: "<i4"}[width]
+        samples = np.frombuffer(data, dtype).astype(np.float32) / (1 << (wav.bits - 16))
+    if wav.channels > 1:
+        samples = samples.reshape(-1, wav.channels).mean(axis=1)
+    return samples
+
+def _lowpass_taps(rate):
+    # Windowed sinc with its cutoff just under the output Nyquist frequency.
+    half = int(FILTER_ZERO_CROSSINGS * rate / SAMPLE_RATE)
+    cutoff = 0.45 * SAMPLE_RATE / rate
+    n = np.arange(-half, half + 1)
+    return (2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(len(n))).astype(np.float32)
+
+def _convert_numpy(data, wav):
+    frame_size = wav.channels * wav.bits // 8
+    frames = len(data) // frame_size
+    rate = wav.sample_rate
+    out_frames = frames * SAMPLE_RATE // rate
+    taps = _lowpass_taps(rate) if rate > SAMPLE_RATE else None
+    margin = len(taps) // 2 + 1 if taps is not None else 1
+    out = np.empty(out_frames, np.int16)
+    block = BLOCK_SECONDS * SAMPLE_RATE
+    for start in range(0, out_frames, block):
+        positions = np.arange(start, min(start + block, out_frames)) * (rate / SAMPLE_RATE)
+        # Input frames covering the block plus the filter's reach on each side.
+        lo = max(0, int(positions[0]) - margin)
+        hi = min(frames, int(positions[-1]) + margin + 1)
+        samples = _to_float_mono(data[lo * frame_size:hi * frame_size], wav)
+        if taps is not None:
+            samples = np.convolve(samples, taps, mode="same")
+        samples = np.interp(positions - lo, np.arange(len(samples)), samples)
+        out[start:start + len(positions)] = np.clip(np.rint(samples), -32768, 32767)
+    return out.tobytes()
@@ -2,114 +2,260 @@ import json
 import logging
 import asyncio
 import websockets
-import srt
-import datetime
 import shlex
 import subprocess
-
-from vosk import KaldiRecognizer, Model
+import multiprocessing
+import shutil
+
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import shared_memory
+from operator import mul
+from vosk import KaldiRecognizer, model_registry
+from vosk.transcriber.pcm import open_pcm
+from vosk.transcriber.writers import open_writer
 from queue import Queue
 from timeit import default_timer as timer
 from multiprocessing.dummy import Pool
 
 CHUNK_SIZE = 4000
 SAMPLE_RATE = 16000.0
+# Long files are cut at the quietest 100 ms window within this many seconds
+# of each segment boundary.
+SILENCE_SEARCH_SECONDS = 5.0
+SILENCE_WINDOW_SECONDS = 0.1
+
+# Model of a process-pool worker, loaded once by _init_process_worker.
+_WORKER_MODEL = None
+
+def silence_split_points(pcm, segment_seconds):
+    """Byte offsets at which to cut 16-bit PCM into segments of about
+    segment_seconds, each placed at the quietest window near the boundary
+    so words are not split. Only the samples around each boundary are read."""
+    total = len(pcm) // 2
+    rate = int(SAMPLE_RATE)
+    segment = int(segment_seconds * rate)
+    search = int(SILENCE_SEARCH_SECONDS * rate)
+    window = int(SILENCE_WINDOW_SECONDS * rate)
+    points = []
+    last = 0
+    # A trailing piece shorter than half a segment stays with the one before.
+    target = segment
+    while segment > 0 and target + segment // 2 < total:
+        start = max(last + window, target - search)
+        end = min(total - window, target + search)
+        samples = array("h")
+        samples.frombytes(pcm[start * 2:(end + window) * 2])
+        quietest = min(range(0, end - start, window),
+                key=lambda i: _energy(samples[i:i + window]), default=target - start) + start
+        last = quietest + window // 2
+        points.append(last * 2)
+        target = last + segment
+    return points
+
+def buffer_chunks(pcm):
+    # Slices of a memoryview: the mapped file goes to the recognizer uncopied.
+    pcm = memoryview(pcm)
+    return (pcm[i:i + CHUNK_SIZE] for i in range(0, len(pcm), CHUNK_SIZE))
+
+def pipe_chunks(pipe):
+    return iter(partial(pipe.read, CHUNK_SIZE), b"")
+
+async def buffer_chunks_async(pcm):
+    for chunk in buffer_chunks(pcm):
+        yield chunk
+
+async def pipe_chunks_async(pipe):
+    while True:
+        data = await pipe.read(CHUNK_SIZE)
+        if len(data) == 0:
+            break
+        yield data
+
+class VoskServerProtocol:
+    """Upstream vosk-server: a config message, audio, then eof. The server
+    answers every message, so each reply frees a slot in the send window."""
+
+    replies_per_chunk = True
+    closing = '{"eof" : 1}'
+
+    def opening(self):
+        return ['{ "config" : { "sample_rate" : %f } }' % (SAMPLE_RATE)]
+
+    def result(self, message):
+        jres = json.loads(message)
+        return None if "partial" in jres else jres
+
+class KanaLoopProtocol:
+    """KanaLoop's vosk_service.py: an optional set_grammar, audio, then eof,
+    after which the service sends the final result and closes. Partials are
+    turned off, so nothing is sent per chunk and the window is the socket's
+    write buffer instead; the service pushes back through the socket once
+    its ingest queue is full, which the block overflow policy guarantees."""
+
+    replies_per_chunk = False
+    closing = '{"type": "eof"}'
+
+    def __init__(self, grammar=None):
+        self.grammar = grammar
+
+    def opening(self):
+        messages = [json.dumps({"type": "partial_policy", "mode": "off"}),
+                json.dumps({"type": "ingest_policy", "overflow": "block"})]
+        if self.grammar:
+            messages.append(json.dumps({"type": "set_grammar", "grammar": self.grammar},
+                    ensure_ascii=False))
+        return messages
+
+    def result(self, message):
+        if isinstance(message, bytes):
+            return None
+        msg = json.loads(message)
+        if msg.get("type") == "error" or msg.get("ok") is False:
+            logging.warning(msg)
+        if msg.get("type") == "final":
+            return msg["result"]
+        return None
+
+SERVER_PROTOCOLS = {"vosk": VoskServerProtocol, "kanaloop": KanaLoopProtocol}
+
+def _energy(samples):
+    return sum(map(mul, samples, samples))
+
+def _init_process_worker(model_path):
+    global _WORKER_MODEL
+    _WORKER_MODEL = model_registry.acquire(model_path)
+
+def _decode_segment(task):
+    """Decodes bytes start:end of a file's audio in a pool worker; returns
+    the results, with word times shifted to the position of the segment in
+    the file, and the decode time. The audio is the mapped file itself when
+    shared_name is None, else the shared memory block holding it."""
+    path, shared_name, start, end = task
+    start_time = timer()
+    shared = None
+    if shared_name is None:
+        pcm = open_pcm(path, convert=False)
+    else:
+        shared = shared_memory.SharedMemory(name=shared_name)
+        pcm = shared.buf
+    segment = pcm[start:end]
+    try:
+        rec = KaldiRecognizer(_WORKER_MODEL, SAMPLE_RATE)
+        rec.SetWords(True)
+        raw_results = rec.AcceptWaveformChunks(segment, CHUNK_SIZE / 2 / SAMPLE_RATE)
+        raw_results.append(rec.FinalResult())
+    finally:
+        segment.release()
+        if shared is not None:
+            shared.close()
+    offset_seconds = start / 2 / SAMPLE_RATE
+    results = [json.loads(raw) for raw in raw_results]
+    for res in results:
+        for word in res.get("result", []):
+            word["start"] += offset_seconds
+            word["end"] += offset_seconds
+    return results, timer() - start_time
 
 class Transcriber:
 
-    def __init__(self, args):
-        self.model = Model(model_path=args.model, model_name=args.model_name, lang=args.lang)
+    def __init__(self, args, manifest=None):
+        self.model_path = model_registry.resolve(model_path=args.model,
+                model_name=args.model_name, lang=args.lang)
+        # Shared with any other Transcriber or service using the same model.
+        # Process-pool workers load their own copy instead.
+        self.model = None
+        if args.processes == 0 and args.server is None:
+            self.model = model_registry.acquire(self.model_path)
         self.args = args
+        self.manifest = manifest
         self.queue = Queue()
+        # Without ffmpeg, WAVs that are not 16 kHz mono s16 are converted in
+        # Python; with it, ffmpeg's resampler is preferred for them.
+        self.have_ffmpeg = shutil.which("ffmpeg") is not None
 
-    def recognize_stream(self, rec, stream):
-        tot_samples = 0
-        result = []
-
-        while True:
-            data = stream.stdout.read(CHUNK_SIZE)
+    def close(self):
+        if self.model is not None:
+            model_registry.release(self.model)
+            self.model = None
 
-            if len(data) == 0:
-                break
+    def recognize_stream(self, rec, chunks, writer):
+        tot_samples = 0
 
+        for data in chunks:
             tot_samples += len(data)
             if rec.AcceptWaveform(data):
-                jres = json.loads(rec.Result())
+                jres = rec.ResultDict()
                 logging.info(jres)
-                result.append(jres)
-            else:
-                jres = json.loads(rec.PartialResult())
+                writer.write(jres)
+            elif rec.PartialResultChanged():
+                # Unchanged partials are neither decoded nor logged again.
+                jres = rec.PartialDict()
                 if jres["partial"] != "":
                     logging.info(jres)
 
         jres = json.loads(rec.FinalResult())
-        result.append(jres)
+        writer.write(jres)
 
-        return result, tot_samples
+        return tot_samples
 
-    async def recognize_stream_server(self, proc):
-        async with websockets.connect(self.args.server) as websocket:
-            tot_samples = 0
-            result = []
+    def server_protocol(self):
+        if self.args.server_protocol == "kanaloop":
+            grammar = [word for word in (self.args.grammar or "").split(",") if word]
+            return KanaLoopProtocol(grammar)
+        return VoskServerProtocol()
 
-            await websocket.send('{ "config" : { "sample_rate" : %f } }' % (SAMPLE_RATE))
-            while True:
-                data = await proc.stdout.read(CHUNK_SIZE)
-                tot_samples += len(data)
-                if len(data) == 0:
+    async def receive_server_results(self, websocket, protocol, window, progress, writer):
+        try:
+            async for message in websocket:
+                progress["received"] += 1
+                if protocol.replies_per_chunk:
+                    window.release()
+                jres = protocol.result(message)
+                if jres is not None:
+                    logging.info(jres)
+                    writer.write(jres)
+                if progress["received"] == progress["expected"]:
                     break
-                await websocket.send(data)
-                jres = json.loads(await websocket.recv())
-                logging.info(jres)
-                if not "partial" in jres:
-                    result.append(jres)
-            await websocket.send('{"eof" : 1}')
-            jres = json.loads(await websocket.recv())
-            logging.info(jres)
-            result.append(jres)
-
-            return result, tot_samples
-
-
-    def format_result(self, result, words_per_line=7):
-        processed_result = ""
-        if self.args.output_type == "srt":
-            subs = []
+        finally:
+            # If the server went away, wake the sender so its next send
+            # raises instead of waiting for replies that will not come.
+            for _ in range(self.args.window):
+                window.release()
+
+    async def recognize_stream_server(self, chunks, writer):
+        """Streams chunks to the server while a separate task collects the
+        results, with at most --window chunks awaiting a reply."""
+        protocol = self.server_protocol()
+        async with websockets.connect(self.args.server,
+                write_limit=self.args.window * CHUNK_SIZE) as websocket:
+            tot_samples = 0
+            window = asyncio.Semaphore(self.args.window)
+            progress = {"received": 0, "expected": None}
 
-            for _, res in enumerate(result):
-                if not "result" in res:
-                    continue
-                words = res["result"]
-
-                for j in range(0, len(words), words_per_line):
-                    line = words[j : j + words_per_line]
-                    s = srt.Subtitle(index=len(subs),
-                            content = " ".join([l["word"] for l in line]),
-                            start=datetime.timedelta(seconds=line[0]["start"]),
-                            end=datetime.timedelta(seconds=line[-1]["end"]))
-                    subs.append(s)
-            processed_result = srt.compose(subs)
-
-        elif self.args.output_type == "txt":
-            for part in result:
-                if part["text"] != "":
-                    processed_result += part["text"] + "\n"
-
-        elif self.args.output_type == "json":
-            monologues = {"schemaVersion":"2.0", "monologues":[], "text":[]}
-            for part in result:
-                if part["text"] != "":
-                    monologue["text"] += part["text"]
-            for _, res in enumerate(result):
-                if not "result" in res:
-                    continue
-                monologue = { "speaker": {"id": "unknown", "name": None}, "start": 0, "end": 0, "terms": []}
-                monologue["start"] = res["result"][0]["start"]
-                monologue["end"] = res["result"][-1]["end"]
-                monologue["terms"] = [{"confidence": t["conf"], "start": t["start"], "end": t["end"], "text": t["word"], "type": "WORD" } for t in res["result"]]
-                monologues["monologues"].append(monologue)
-            processed_result = json.dumps(monologues)
-        return processed_result
+            for message in protocol.opening():
+                await websocket.send(message)
+            receiver = asyncio.create_task(self.receive_server_results(
+                    websocket, protocol, window, progress, writer))
+            try:
+                sent = 0
+                async for data in chunks:
+                    if protocol.replies_per_chunk:
+                        await window.acquire()
+                    tot_samples += len(data)
+                    await websocket.send(data)
+                    sent += 1
+                if protocol.replies_per_chunk:
+                    # One reply per chunk plus the one to eof.
+                    progress["expected"] = sent + 1
+                await websocket.send(protocol.closing)
+                await receiver
+            finally:
+                receiver.cancel()
+
+            return tot_samples
 
     def resample_ffmpeg(self, infile):
         cmd = shlex.split("ffmpeg -nostdin -loglevel quiet "
@@ -131,18 +277,19 @@ class Transcriber:
 
             logging.info("Recognizing {}".format(input_file))
             start_time = timer()
-            proc = await self.resample_ffmpeg_async(input_file)
-            result, tot_samples = await self.recognize_stream_server(proc)
-
-            processed_result = self.format_result(result)
-            if output_file != "":
-                logging.info("File {} processing complete".format(output_file))
-                with open(output_file, "w", encoding="utf-8") as fh:
-                    fh.write(processed_result)
+            proc = None
+            pcm = self.open_pcm(input_file)
+            if pcm is not None:
+                chunks = buffer_chunks_async(pcm)
             else:
-                print(processed_result)
+                proc = await self.resample_ffmpeg_async(input_file)
+                chunks = pipe_chunks_async(proc.stdout)
+            with self.open_writer(output_file) as writer:
+                tot_samples = await self.recognize_stream_server(chunks, writer)
+            self.output_done(input_file, output_file)
 
-            await proc.wait()
+            if proc is not None:
+                await proc.wait()
 
             elapsed = timer() - start_time
             logging.info("Execution time: {:.3f} sec; "\
@@ -153,26 +300,32 @@ class Transcriber:
         logging.info("Recognizing {}".format(inputdata[0]))
         start_time = timer()
 
+        stream = None
         try:
-            stream = self.resample_ffmpeg(inputdata[0])
-        except FileNotFoundError as e:
-            print(e, "Missing FFMPEG, please install and try again")
-            return
-        except Exception as e:
-            logging.info(e)
+            pcm = self.open_pcm(inputdata[0])
+        except ValueError as e:
+            logging.error("Failed to read {}: {}".format(inputdata[0], e))
             return
+        if pcm is not None:
+            chunks = buffer_chunks(pcm)
+        else:
+            try:
+                stream = self.resample_ffmpeg(inputdata[0])
+            except FileNotFoundError as e:
+                print(e, "Missing FFMPEG, please install and try again")
+                return
+            except Exception as e:
+                logging.info(e)
+                return
+            chunks = pipe_chunks(stream.stdout)
 
         rec = KaldiRecognizer(self.model, SAMPLE_RATE)
         rec.SetWords(True)
-        result, tot_samples = self.recognize_stream(rec, stream)
-        processed_result = self.format_result(result)
-
-        if inputdata[1] != "":
-            logging.info("File {} processing complete".format(inputdata[1]))
-            with open(inputdata[1], "w", encoding="utf-8") as fh:
-                fh.write(processed_result)
-        else:
-            print(processed_result)
+        with self.open_writer(inputdata[1]) as writer:
+            tot_samples = self.recognize_stream(rec, chunks, writer)
+        if stream is not None:
+            stream.wait()
+        self.output_done(inputdata[0], inputdata[1])
 
         elapsed = timer() - start_time
         logging.info("Execution time: {:.3f} sec; "\
@@ -188,8 +341,126 @@ class Transcriber:
         with Pool() as pool:
             pool.map(self.pool_worker, task_list)
 
+    def open_pcm(self, infile):
+        """16 kHz mono s16 audio of infile read without ffmpeg, or None."""
+        return open_pcm(infile, convert=not self.have_ffmpeg)
+
+    def read_pcm(self, infile):
+        pcm = self.open_pcm(infile)
+        if pcm is not None:
+            return pcm
+        stream = self.resample_ffmpeg(infile)
+        pcm = stream.stdout.read()
+        stream.wait()
+        return pcm
+
+    def open_writer(self, output_file):
+        """Streams results to output_file, or standard output for "". The
+        file appears under its name only once the writer has committed."""
+        return open_writer(self.args.output_type, output_file)
+
+    def output_done(self, input_file, output_file):
+        if output_file != "":
+            logging.info("File {} processing complete".format(output_file))
+            if self.manifest is not None:
+                self.manifest.record(input_file, output_file)
+
+    def submit_file(self, pool, input_file):
+        """Splits one file into segments for the pool. Workers get segment
+        bounds, not audio: a file read without conversion is mapped by each
+        worker, anything else is shared once through a shared memory block,
+        which is returned for finish_file to free."""
+        pcm = self.read_pcm(input_file)
+        bounds = [0] + silence_split_points(pcm, self.args.segment_seconds) + [len(pcm)]
+        logging.info("Recognizing {} in {} segments".format(input_file, len(bounds) - 1))
+        shared = None
+        if not isinstance(pcm, memoryview):
+            # Converted or from ffmpeg, so only this process has it.
+            shared = shared_memory.SharedMemory(create=True, size=max(len(pcm), 1))
+            shared.buf[:len(pcm)] = pcm
+        try:
+            name = None if shared is None else shared.name
+            futures = [pool.submit(_decode_segment, (str(input_file), name, a, b))
+                    for a, b in zip(bounds, bounds[1:])]
+        except Exception:
+            if shared is not None:
+                shared.close()
+                shared.unlink()
+            raise
+        return futures, len(pcm) / 2 / SAMPLE_RATE, shared
+
+    def finish_file(self, input_file, output_file, futures, audio_seconds, shared, submitted):
+        """Stitches the segments of one file back together in order, writing
+        each as soon as it and those before it are decoded. Returns the audio
+        and summed decode seconds; a file that fails is logged, its partial
+        output removed, and counted as (0, 0)."""
+        decode_seconds = 0.0
+        writer = self.open_writer(output_file)
+        try:
+            with writer:
+                for future in futures:
+                    segment_result, segment_seconds = future.result()
+                    for jres in segment_result:
+                        writer.write(jres)
+                    decode_seconds += segment_seconds
+        except Exception as e:
+            for future in futures:
+                future.cancel()
+            if writer.part is not None:
+                writer.part.unlink(missing_ok=True)
+            logging.error("Failed to recognize {}: {}".format(input_file, e))
+            return 0.0, 0.0
+        finally:
+            if shared is not None:
+                # Only the name goes; a segment still running keeps its
+                # own mapping until it is done.
+                shared.close()
+                shared.unlink()
+        self.output_done(input_file, output_file)
+        elapsed = timer() - submitted
+        logging.info("Execution time: {:.3f} sec; xRT {:.3f}; decode xRT {:.3f}".format(
+                elapsed, elapsed / max(audio_seconds, 1e-9),
+                decode_seconds / max(audio_seconds, 1e-9)))
+        return audio_seconds, decode_seconds
+
+    def process_task_list_processes(self, task_list):
+        start_time = timer()
+        pending = deque()
+        tot_audio = tot_decode = 0.0
+        with ProcessPoolExecutor(max_workers=self.args.processes,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_process_worker, initargs=(self.model_path,)) as pool:
+            for input_file, output_file in task_list:
+                # As in the thread pool: skip a file that fails, keep the rest.
+                try:
+                    futures, audio_seconds, shared = self.submit_file(pool, input_file)
+                except FileNotFoundError as e:
+                    print(e, "Missing FFMPEG, please install and try again")
+                    continue
+                except Exception as e:
+                    logging.error("Failed to read {}: {}".format(input_file, e))
+                    continue
+                pending.append((input_file, output_file, futures, audio_seconds, shared,
+                        timer()))
+                # Convert the next file while this one is in the pool, but
+                # keep at most two files of audio in memory.
+                while len(pending) > 1:
+                    audio_seconds, decode_seconds = self.finish_file(*pending.popleft())
+                    tot_audio += audio_seconds
+                    tot_decode += decode_seconds
+            while pending:
+                audio_seconds, decode_seconds = self.finish_file(*pending.popleft())
+                tot_audio += audio_seconds
+                tot_decode += decode_seconds
+        elapsed = timer() - start_time
+        logging.info("Total: {:.1f} sec of audio in {:.3f} sec; xRT {:.3f}; "\
+                "decode xRT {:.3f}".format(tot_audio, elapsed, elapsed / max(tot_audio, 1e-9),
+                tot_decode / max(tot_audio, 1e-9)))
+
     def process_task_list(self, task_list):
-        if self.args.server is None:
+        if self.args.server is None and self.args.processes > 0:
+            self.process_task_list_processes(task_list)
+        elif self.args.server is None:
             self.process_task_list_pool(task_list)
         else:
             asyncio.run(self.process_task_list_server(task_list))
@@ -0,0 +1,126 @@
+"""Writes transcription results as each final result arrives.
+
+Nothing is held back until the end of a file, so memory stays flat however
+long the recording is. Output goes to ``<output>.part`` and is renamed into
+place once the file is done; after every result the .part file is a valid
+document on its own (the JSON writer rewrites its closing brackets each
+time), so a run that dies halfway leaves a usable partial transcript.
+"""
+
+import datetime
+import json
+import os
+import sys
+
+from pathlib import Path
+
+import srt
+
+class ResultWriter:
+    """Base class: subclasses turn one final result into zero or more items,
+    written in order between header and footer, separated by separator."""
+
+    header = ""
+    footer = ""
+    separator = ""
+
+    def __init__(self, output_file, words_per_line=7):
+        self.output_file = output_file
+        self.words_per_line = words_per_line
+        self.items = 0
+        if output_file == "":
+            self.part = None
+            self.fh = sys.stdout
+        else:
+            self.part = Path(str(output_file) + ".part")
+            self.part.parent.mkdir(parents=True, exist_ok=True)
+            self.fh = open(self.part, "w", encoding="utf-8")
+        self.fh.write(self.header)
+        self._footer_at = self._write_footer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        elif self.part is not None:
+            # The .part file stays behind, complete up to the last result.
+            self.fh.close()
+
+    def _write_footer(self):
+        # Only a file can be kept valid: its footer is overwritten by the
+        # next item. Standard output gets the footer once, at the end.
+        if self.part is None or not self.footer:
+            return None
+        footer_at = self.fh.tell()
+        self.fh.write(self.footer)
+        return footer_at
+
+    def write(self, result):
+        for item in self.format(result):
+            if self._footer_at is not None:
+                self.fh.seek(self._footer_at)
+            if self.items:
+                self.fh.write(self.separator)
+            self.fh.write(item)
+            self.items += 1
+            self._footer_at = self._write_footer()
+        self.fh.flush()
+
+    def commit(self):
+        if self.part is None:
+            self.fh.write(self.footer)
+            self.fh.flush()
+            return
+        self.fh.flush()
+        os.fsync(self.fh.fileno())
+        self.fh.close()
+        os.replace(self.part, self.output_file)
+
+    def format(self, result):
+        raise NotImplementedError
+
+class TxtWriter(ResultWriter):
+
+    def format(self, result):
+        if result.get("text", "") != "":
+            yield result["text"] + "\n"
+
+class SrtWriter(ResultWriter):
+
+    def format(self, result):
+        words = result.get("result", [])
+        for j in range(0, len(words), self.words_per_line):
+            line = words[j : j + self.words_per_line]
+            yield srt.Subtitle(index=self.items + 1,
+                    content=" ".join([l["word"] for l in line]),
+                    start=datetime.timedelta(seconds=line[0]["start"]),
+                    end=datetime.timedelta(seconds=line[-1]["end"])).to_srt()
+
+class JsonWriter(ResultWriter):
+    """One monologue per non-empty final. Results without word timings (from
+    a server that does not send them) get a monologue with text only."""
+
+    header = '{"schemaVersion": "2.0", "monologues": ['
+    footer = "]}\n"
+    separator = ", "
+
+    def format(self, result):
+        if result.get("text", "") == "":
+            return
+        words = result.get("result", [])
+        monologue = {
+            "speaker": {"id": "unknown", "name": None},
+            "start": words[0]["start"] if words else None,
+            "end": words[-1]["end"] if words else None,
+            "text": result["text"],
+            "terms": [{"confidence": t["conf"], "start": t["start"], "end": t["end"],
+                    "text": t["word"], "type": "WORD"} for t in words],
+        }
+        yield json.dumps(monologue, ensure_ascii=False)
+
+WRITERS = {"txt": TxtWriter, "srt": SrtWriter, "json": JsonWriter}
+
+def open_writer(output_type, output_file, words_per_line=7):
+    return WRITERS[output_type](output_file, words_per_line)
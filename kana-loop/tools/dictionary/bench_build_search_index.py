@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import re
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from build_search_index import iter_json_array
+
+BUILDER_PATH = Path(__file__).resolve().parent / "build_search_index.py"
+REPORT_PATTERN = re.compile(r"(\d+) entries in ([\d.]+)s(?:, peak memory ([\d.]+) MB)?")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Build the search index from synthetic inputs of growing size and "
+            "report build time and peak memory for each."
+        ),
+    )
+    parser.add_argument(
+        "--input",
+        type=Path,
+        default=Path(__file__).resolve().parents[2] / "jmdict_with_freq.json",
+        help="Entries to repeat, with fresh ids, up to each size",
+    )
+    parser.add_argument(
+        "--sizes",
+        default="4,64,256",
+        help="Comma-separated input sizes in MB (default: 4,64,256)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=None,
+        help="Passed to build_search_index.py",
+    )
+    return parser.parse_args()
+
+
+def write_synthetic_input(entries: list[dict], path: Path, size_mb: float) -> int:
+    """Writes copies of entries, each with a unique id, until the file reaches
+    size_mb; returns the number of entries written."""
+    target = size_mb * (1 << 20)
+    written = 0
+    count = 0
+    with path.open("w", encoding="utf-8") as handle:
+        handle.write("[\n")
+        while written < target:
+            entry = dict(entries[count % len(entries)])
+            entry["id"] = f"{entry.get('id')}-{count // len(entries)}"
+            text = ("," if count else "") + json.dumps(entry, ensure_ascii=False) + "\n"
+            handle.write(text)
+            written += len(text.encode("utf-8"))
+            count += 1
+        handle.write("]\n")
+    return count
+
+
+def main() -> None:
+    args = parse_args()
+    with args.input.open("r", encoding="utf-8") as handle:
+        # Repeated ids in the source would collide across copies.
+        entries = list({entry.get("id"): entry for entry in iter_json_array(handle)}.values())
+    sizes = [float(item) for item in args.sizes.split(",") if item.strip()]
+
+    print("input MB  entries  build s  entries/s  peak MB")
+    with tempfile.TemporaryDirectory() as workdir:
+        input_path = Path(workdir) / "entries.json"
+        output_path = Path(workdir) / "search_index.sqlite"
+        for size_mb in sizes:
+            count = write_synthetic_input(entries, input_path, size_mb)
+            command = [
+                sys.executable,
+                str(BUILDER_PATH),
+                "--input",
+                str(input_path),
+                "--output",
+                str(output_path),
+            ]
+            if args.batch_size is not None:
+                command += ["--batch-size", str(args.batch_size)]
+            output = subprocess.run(
+                command, check=True, capture_output=True, text=True
+            ).stdout
+            match = REPORT_PATTERN.search(output)
+            if match is None:
+                raise RuntimeError(f"Unexpected builder output: {output!r}")
+            seconds = float(match.group(2))
+            peak = match.group(3) or "n/a"
+            input_mb = input_path.stat().st_size / (1 << 20)
+            print(
+                f"{input_mb:>8.1f}  {count:>7}  {seconds:>7.2f}  {count / seconds:>9.0f}"
+                f"  {peak:>7}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,23 @@
 import argparse
 import json
 import sqlite3
+import sys
+import time
+from collections.abc import Iterable, Iterator
 from pathlib import Path
+from typing import TextIO
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Characters read from the input at a time while streaming entries.
+READ_CHUNK_SIZE = 1 << 20
+# Entries inserted per transaction; bounds memory however large the input.
+DEFAULT_BATCH_SIZE = 5000
+WHITESPACE = " \t\r\n"
+ITEM_DELIMITERS = WHITESPACE + ",]"
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
@@ -20,9 +36,74 @@ def parse_args() -> argparse.Namespace:
         default=Path(__file__).resolve().parents[2] / "search_index.sqlite",
         help="Path to output SQLite database",
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help=f"Entries inserted per transaction (default: {DEFAULT_BATCH_SIZE})",
+    )
     return parser.parse_args()
 
 
+def iter_json_array(handle: TextIO, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[object]:
+    """Yields the items of a top-level JSON array one at a time, holding only
+    the item being parsed (plus one read chunk) in memory."""
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    at_eof = False
+
+    def fill() -> bool:
+        nonlocal buffer, position, at_eof
+        if at_eof:
+            return False
+        chunk = handle.read(chunk_size)
+        if chunk == "":
+            at_eof = True
+            return False
+        buffer = buffer[position:] + chunk
+        position = 0
+        return True
+
+    def skip(characters: str) -> str:
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in characters:
+                position += 1
+            if position < len(buffer) or not fill():
+                return buffer[position : position + 1]
+
+    if skip(WHITESPACE) != "[":
+        raise ValueError("Expected a JSON array at the top level")
+    position += 1
+    if skip(WHITESPACE) == "]":
+        return
+    while True:
+        while True:
+            try:
+                item, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # The item runs past the buffer; read more and try again.
+                if fill():
+                    continue
+                raise
+            # A number cut off by the end of the buffer parses as a shorter
+            # one, so an item counts only once what follows it is known.
+            if (end < len(buffer) and buffer[end] in ITEM_DELIMITERS) or not fill():
+                break
+        position = end
+        yield item
+        separator = skip(WHITESPACE)
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError(
+                "Unterminated JSON array" if separator == "" else "Expected ',' or ']'"
+            )
+        position += 1
+        skip(WHITESPACE)
+
+
 def normalize_gloss(gloss_value: object) -> str:
     if gloss_value is None:
         return ""
@@ -31,7 +112,57 @@ def normalize_gloss(gloss_value: object) -> str:
     return str(gloss_value)
 
 
-def build_database(entries: list[dict], output_path: Path) -> None:
+def entry_row(entry: dict) -> tuple:
+    return (
+        entry.get("id"),
+        entry.get("kana"),
+        entry.get("kanji"),
+        entry.get("romaji"),
+        normalize_gloss(entry.get("gloss")),
+        entry.get("frequency_rank"),
+        entry.get("jlpt"),
+    )
+
+
+def insert_batch(cursor: sqlite3.Cursor, rows: list[tuple]) -> None:
+    cursor.execute("SELECT COALESCE(MAX(rowid), 0) FROM entries;")
+    (last_rowid,) = cursor.fetchone()
+    cursor.executemany(
+        """
+        INSERT INTO entries (
+            id,
+            kana,
+            kanji,
+            romaji,
+            gloss,
+            frequency_rank,
+            jlpt
+        ) VALUES (?, ?, ?, ?, ?, ?, ?);
+        """,
+        rows,
+    )
+    # Index the batch in the same transaction, so FTS5 never has to hold
+    # more than one batch of pending terms.
+    cursor.execute(
+        """
+        INSERT INTO entries_fts (
+            rowid,
+            kana,
+            kanji,
+            romaji,
+            gloss
+        )
+        SELECT rowid, kana, kanji, romaji, gloss FROM entries WHERE rowid > ?;
+        """,
+        (last_rowid,),
+    )
+
+
+def build_database(
+    entries: Iterable[dict], output_path: Path, batch_size: int = DEFAULT_BATCH_SIZE
+) -> int:
+    """Writes entries to a fresh database batch by batch; returns how many
+    were written."""
     if output_path.exists():
         output_path.unlink()
 
@@ -69,53 +200,35 @@ def build_database(entries: list[dict], output_path: Path) -> None:
             """
         )
 
+        connection.commit()
+
+        count = 0
         rows = []
         for entry in entries:
-            rows.append(
-                (
-                    entry.get("id"),
-                    entry.get("kana"),
-                    entry.get("kanji"),
-                    entry.get("romaji"),
-                    normalize_gloss(entry.get("gloss")),
-                    entry.get("frequency_rank"),
-                    entry.get("jlpt"),
-                )
-            )
-
-        cursor.executemany(
-            """
-            INSERT INTO entries (
-                id,
-                kana,
-                kanji,
-                romaji,
-                gloss,
-                frequency_rank,
-                jlpt
-            ) VALUES (?, ?, ?, ?, ?, ?, ?);
-            """,
-            rows,
-        )
-
-        cursor.execute(
-            """
-            INSERT INTO entries_fts (
-                rowid,
-                kana,
-                kanji,
-                romaji,
-                gloss
-            )
-            SELECT rowid, kana, kanji, romaji, gloss FROM entries;
-            """
-        )
+            rows.append(entry_row(entry))
+            if len(rows) >= batch_size:
+                insert_batch(cursor, rows)
+                connection.commit()
+                count += len(rows)
+                rows = []
+        if rows:
+            insert_batch(cursor, rows)
+            count += len(rows)
 
         cursor.execute("CREATE INDEX entries_frequency_rank ON entries(frequency_rank);")
         cursor.execute("CREATE INDEX entries_jlpt ON entries(jlpt);")
         connection.commit()
     finally:
         connection.close()
+    return count
+
+
+def peak_memory_mb() -> float | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak / (1 << 20 if sys.platform == "darwin" else 1 << 10)
 
 
 def main() -> None:
@@ -123,11 +236,14 @@ def main() -> None:
     input_path = args.input
     output_path = args.output
 
+    start = time.perf_counter()
     with input_path.open("r", encoding="utf-8") as handle:
-        entries = json.load(handle)
+        count = build_database(iter_json_array(handle), output_path, args.batch_size)
+    elapsed = time.perf_counter() - start
 
-    build_database(entries, output_path)
-    print(f"Wrote {output_path}")
+    peak = peak_memory_mb()
+    memory = f", peak memory {peak:.1f} MB" if peak is not None else ""
+    print(f"Wrote {output_path}: {count} entries in {elapsed:.2f}s{memory}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,124 @@
+"""Checks that the transcriber's txt, srt and json writers keep their output
+valid: the .part file parses after every write(), a run that stops or dies
+halfway leaves a valid .part file and no output, and a committed file
+matches standard output mode.
+
+Run with ``python -m pytest kana-loop/tools/test_transcriber_writers.py``.
+The writers are the bundled vosk bindings' (``_internal/_internal/vosk``),
+which need cffi and srt to import.
+"""
+
+import json
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+VOSK_ROOT = Path(__file__).resolve().parents[1] / "_internal" / "_internal"
+sys.path.insert(0, str(VOSK_ROOT))
+writers = pytest.importorskip("vosk.transcriber.writers")
+
+WORDS_PER_LINE = 2
+# Results as the recognizer returns them: an empty final, finals with word
+# timings, and a final without them, as some servers send.
+RESULTS = [{"text": "", "result": []}] + [
+    {"text": "a b c", "result": [
+        {"word": word, "start": i + j * 0.3, "end": i + j * 0.3 + 0.25, "conf": 1.0}
+        for j, word in enumerate(["a", "b", "c"])]}
+    for i in range(12)] + [{"text": "d"}]
+STOP_AFTER = 6
+SRT_CUE = re.compile(r"(\d+)\n\d\d:\d\d:\d\d,\d{3} --> \d\d:\d\d:\d\d,\d{3}\n.+\n?")
+# Writes the first results and exits without unwinding, as a killed run would.
+KILLED_RUN = """
+import json, os, sys
+sys.path.insert(0, sys.argv[1])
+from vosk.transcriber.writers import open_writer
+writer = open_writer(sys.argv[2], sys.argv[3], int(sys.argv[4]))
+for result in json.loads(sys.argv[5]):
+    writer.write(result)
+os._exit(1)
+"""
+
+OUTPUT_TYPES = sorted(writers.WRITERS)
+
+
+def expected_items(output_type, results):
+    if output_type == "srt":
+        return sum(-(-len(r.get("result", [])) // WORDS_PER_LINE) for r in results)
+    return sum(1 for r in results if r.get("text", "") != "")
+
+
+def count_items(output_type, text):
+    """Parses a whole document and returns its item count; raises ValueError
+    if it is not valid."""
+    if output_type == "json":
+        return len(json.loads(text)["monologues"])
+    if output_type == "txt":
+        if text and not text.endswith("\n"):
+            raise ValueError("last line is cut off")
+        return text.count("\n")
+    cues = [cue for cue in text.split("\n\n") if cue.strip()]
+    for number, cue in enumerate(cues, 1):
+        found = SRT_CUE.fullmatch(cue)
+        if found is None or int(found.group(1)) != number:
+            raise ValueError("cue %d is malformed" % number)
+    return len(cues)
+
+
+def part_of(output_file):
+    return Path(str(output_file) + ".part")
+
+
+@pytest.mark.parametrize("output_type", OUTPUT_TYPES)
+def test_part_file_is_valid_after_every_write(output_type, tmp_path):
+    output_file = tmp_path / ("out." + output_type)
+    with writers.open_writer(output_type, output_file, WORDS_PER_LINE) as writer:
+        for n, result in enumerate(RESULTS, 1):
+            writer.write(result)
+            text = part_of(output_file).read_text(encoding="utf-8")
+            assert count_items(output_type, text) == expected_items(output_type, RESULTS[:n])
+            assert not output_file.exists()
+    assert not part_of(output_file).exists()
+    text = output_file.read_text(encoding="utf-8")
+    assert count_items(output_type, text) == expected_items(output_type, RESULTS)
+
+
+@pytest.mark.parametrize("output_type", OUTPUT_TYPES)
+def test_stopped_run_leaves_valid_part_file(output_type, tmp_path):
+    output_file = tmp_path / ("stopped." + output_type)
+    with pytest.raises(KeyboardInterrupt):
+        with writers.open_writer(output_type, output_file, WORDS_PER_LINE) as writer:
+            for result in RESULTS[:STOP_AFTER]:
+                writer.write(result)
+            raise KeyboardInterrupt
+    assert not output_file.exists()
+    text = part_of(output_file).read_text(encoding="utf-8")
+    assert count_items(output_type, text) == expected_items(output_type, RESULTS[:STOP_AFTER])
+
+
+@pytest.mark.parametrize("output_type", OUTPUT_TYPES)
+def test_killed_run_leaves_valid_part_file(output_type, tmp_path):
+    output_file = tmp_path / ("killed." + output_type)
+    completed = subprocess.run([
+        sys.executable, "-c", KILLED_RUN, str(VOSK_ROOT), output_type,
+        str(output_file), str(WORDS_PER_LINE), json.dumps(RESULTS[:STOP_AFTER]),
+    ])
+    assert completed.returncode == 1
+    assert not output_file.exists()
+    text = part_of(output_file).read_text(encoding="utf-8")
+    assert count_items(output_type, text) == expected_items(output_type, RESULTS[:STOP_AFTER])
+
+
+@pytest.mark.parametrize("output_type", OUTPUT_TYPES)
+def test_standard_output_matches_committed_file(output_type, tmp_path, capsys):
+    output_file = tmp_path / ("out." + output_type)
+    with writers.open_writer(output_type, output_file, WORDS_PER_LINE) as writer:
+        for result in RESULTS:
+            writer.write(result)
+    capsys.readouterr()
+    with writers.open_writer(output_type, "", WORDS_PER_LINE) as writer:
+        for result in RESULTS:
+            writer.write(result)
+    assert capsys.readouterr().out == output_file.read_text(encoding="utf-8")
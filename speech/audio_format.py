@@ -0,0 +1,204 @@
+"""Converts a session's declared audio format to the PCM Kaldi expects.
+
+Clients declare what they send with ``audio_format`` (sample rate, ``int16``
+or ``float32`` little-endian samples, 1 or 2 interleaved channels), so a game
+client can ship its raw capture buffers instead of resampling and packing
+them one sample at a time. Frames are downmixed, resampled with a streaming
+polyphase FIR filter and converted to 16-bit PCM here, vectorized with
+NumPy. Frames may split samples anywhere; leftover bytes and filter history
+carry over to the next frame.
+
+With ``buffer_output`` the converted PCM is returned as a memoryview of the
+NumPy result rather than copied into ``bytes``, for recognizers whose
+AcceptWaveform takes any buffer.
+
+NumPy is optional; without it only the native format is accepted. It is
+imported on first use, so sessions in the native format (and service
+startup) never pay for it.
+"""
+import math
+
+np = sliding_window_view = None
+_numpy_tried = False
+
+
+def load_numpy():
+    """Imports NumPy the first time it is needed; returns it, or None."""
+    global np, sliding_window_view, _numpy_tried
+    if not _numpy_tried:
+        _numpy_tried = True
+        try:
+            import numpy
+            from numpy.lib.stride_tricks import sliding_window_view
+        except ImportError:
+            return None
+        np = numpy
+    return np
+
+
+ENCODINGS = {"int16": "<i2", "float32": "<f4"}
+SAMPLE_WIDTHS = {"int16": 2, "float32": 4}
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 192000
+# Zero crossings of the windowed sinc on each side of its centre. More gives
+# a sharper anti-aliasing filter at the cost of taps per output sample.
+ZERO_CROSSINGS = 16
+KAISER_BETA = 8.6
+# Passband edge as a fraction of the lower Nyquist frequency.
+ROLLOFF = 0.94
+
+
+def design_polyphase_filter(up, down):
+    """Returns the anti-aliasing filter split into ``up`` phases.
+
+    Row ``p`` holds taps ``p, p + up, p + 2 * up, ...`` of the prototype
+    low-pass filter, scaled by ``up`` so the passband gain is 1.
+    """
+    factor = max(up, down)
+    taps_per_phase = math.ceil(2 * ZERO_CROSSINGS * factor / up)
+    length = taps_per_phase * up
+    cutoff = ROLLOFF * 0.5 / factor
+    centre = (length - 1) / 2
+    n = np.arange(length) - centre
+    prototype = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, KAISER_BETA)
+    prototype *= up / prototype.sum()
+    return (prototype.reshape(taps_per_phase, up).T).astype(np.float32)
+
+
+class PolyphaseResampler:
+    """Streaming rational-ratio resampler for float32 mono samples."""
+
+    def __init__(self, input_rate, output_rate):
+        load_numpy()
+        divisor = math.gcd(input_rate, output_rate)
+        self.up = output_rate // divisor
+        self.down = input_rate // divisor
+        self.phases = design_polyphase_filter(self.up, self.down)
+        self._taps = self.phases.shape[1]
+        # Each output is a dot product of one phase with the newest ``taps``
+        # inputs, oldest first, so the phases are stored reversed.
+        self._reversed_phases = np.ascontiguousarray(self.phases[:, ::-1])
+        self.reset()
+
+    def reset(self):
+        self._history = np.zeros(self._taps - 1, dtype=np.float32)
+        # Position of the next output sample on the upsampled time axis,
+        # relative to the first sample of the next block.
+        self._position = 0
+
+    def process(self, samples):
+        if samples.size == 0:
+            return samples
+        limit = samples.size * self.up
+        positions = np.arange(self._position, limit, self.down)
+        signal = np.concatenate((self._history, samples))
+        self._history = signal[signal.size - (self._taps - 1) :]
+        if positions.size == 0:
+            self._position -= limit
+            return np.zeros(0, dtype=np.float32)
+        self._position = int(positions[-1]) + self.down - limit
+        # A view, not a copy: row k is signal[k : k + taps].
+        windows = sliding_window_view(signal, self._taps)
+        starts = positions // self.up
+        if self.up == 1:
+            # Integer decimation (48k/32k -> 16k): one phase, and the windows
+            # needed are every ``down``-th row, which is still a view.
+            picked = windows[starts[0] : starts[-1] + 1 : self.down]
+            return picked @ self._reversed_phases[0]
+        return np.einsum(
+            "ij,ij->i", windows[starts], self._reversed_phases[positions % self.up]
+        )
+
+
+class AudioFormat:
+    def __init__(self, target_rate, buffer_output=False):
+        self.target_rate = target_rate
+        self.buffer_output = buffer_output
+        self.sample_rate = target_rate
+        self.encoding = "int16"
+        self.channels = 1
+        self._resampler = None
+        self._pending = b""
+
+    @property
+    def is_native(self):
+        return (
+            self.sample_rate == self.target_rate
+            and self.encoding == "int16"
+            and self.channels == 1
+        )
+
+    def configure(self, msg):
+        sample_rate = msg.get("sample_rate", self.sample_rate)
+        encoding = msg.get("encoding", self.encoding)
+        channels = msg.get("channels", self.channels)
+        if (
+            isinstance(sample_rate, bool)
+            or not isinstance(sample_rate, int)
+            or not MIN_SAMPLE_RATE <= sample_rate <= MAX_SAMPLE_RATE
+        ):
+            return (
+                f"sample_rate must be an integer from {MIN_SAMPLE_RATE} "
+                f"to {MAX_SAMPLE_RATE}"
+            )
+        if encoding not in ENCODINGS:
+            return "encoding must be one of: " + ", ".join(ENCODINGS)
+        if channels not in (1, 2):
+            return "channels must be 1 or 2"
+        native = (sample_rate, encoding, channels) == (self.target_rate, "int16", 1)
+        if not native and load_numpy() is None:
+            return "audio conversion needs numpy, which is not available"
+        self.sample_rate = sample_rate
+        self.encoding = encoding
+        self.channels = channels
+        self._resampler = (
+            PolyphaseResampler(sample_rate, self.target_rate)
+            if sample_rate != self.target_rate
+            else None
+        )
+        self._pending = b""
+        return None
+
+    def describe(self):
+        return {
+            "sample_rate": self.sample_rate,
+            "encoding": self.encoding,
+            "channels": self.channels,
+        }
+
+    def bytes_per_ms(self):
+        width = SAMPLE_WIDTHS[self.encoding]
+        return self.sample_rate * width * self.channels / 1000
+
+    def reset(self):
+        self._pending = b""
+        if self._resampler is not None:
+            self._resampler.reset()
+
+    def convert(self, data):
+        """Returns ``data`` as mono 16-bit PCM at the target rate."""
+        if self.is_native:
+            return data
+        width = SAMPLE_WIDTHS[self.encoding]
+        frame_bytes = width * self.channels
+        if self._pending:
+            data = self._pending + data
+        usable = len(data) - len(data) % frame_bytes
+        self._pending = data[usable:]
+        samples = np.frombuffer(
+            data, dtype=ENCODINGS[self.encoding], count=usable // width
+        ).astype(np.float32)
+        if self.encoding == "int16":
+            samples *= 1.0 / 32767.0
+        if self.channels == 2:
+            samples = samples.reshape(-1, 2).mean(axis=1, dtype=np.float32)
+        if self._resampler is not None:
+            samples = self._resampler.process(samples)
+        # In place: ``samples`` is always a fresh array by now.
+        samples *= 32767.0
+        np.rint(samples, out=samples)
+        np.clip(samples, -32768, 32767, out=samples)
+        pcm = samples.astype("<i2")
+        if self.buffer_output:
+            return memoryview(pcm).cast("B")
+        return pcm.tobytes()
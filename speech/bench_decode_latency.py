@@ -0,0 +1,138 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import statistics
+import struct
+import time
+import wave
+
+import websockets
+
+WS_URL = "ws://localhost:2700"
+SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.1
+DEFAULT_STREAMS = "1,4,16"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Measure partial-result latency of the Vosk WebSocket service "
+            "with several simultaneous streams."
+        )
+    )
+    parser.add_argument("--ws-url", default=WS_URL, help="WebSocket URL.")
+    parser.add_argument(
+        "--streams",
+        default=DEFAULT_STREAMS,
+        help="Comma-separated concurrency levels to run (default: 1,4,16).",
+    )
+    parser.add_argument(
+        "--audio-file",
+        default="",
+        help="Optional WAV file (16kHz mono, 16-bit PCM). Defaults to synthetic noise.",
+    )
+    parser.add_argument(
+        "--seconds",
+        type=float,
+        default=5.0,
+        help="Seconds of synthetic audio per stream when no WAV is given.",
+    )
+    parser.add_argument(
+        "--grammar",
+        default="あ,い,う,え,お",
+        help="Comma-separated grammar sent before streaming.",
+    )
+    parser.add_argument(
+        "--json",
+        action="store_true",
+        help="Print the results as JSON instead of a table.",
+    )
+    return parser.parse_args()
+
+
+def load_audio(audio_path, seconds):
+    if audio_path:
+        with wave.open(audio_path, "rb") as wav_file:
+            if (
+                wav_file.getframerate() != SAMPLE_RATE
+                or wav_file.getnchannels() != 1
+                or wav_file.getsampwidth() != 2
+            ):
+                raise ValueError("Audio must be 16kHz mono 16-bit PCM WAV.")
+            return wav_file.readframes(wav_file.getnframes())
+    rng = random.Random(0)
+    sample_count = int(seconds * SAMPLE_RATE)
+    samples = [int(rng.gauss(0.0, 600.0)) for _ in range(sample_count)]
+    return struct.pack("<%dh" % sample_count, *samples)
+
+
+def split_frames(audio):
+    frame_bytes = int(SAMPLE_RATE * FRAME_SECONDS) * 2
+    return [audio[i : i + frame_bytes] for i in range(0, len(audio), frame_bytes)]
+
+
+async def run_stream(ws_url, frames, grammar, latencies):
+    async with websockets.connect(ws_url, max_size=None) as ws:
+        if grammar:
+            await ws.send(json.dumps({"type": "set_grammar", "grammar": grammar}))
+            while json.loads(await ws.recv()).get("type") != "grammar_ack":
+                pass
+        for frame in frames:
+            frame_start = time.perf_counter()
+            await ws.send(frame)
+            while True:
+                payload = json.loads(await ws.recv())
+                if payload.get("type") in {"partial", "final"}:
+                    break
+            latencies.append(time.perf_counter() - frame_start)
+            # Keep real-time pacing so the load resembles live microphones.
+            remaining = FRAME_SECONDS - (time.perf_counter() - frame_start)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run_level(ws_url, streams, frames, grammar):
+    latencies = []
+    await asyncio.gather(
+        *(run_stream(ws_url, frames, grammar, latencies) for _ in range(streams))
+    )
+    return {
+        "streams": streams,
+        "frames": len(latencies),
+        "mean_ms": statistics.fmean(latencies) * 1000.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000.0,
+        "p95_ms": percentile(latencies, 0.95) * 1000.0,
+        "max_ms": max(latencies) * 1000.0,
+    }
+
+
+async def main():
+    args = parse_args()
+    levels = [int(item) for item in args.streams.split(",") if item.strip()]
+    grammar = [item.strip() for item in args.grammar.split(",") if item.strip()]
+    frames = split_frames(load_audio(args.audio_file, args.seconds))
+    results = []
+    for streams in levels:
+        results.append(await run_level(args.ws_url, streams, frames, grammar))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print("streams  frames   mean ms    p50 ms    p95 ms    max ms")
+    for row in results:
+        print(
+            "{streams:>7}  {frames:>6}  {mean_ms:>8.1f}  {p50_ms:>8.1f}  "
+            "{p95_ms:>8.1f}  {max_ms:>8.1f}".format(**row)
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,58 @@
+import argparse
+import json
+import time
+
+from service_protocol import encode_result_binary, encode_result_text
+
+# Shaped like vosk's own output, including its pretty-printing.
+SAMPLE_RESULTS = {
+    "partial": '{\n  "partial" : "か た な"\n}',
+    "final": (
+        '{\n  "result" : [{\n      "conf" : 1.000000,\n      "end" : 1.110000,\n'
+        '      "start" : 0.690000,\n      "word" : "かたな"\n    }],\n'
+        '  "text" : "かたな"\n}'
+    ),
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare result-envelope encoders in messages per second."
+    )
+    parser.add_argument(
+        "--messages", type=int, default=200000, help="Messages per encoder."
+    )
+    return parser.parse_args()
+
+
+def encode_reparse(result_type, raw_result):
+    """The previous path: parse the recognizer JSON, then encode it again."""
+    return json.dumps({"type": result_type, "result": json.loads(raw_result)})
+
+
+def measure(encoder, result_type, count):
+    raw_result = SAMPLE_RESULTS[result_type]
+    start = time.perf_counter()
+    for _ in range(count):
+        encoder(result_type, raw_result)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    args = parse_args()
+    encoders = [
+        ("json reparse (before)", encode_reparse),
+        ("text splice", encode_result_text),
+        ("binary frame", encode_result_binary),
+    ]
+    print("encoder                 type       msgs/s   vs before")
+    for result_type in SAMPLE_RESULTS:
+        baseline = None
+        for name, encoder in encoders:
+            rate = measure(encoder, result_type, args.messages)
+            baseline = baseline or rate
+            print(f"{name:<22}  {result_type:<7}  {rate:>10,.0f}  {rate / baseline:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import websockets
+
+from bench_decode_latency import (
+    FRAME_SECONDS,
+    SAMPLE_RATE,
+    load_audio,
+    percentile,
+    split_frames,
+)
+from bench_shard_scaling import SERVICE_PATH, wait_for_service
+from kana_grammars import standard_kana_grammars
+from service_protocol import BINARY_SUBPROTOCOL
+from stub_recognizer import STUB_RTF_ENV_VAR
+from vosk_ws_test_client import WS_URL, decode_message, read_wav_pcm
+
+STUB_PORT = 2720
+REPLY_TIMEOUT_SECONDS = 30.0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Replay WAV files over many concurrent connections to the Vosk "
+            "WebSocket service and report latency percentiles, throughput "
+            "and errors as JSON."
+        )
+    )
+    parser.add_argument("--ws-url", default=WS_URL, help="WebSocket URL.")
+    parser.add_argument(
+        "--audio-dir",
+        default="",
+        help=(
+            "Directory of WAV files (16kHz mono, 16-bit PCM) to replay. "
+            "Defaults to synthetic noise."
+        ),
+    )
+    parser.add_argument(
+        "--seconds",
+        type=float,
+        default=3.0,
+        help="Seconds of synthetic audio per utterance when no WAVs are given.",
+    )
+    parser.add_argument(
+        "--connections", type=int, default=8, help="Concurrent connections."
+    )
+    parser.add_argument(
+        "--utterances",
+        type=int,
+        default=3,
+        help="Utterances each connection sends, one random WAV each.",
+    )
+    parser.add_argument(
+        "--pacing",
+        choices=["realtime", "fast"],
+        default="realtime",
+        help="Send audio at real-time speed or as fast as the socket allows.",
+    )
+    parser.add_argument(
+        "--ramp-up",
+        type=float,
+        default=0.0,
+        help="Spread connection starts evenly over this many seconds.",
+    )
+    parser.add_argument(
+        "--schedule",
+        default="",
+        help=(
+            "Step ramp as comma-separated SECONDS:CONNECTIONS pairs, e.g. "
+            "0:2,5:8,10:16 (total connections started by each time). "
+            "Overrides --ramp-up."
+        ),
+    )
+    parser.add_argument(
+        "--random-grammars",
+        action="store_true",
+        help="Send a random single-kana grammar before each utterance.",
+    )
+    parser.add_argument(
+        "--binary-framing",
+        action="store_true",
+        help="Request binary result frames instead of JSON text envelopes.",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+    parser.add_argument(
+        "--stub",
+        action="store_true",
+        help=(
+            "Start vosk_service with --stub-recognizer on --stub-port and load "
+            "that instead of --ws-url; needs no model."
+        ),
+    )
+    parser.add_argument(
+        "--stub-port", type=int, default=STUB_PORT, help="Port for --stub."
+    )
+    parser.add_argument(
+        "--stub-workers",
+        type=int,
+        default=0,
+        help="Shard workers for the --stub service (0 decodes in-process).",
+    )
+    parser.add_argument(
+        "--stub-rtf",
+        type=float,
+        default=0.0,
+        help="Simulated decode time per second of audio for the --stub service.",
+    )
+    return parser.parse_args()
+
+
+def load_clips(audio_dir, seconds):
+    if not audio_dir:
+        return [split_frames(load_audio("", seconds))]
+    paths = sorted(Path(audio_dir).glob("*.wav"))
+    if not paths:
+        raise SystemExit(f"No .wav files in {audio_dir}")
+    return [split_frames(read_wav_pcm(path)) for path in paths]
+
+
+def parse_schedule(raw):
+    steps = []
+    for item in raw.split(","):
+        if item.strip():
+            at, total = item.split(":")
+            steps.append((float(at), int(total)))
+    return sorted(steps)
+
+
+def start_offsets(connections, ramp_up, schedule):
+    """Returns when each connection starts, in seconds from the beginning."""
+    if not schedule:
+        return [ramp_up * index / connections for index in range(connections)]
+    offsets = []
+    for at, total in schedule:
+        offsets += [at] * max(0, min(total, connections) - len(offsets))
+    offsets += [schedule[-1][0]] * (connections - len(offsets))
+    return offsets
+
+
+class LoadStats:
+    def __init__(self):
+        self.first_partial = []
+        self.final = []
+        self.audio_seconds = 0.0
+        self.utterances = 0
+        self.errors = collections.Counter()
+
+    def summary(self, wall_seconds):
+        return {
+            "utterances": self.utterances,
+            "audio_seconds": round(self.audio_seconds, 3),
+            "wall_seconds": round(wall_seconds, 3),
+            "audio_seconds_per_second": round(self.audio_seconds / wall_seconds, 3),
+            "first_partial_ms": latency_summary(self.first_partial),
+            "final_ms": latency_summary(self.final),
+            "errors": dict(self.errors),
+        }
+
+
+def latency_summary(latencies):
+    if not latencies:
+        return {"count": 0}
+    summary = {"count": len(latencies)}
+    for name, fraction in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99)):
+        summary[name] = round(percentile(latencies, fraction) * 1000.0, 1)
+    summary["max"] = round(max(latencies) * 1000.0, 1)
+    return summary
+
+
+async def receive_utterance(ws, timings, stats):
+    # The utterance ends with final then reset, so the last final before
+    # reset_ack is the flushed one; earlier finals came from the endpointer.
+    async for message in ws:
+        now = time.perf_counter()
+        payload = decode_message(message)
+        kind = payload.get("type")
+        if kind == "partial":
+            timings.setdefault("first_partial", now)
+        elif kind == "final":
+            timings["final"] = now
+        elif kind == "error":
+            stats.errors["server: " + str(payload.get("error"))] += 1
+        elif kind == "overflow":
+            stats.errors["overflow"] += 1
+        elif kind == "reset_ack":
+            return
+
+
+async def run_utterance(ws, frames, grammar, pacing, stats):
+    if grammar is not None:
+        await ws.send(json.dumps({"type": "set_grammar", "grammar": grammar}))
+    timings = {}
+    receiver = asyncio.create_task(receive_utterance(ws, timings, stats))
+    try:
+        start = time.perf_counter()
+        for index, frame in enumerate(frames):
+            if pacing == "realtime":
+                delay = start + index * FRAME_SECONDS - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await ws.send(frame)
+        final_sent = time.perf_counter()
+        await ws.send(json.dumps({"type": "final"}))
+        await ws.send(json.dumps({"type": "reset"}))
+        await asyncio.wait_for(receiver, REPLY_TIMEOUT_SECONDS)
+    finally:
+        receiver.cancel()
+    stats.utterances += 1
+    stats.audio_seconds += sum(len(frame) for frame in frames) / 2 / SAMPLE_RATE
+    if "first_partial" in timings:
+        stats.first_partial.append(timings["first_partial"] - start)
+    if "final" in timings:
+        stats.final.append(timings["final"] - final_sent)
+    else:
+        stats.errors["no final"] += 1
+
+
+async def run_connection(args, index, offset, clips, grammars, stats):
+    await asyncio.sleep(offset)
+    rng = random.Random(args.seed * 1000003 + index)
+    subprotocols = [BINARY_SUBPROTOCOL] if args.binary_framing else None
+    try:
+        async with websockets.connect(
+            args.ws_url, max_size=None, subprotocols=subprotocols
+        ) as ws:
+            for _ in range(args.utterances):
+                grammar = rng.choice(grammars) if grammars else None
+                await run_utterance(ws, rng.choice(clips), grammar, args.pacing, stats)
+    except asyncio.TimeoutError:
+        stats.errors["timeout"] += 1
+    except (OSError, websockets.WebSocketException) as error:
+        stats.errors[type(error).__name__] += 1
+
+
+async def run_load(args, clips):
+    grammars = standard_kana_grammars() if args.random_grammars else []
+    offsets = start_offsets(
+        args.connections, args.ramp_up, parse_schedule(args.schedule)
+    )
+    stats = LoadStats()
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            run_connection(args, index, offset, clips, grammars, stats)
+            for index, offset in enumerate(offsets)
+        )
+    )
+    return stats.summary(time.perf_counter() - start)
+
+
+async def run_with_stub(args, clips):
+    command = [
+        sys.executable,
+        str(SERVICE_PATH),
+        "--stub-recognizer",
+        "--port",
+        str(args.stub_port),
+        "--metrics-port",
+        "0",
+        "--workers",
+        str(args.stub_workers),
+    ]
+    env = dict(os.environ, **{STUB_RTF_ENV_VAR: str(args.stub_rtf)})
+    process = subprocess.Popen(
+        command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    args.ws_url = f"ws://localhost:{args.stub_port}"
+    try:
+        await wait_for_service(args.ws_url, process)
+        return await run_load(args, clips)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def main():
+    args = parse_args()
+    clips = load_clips(args.audio_dir, args.seconds)
+    if args.stub:
+        summary = await run_with_stub(args, clips)
+    else:
+        summary = await run_load(args, clips)
+    report = {
+        "connections": args.connections,
+        "pacing": args.pacing,
+        "random_grammars": args.random_grammars,
+        **summary,
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
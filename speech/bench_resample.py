@@ -0,0 +1,156 @@
+import argparse
+import math
+import struct
+import sys
+import time
+
+import numpy as np
+
+from audio_format import AudioFormat, PolyphaseResampler
+
+TARGET_RATE = 16000
+TONE_HZ = 1000.0
+FRAME_SECONDS = 0.02
+# Streaming must match one-shot processing and the direct reference to within
+# float32 rounding; the tone must come through this cleanly.
+MAX_REFERENCE_ERROR = 1e-4
+MIN_TONE_SNR_DB = 60.0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Check the service's polyphase resampler against a direct reference "
+            "and compare its CPU cost with the client's per-sample conversion."
+        )
+    )
+    parser.add_argument(
+        "--rates",
+        default="48000,44100,32000,22050,8000",
+        help="Comma-separated input sample rates to check.",
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=2.0, help="Seconds of audio per check."
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Exit non-zero if any accuracy check fails.",
+    )
+    return parser.parse_args()
+
+
+def reference_resample(samples, resampler):
+    """Zero-stuff, filter with the full prototype, then decimate (float64)."""
+    up, down = resampler.up, resampler.down
+    prototype = resampler.phases.T.reshape(-1).astype(np.float64)
+    stuffed = np.zeros(samples.size * up)
+    stuffed[::up] = samples
+    return np.convolve(stuffed, prototype)[: stuffed.size : down]
+
+
+def stream(resampler, samples, rng):
+    parts = []
+    start = 0
+    while start < samples.size:
+        size = int(rng.integers(1, 4096))
+        parts.append(resampler.process(samples[start : start + size]))
+        start += size
+    return np.concatenate(parts)
+
+
+def tone_snr_db(output, resampler, input_rate):
+    length = resampler.phases.size
+    delay = (length - 1) / 2 / (input_rate * resampler.up)
+    skip = resampler.phases.shape[1] * 2
+    t = np.arange(output.size) / TARGET_RATE - delay
+    expected = 0.5 * np.sin(2 * math.pi * TONE_HZ * t)
+    error = output[skip:-skip] - expected[skip:-skip]
+    return 10 * math.log10(np.mean(expected[skip:-skip] ** 2) / np.mean(error**2))
+
+
+def check_rate(input_rate, seconds):
+    t = np.arange(int(input_rate * seconds)) / input_rate
+    samples = (0.5 * np.sin(2 * math.pi * TONE_HZ * t)).astype(np.float32)
+    resampler = PolyphaseResampler(input_rate, TARGET_RATE)
+    one_shot = resampler.process(samples)
+    resampler.reset()
+    streamed = stream(resampler, samples, np.random.default_rng(0))
+    reference = reference_resample(samples, resampler)[: one_shot.size]
+    return {
+        "rate": input_rate,
+        "taps": resampler.phases.shape[1],
+        "stream_error": float(np.max(np.abs(streamed - one_shot))),
+        "reference_error": float(np.max(np.abs(one_shot - reference))),
+        "snr_db": tone_snr_db(one_shot, resampler, input_rate),
+    }
+
+
+def client_conversion(stereo, input_rate):
+    """Python port of vosk_mic_streamer.gd: downmix, lerp resample, pack."""
+    mono = [(stereo[i] + stereo[i + 1]) * 0.5 for i in range(0, len(stereo), 2)]
+    step = input_rate / TARGET_RATE
+    position = 0.0
+    out = bytearray()
+    while position + 1.0 < len(mono):
+        index = int(position)
+        frac = position - index
+        sample = mono[index] + (mono[index + 1] - mono[index]) * frac
+        value = int(round(max(-1.0, min(1.0, sample)) * 32767.0))
+        out += struct.pack("<h", value)
+        position += step
+    return bytes(out)
+
+
+def compare_cpu(input_rate, seconds):
+    t = np.arange(int(input_rate * seconds)) / input_rate
+    tone = 0.5 * np.sin(2 * math.pi * TONE_HZ * t)
+    stereo = np.repeat(tone, 2).astype("<f4")
+    frame_bytes = int(input_rate * FRAME_SECONDS) * 8
+    raw = stereo.tobytes()
+    audio_format = AudioFormat(TARGET_RATE)
+    audio_format.configure(
+        {"sample_rate": input_rate, "encoding": "float32", "channels": 2}
+    )
+    start = time.process_time()
+    for offset in range(0, len(raw), frame_bytes):
+        audio_format.convert(raw[offset : offset + frame_bytes])
+    server_seconds = time.process_time() - start
+    values = stereo.tolist()
+    frame_values = frame_bytes // 4
+    start = time.process_time()
+    for offset in range(0, len(values), frame_values):
+        client_conversion(values[offset : offset + frame_values], input_rate)
+    client_seconds = time.process_time() - start
+    return server_seconds * 60 / seconds, client_seconds * 60 / seconds
+
+
+def main():
+    args = parse_args()
+    rates = [int(item) for item in args.rates.split(",") if item.strip()]
+    failed = False
+    print("rate    taps  stream err  reference err  tone SNR dB")
+    for rate in rates:
+        row = check_rate(rate, args.seconds)
+        ok = (
+            row["stream_error"] <= MAX_REFERENCE_ERROR
+            and row["reference_error"] <= MAX_REFERENCE_ERROR
+            and row["snr_db"] >= MIN_TONE_SNR_DB
+        )
+        failed = failed or not ok
+        print(
+            f"{row['rate']:>6}  {row['taps']:>4}  {row['stream_error']:>10.2e}"
+            f"  {row['reference_error']:>13.2e}  {row['snr_db']:>11.1f}"
+            f"{'' if ok else '  FAIL'}"
+        )
+    print()
+    print("CPU seconds per audio minute (48 kHz stereo float32, 20 ms frames):")
+    server, client = compare_cpu(48000, args.seconds)
+    print(f"  vectorized polyphase (service)   {server:.3f}")
+    print(f"  per-sample lerp + pack (client)  {client:.3f}")
+    if args.check and failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
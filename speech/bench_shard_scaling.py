@@ -0,0 +1,123 @@
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import websockets
+
+from bench_decode_latency import SAMPLE_RATE, load_audio, split_frames
+
+SERVICE_PATH = Path(__file__).resolve().parent / "vosk_service.py"
+BENCH_PORT = 2710
+STARTUP_TIMEOUT_SECONDS = 120.0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Start vosk_service with 1..N shard workers and measure decode "
+            "throughput with many concurrent streams."
+        )
+    )
+    parser.add_argument(
+        "--workers",
+        default="1,2,4",
+        help="Comma-separated worker counts to compare (default: 1,2,4).",
+    )
+    parser.add_argument(
+        "--streams", type=int, default=16, help="Concurrent streams per run."
+    )
+    parser.add_argument("--port", type=int, default=BENCH_PORT, help="Service port.")
+    parser.add_argument(
+        "--audio-file",
+        default="",
+        help="Optional WAV file (16kHz mono, 16-bit PCM). Defaults to synthetic noise.",
+    )
+    parser.add_argument(
+        "--seconds",
+        type=float,
+        default=10.0,
+        help="Seconds of synthetic audio per stream when no WAV is given.",
+    )
+    parser.add_argument(
+        "--pin-cpus", action="store_true", help="Pass --pin-cpus to the service."
+    )
+    return parser.parse_args()
+
+
+async def wait_for_service(ws_url, process):
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("vosk_service exited during startup")
+        try:
+            async with websockets.connect(ws_url) as ws:
+                while time.monotonic() < deadline:
+                    await ws.send(json.dumps({"type": "status"}))
+                    status = json.loads(await ws.recv())
+                    if status["state"] == "ready":
+                        return
+                    if status["state"] == "failed":
+                        raise RuntimeError(status.get("error", "model failed to load"))
+                    await asyncio.sleep(0.2)
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("vosk_service did not become ready")
+
+
+async def drive_stream(ws_url, frames):
+    async with websockets.connect(ws_url, max_size=None) as ws:
+        for frame in frames:
+            await ws.send(frame)
+            await ws.recv()
+
+
+async def measure(ws_url, streams, frames):
+    start = time.perf_counter()
+    await asyncio.gather(*(drive_stream(ws_url, frames) for _ in range(streams)))
+    return time.perf_counter() - start
+
+
+async def run_workers(args, workers, frames):
+    command = [sys.executable, str(SERVICE_PATH), "--port", str(args.port)]
+    command += ["--workers", str(workers)]
+    if args.pin_cpus:
+        command.append("--pin-cpus")
+    process = subprocess.Popen(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    ws_url = f"ws://localhost:{args.port}"
+    try:
+        await wait_for_service(ws_url, process)
+        # Warm each worker's recognizer cache before timing.
+        await measure(ws_url, workers, frames[:1])
+        return await measure(ws_url, args.streams, frames)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def main():
+    args = parse_args()
+    frames = split_frames(load_audio(args.audio_file, args.seconds))
+    audio_seconds = sum(len(frame) for frame in frames) / 2 / SAMPLE_RATE
+    levels = [int(item) for item in args.workers.split(",") if item.strip()]
+    print("workers  streams  wall s  audio s/s  speedup  efficiency")
+    baseline = None
+    for workers in levels:
+        elapsed = await run_workers(args, workers, frames)
+        throughput = audio_seconds * args.streams / elapsed
+        if baseline is None:
+            baseline = throughput / levels[0]
+        speedup = throughput / baseline
+        print(
+            f"{workers:>7}  {args.streams:>7}  {elapsed:>6.2f}  {throughput:>9.1f}"
+            f"  {speedup:>7.2f}  {speedup / workers:>10.0%}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+SERVICE_PATH = Path(__file__).resolve().parent / "vosk_service.py"
+BENCH_PORT = 2711
+STARTUP_TIMEOUT_SECONDS = 120.0
+# Median seconds to ready allowed by default, model load included; the
+# stub recognizer needs well under one.
+DEFAULT_BUDGET_SECONDS = 10.0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=(
+            "Cold-start vosk_service several times with --profile-startup and "
+            "check the median time to ready against a budget."
+        )
+    )
+    parser.add_argument(
+        "--executable",
+        default="",
+        help="Frozen vosk_service executable to start instead of the script.",
+    )
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts to time.")
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=DEFAULT_BUDGET_SECONDS,
+        help=(
+            "Exit with status 1 if the median seconds to ready exceed this "
+            f"(default: {DEFAULT_BUDGET_SECONDS:g}; 0 disables the check)."
+        ),
+    )
+    parser.add_argument("--port", type=int, default=BENCH_PORT, help="Service port.")
+    parser.add_argument(
+        "--workers", type=int, default=0, help="Pass --workers to the service."
+    )
+    parser.add_argument(
+        "--stub-recognizer",
+        action="store_true",
+        help="Start with the stub recognizer; times everything but the model.",
+    )
+    return parser.parse_args(argv)
+
+
+def service_command(args):
+    if args.executable:
+        command = [args.executable]
+    else:
+        command = [sys.executable, str(SERVICE_PATH)]
+    command += [
+        "--profile-startup",
+        "--port",
+        str(args.port),
+        "--metrics-port",
+        "0",
+        "--workers",
+        str(args.workers),
+    ]
+    if args.stub_recognizer:
+        command.append("--stub-recognizer")
+    return command
+
+
+def cold_start(command):
+    start = time.perf_counter()
+    completed = subprocess.run(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        timeout=STARTUP_TIMEOUT_SECONDS,
+    )
+    wall_seconds = time.perf_counter() - start
+    for line in completed.stdout.splitlines():
+        if line.startswith("{"):
+            profile = json.loads(line)
+            if profile.get("type") == "startup_profile":
+                return wall_seconds, profile
+    raise RuntimeError(f"vosk_service exited with {completed.returncode} without a profile")
+
+
+def main():
+    args = parse_args()
+    command = service_command(args)
+    walls = []
+    print("run  wall s  state  timings")
+    for run in range(1, args.runs + 1):
+        wall_seconds, profile = cold_start(command)
+        if profile["state"] != "ready":
+            print(f"startup {profile['state']}: {profile.get('error', '')}", file=sys.stderr)
+            sys.exit(1)
+        walls.append(wall_seconds)
+        timings = " ".join(
+            f"{name.removesuffix('_seconds')}={value:.3f}"
+            for name, value in profile["timings"].items()
+        )
+        print(f"{run:>3}  {wall_seconds:>6.3f}  {profile['state']:<5}  {timings}")
+    median = statistics.median(walls)
+    print(f"median {median:.3f}s, max {max(walls):.3f}s over {len(walls)} cold starts")
+    if args.budget and median > args.budget:
+        print(f"over the {args.budget:.3f}s startup budget", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from audio_format import AudioFormat, SAMPLE_WIDTHS
+
+SAMPLE_RATE = 16000
+FRAME_MS = 20
+DEFAULT_FORMATS = "16000:int16:1,48000:float32:2,44100:int16:1"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Measure the memory allocated per frame while converting client "
+            "audio, and the bytes copied handing it to the recognizer as bytes "
+            "versus as a zero-copy buffer."
+        )
+    )
+    parser.add_argument(
+        "--formats",
+        default=DEFAULT_FORMATS,
+        help="Comma-separated RATE:ENCODING:CHANNELS client formats.",
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=30.0, help="Seconds of audio per run."
+    )
+    return parser.parse_args()
+
+
+class NullRecognizer:
+    """Reads the samples like libvosk would and does nothing else, so only
+    the cost of getting audio to the recognizer is measured."""
+
+    accepts_buffers = True
+
+    def __init__(self):
+        self.checksum = 0
+
+    def AcceptWaveform(self, data):
+        view = memoryview(data)
+        if view.nbytes:
+            self.checksum ^= view[0]
+        return False
+
+
+def client_frames(sample_rate, encoding, channels, seconds):
+    rng = np.random.default_rng(0)
+    samples = rng.normal(0.0, 0.1, int(sample_rate * seconds) * channels)
+    if encoding == "int16":
+        data = (samples * 32767).astype("<i2").tobytes()
+    else:
+        data = samples.astype("<f4").tobytes()
+    frame_bytes = sample_rate * FRAME_MS // 1000 * SAMPLE_WIDTHS[encoding] * channels
+    return [data[i : i + frame_bytes] for i in range(0, len(data), frame_bytes)]
+
+
+def run(frames, client_format, buffer_output):
+    audio_format = AudioFormat(SAMPLE_RATE, buffer_output=buffer_output)
+    audio_format.configure(client_format)
+    recognizer = NullRecognizer()
+    copied = 0
+    start = time.perf_counter()
+    for frame in frames:
+        pcm = audio_format.convert(frame)
+        recognizer.AcceptWaveform(pcm)
+        if isinstance(pcm, bytes) and pcm is not frame:
+            copied += len(pcm)
+    elapsed = time.perf_counter() - start
+    # Second pass under tracemalloc, which slows everything down: the peak
+    # above the starting point is the memory each frame allocates on its way
+    # to the recognizer.
+    audio_format.reset()
+    tracemalloc.start()
+    allocated = 0
+    for frame in frames:
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        recognizer.AcceptWaveform(audio_format.convert(frame))
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return allocated / len(frames), copied / len(frames), elapsed
+
+
+def main():
+    args = parse_args()
+    print("format                  output  peak B/frame  copied B/frame  ms/audio s")
+    for spec in args.formats.split(","):
+        rate, encoding, channels = spec.split(":")
+        client_format = {
+            "sample_rate": int(rate),
+            "encoding": encoding,
+            "channels": int(channels),
+        }
+        frames = client_frames(int(rate), encoding, int(channels), args.seconds)
+        for buffer_output in (False, True):
+            peak, copied, elapsed = run(frames, client_format, buffer_output)
+            print(
+                f"{spec:<22}  {'buffer' if buffer_output else 'bytes':<6}"
+                f"  {peak:>12.0f}  {copied:>14.0f}"
+                f"  {elapsed * 1000 / args.seconds:>10.2f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from vosk_ws_test_client import SAMPLE_RATE, read_wav_pcm, token_outside_grammar
+
+# Audio fed to the recognizer per call, so Kaldi's endpointer can split a
+# clip into utterances as it would on a live stream: 0.25 s.
+CHUNK_BYTES = SAMPLE_RATE // 4 * 2
+# Cases handed to a worker at a time; keeps pickling overhead off short clips.
+CASES_PER_TASK = 8
+MP_CONTEXT = multiprocessing.get_context("spawn")
+
+# Per-process recognizer cache, set up once by init_worker.
+CACHE = None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description=(
+            "Decode a manifest of grammar regression cases offline, across a "
+            "process pool, and write a JSON report."
+        )
+    )
+    parser.add_argument(
+        "manifest",
+        help=(
+            "JSON Lines file; each line has audio (WAV path, relative to the "
+            "manifest), grammar (list of strings) and expected (text, or a "
+            "list of acceptable texts), plus an optional case name."
+        ),
+    )
+    parser.add_argument(
+        "--output", default="", help="Write the report here instead of stdout."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Worker processes, each loading the model once (default: CPU count).",
+    )
+    parser.add_argument(
+        "--model-path",
+        default="",
+        help="Model directory. Defaults to the service's model lookup.",
+    )
+    parser.add_argument(
+        "--stub-recognizer",
+        action="store_true",
+        help="Decode with the service's stub recognizer; checks the harness only.",
+    )
+    parser.add_argument(
+        "--min-accuracy",
+        type=float,
+        default=0.0,
+        help="Exit with status 1 if accuracy falls below this fraction.",
+    )
+    return parser.parse_args()
+
+
+def load_manifest(path):
+    path = Path(path)
+    cases = []
+    with path.open(encoding="utf-8") as manifest:
+        for line_number, line in enumerate(manifest, start=1):
+            if not line.strip():
+                continue
+            case = json.loads(line)
+            expected = case["expected"]
+            cases.append(
+                {
+                    "case": case.get("case", f"line {line_number}"),
+                    "audio": str(path.parent / case["audio"]),
+                    "grammar": list(case.get("grammar", [])),
+                    "expected": [expected] if isinstance(expected, str) else expected,
+                }
+            )
+    return cases
+
+
+def normalize(text):
+    # Vosk separates words with spaces; Japanese expectations are written
+    # without them, so "か た な" and "かたな" compare equal.
+    return "".join(text.split())
+
+
+def init_worker(model_path, stub):
+    global CACHE
+    import vosk_service
+
+    vosk_service.use_recognizer_backend(stub)
+    model = vosk_service.acquire_model(model_path)
+    CACHE = vosk_service.create_recognizer_cache(model)
+
+
+def decode_case(case):
+    import vosk_service
+
+    result = {
+        "case": case["case"],
+        "audio": case["audio"],
+        "grammar": case["grammar"],
+        "expected": case["expected"],
+    }
+    try:
+        audio = read_wav_pcm(case["audio"])
+    except (OSError, EOFError, ValueError) as error:
+        return {**result, "passed": False, "error": str(error)}
+    grammar_key = vosk_service.canonical_grammar(case["grammar"])
+    start = time.perf_counter()
+    recognizer = CACHE.acquire(grammar_key)
+    if hasattr(recognizer, "AcceptWaveformChunks"):
+        # The bundled bindings chunk inside one call, without slicing copies.
+        results = recognizer.AcceptWaveformChunks(audio, CHUNK_BYTES / 2 / SAMPLE_RATE)
+    else:
+        results = [
+            recognizer.Result()
+            for offset in range(0, len(audio), CHUNK_BYTES)
+            if recognizer.AcceptWaveform(audio[offset : offset + CHUNK_BYTES])
+        ]
+    texts = [json.loads(raw).get("text", "") for raw in results]
+    texts.append(json.loads(vosk_service.flush_utterance(recognizer)).get("text", ""))
+    decode_seconds = time.perf_counter() - start
+    CACHE.release(grammar_key, recognizer)
+    actual = " ".join(text for text in texts if text)
+    expected = {normalize(text) for text in case["expected"]}
+    return {
+        **result,
+        "actual": actual,
+        "passed": normalize(actual) in expected,
+        "violations": token_outside_grammar(actual, case["grammar"]),
+        "audio_seconds": round(len(audio) / 2 / SAMPLE_RATE, 3),
+        "decode_seconds": round(decode_seconds, 4),
+    }
+
+
+def build_report(results, wall_seconds, workers):
+    passed = sum(result["passed"] for result in results)
+    violations = sum(bool(result.get("violations")) for result in results)
+    audio_seconds = sum(result.get("audio_seconds", 0.0) for result in results)
+    decode_seconds = sum(result.get("decode_seconds", 0.0) for result in results)
+    return {
+        "cases": len(results),
+        "passed": passed,
+        "failed": len(results) - passed,
+        "errors": sum("error" in result for result in results),
+        "accuracy": round(passed / len(results), 4) if results else 0.0,
+        "grammar_violations": violations,
+        "workers": workers,
+        "audio_seconds": round(audio_seconds, 3),
+        "decode_seconds": round(decode_seconds, 3),
+        "wall_seconds": round(wall_seconds, 3),
+        "results": results,
+    }
+
+
+def main():
+    args = parse_args()
+    cases = load_manifest(args.manifest)
+    if args.stub_recognizer:
+        model_path = None
+    elif args.model_path:
+        model_path = Path(args.model_path)
+    else:
+        import vosk_service
+
+        model_path = vosk_service.resolve_model_path()
+    workers = max(1, min(args.workers, len(cases)))
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=MP_CONTEXT,
+        initializer=init_worker,
+        initargs=(model_path, args.stub_recognizer),
+    ) as pool:
+        results = list(pool.map(decode_case, cases, chunksize=CASES_PER_TASK))
+    report = build_report(results, time.perf_counter() - start, workers)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+    print(
+        f"{report['passed']}/{report['cases']} passed, "
+        f"{report['grammar_violations']} grammar violations, "
+        f"{report['wall_seconds']:.2f}s wall",
+        file=sys.stderr,
+    )
+    if report["accuracy"] < args.min_accuracy:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    main()
@@ -0,0 +1,253 @@
+"""Bounded per-connection queue between the socket reader and the decoder.
+
+The reader enqueues every message as it arrives; the decoder takes either one
+control message or a run of queued audio frames merged into a single chunk,
+so a client that sends one small packet per tick costs one recognizer call
+per chunk rather than per packet once decoding falls behind. Control
+messages are never merged or dropped and keep their place in the stream.
+
+The queue holds at most ``max_queued_ms`` of audio. When a frame does not
+fit, ``overflow`` decides what happens:
+
+- ``block``: the reader waits, which pushes back on the client's socket.
+- ``drop_oldest``: the oldest queued audio is discarded to make room.
+- ``signal``: the new frame is discarded and the client is sent an
+  ``overflow`` message (once per overrun).
+
+Limits are in milliseconds of audio; the queue follows ``audio_format``
+messages on their way to the session so a client sending 48 kHz float32 gets
+the same headroom as one sending 16 kHz PCM.
+"""
+import asyncio
+import json
+import time
+from collections import deque
+
+from audio_format import AudioFormat
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "signal")
+DEFAULT_SETTINGS = {
+    "overflow": "block",
+    "max_queued_ms": 2000,
+    "max_chunk_ms": 200,
+    # Hold audio until this much is queued (or a control message follows) so
+    # per-tick packets are merged even when the decoder keeps up. 0 decodes
+    # whatever is queued straight away.
+    "min_chunk_ms": 0,
+}
+
+
+class IngestMetrics:
+    def __init__(self, registry):
+        self.frames = registry.counter(
+            "kanaloop_frames_received_total", "Binary audio frames received."
+        )
+        self.bytes = registry.counter(
+            "kanaloop_audio_bytes_received_total", "PCM bytes received."
+        )
+        self.queued_bytes = registry.gauge(
+            "kanaloop_ingest_queued_bytes", "Audio bytes waiting to be decoded."
+        )
+        self.merged_frames = registry.counter(
+            "kanaloop_ingest_merged_frames_total",
+            "Frames decoded as part of a larger chunk.",
+        )
+        self.dropped_bytes = registry.counter(
+            "kanaloop_ingest_dropped_bytes_total", "Audio bytes dropped on overflow."
+        )
+        self.overflows = registry.counter(
+            "kanaloop_ingest_overflows_total", "Frames that did not fit the queue."
+        )
+
+
+class IngestQueue:
+    def __init__(self, sample_rate, metrics=None):
+        self._format = AudioFormat(sample_rate)
+        self._bytes_per_ms = self._format.bytes_per_ms()
+        self.metrics = metrics
+        self.settings = dict(DEFAULT_SETTINGS)
+        self._items = deque()
+        self._cond = asyncio.Condition()
+        self._closed = False
+        self._signalled = False
+        self.queued_bytes = 0
+        self.merged_frames = 0
+        self.dropped_bytes = 0
+        self.dropped_frames = 0
+
+    def configure(self, msg):
+        settings = dict(self.settings)
+        overflow = msg.get("overflow", settings["overflow"])
+        if overflow not in OVERFLOW_POLICIES:
+            return "overflow must be one of: " + ", ".join(OVERFLOW_POLICIES)
+        settings["overflow"] = overflow
+        for name in ("max_queued_ms", "max_chunk_ms", "min_chunk_ms"):
+            value = msg.get(name, settings[name])
+            if (
+                isinstance(value, bool)
+                or not isinstance(value, (int, float))
+                or value < 0
+            ):
+                return f"{name} must be a non-negative number"
+            settings[name] = value
+        self.settings = settings
+        return None
+
+    def policy_ack(self, msg):
+        error = self.configure(msg)
+        ack = {"type": "ingest_policy_ack", "ok": error is None, **self.describe()}
+        if error is not None:
+            ack["error"] = error
+        return json.dumps(ack)
+
+    def describe(self):
+        return {
+            **self.settings,
+            "queued_bytes": self.queued_bytes,
+            "queued_ms": round(self.queued_bytes / self._bytes_per_ms),
+            "merged_frames": self.merged_frames,
+            "dropped_bytes": self.dropped_bytes,
+            "dropped_frames": self.dropped_frames,
+        }
+
+    async def put(self, message):
+        """Queues one message; returns an overflow notice to send, or None."""
+        async with self._cond:
+            if self._closed:
+                return None
+            if isinstance(message, str):
+                if '"audio_format"' in message:
+                    self._follow_audio_format(message)
+                self._append(message, 0)
+                return None
+            size = len(message)
+            if self.metrics is not None:
+                self.metrics.frames.inc()
+                self.metrics.bytes.inc(size)
+            if self._overfull(size):
+                if self.metrics is not None:
+                    self.metrics.overflows.inc()
+                policy = self.settings["overflow"]
+                if policy == "block":
+                    await self._cond.wait_for(
+                        lambda: self._closed or not self._overfull(size)
+                    )
+                    if self._closed:
+                        return None
+                elif policy == "drop_oldest":
+                    self._drop_oldest(size)
+                else:
+                    self._count_drop(size)
+                    if self._signalled:
+                        return None
+                    self._signalled = True
+                    return json.dumps({"type": "overflow", **self.describe()})
+            self._signalled = False
+            self._append(message, size)
+            return None
+
+    async def get(self):
+        """Returns ``(message, received_at)`` for the next control message or
+        merged audio chunk, or None once the queue is closed and empty."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._closed or self._items)
+            if not self._items:
+                return None
+            min_bytes = self.settings["min_chunk_ms"] * self._bytes_per_ms
+            if min_bytes and isinstance(self._items[0][0], bytes):
+                held_for = time.monotonic() - self._items[0][1]
+                try:
+                    await asyncio.wait_for(
+                        self._cond.wait_for(lambda: self._chunk_ready(min_bytes)),
+                        max(0.0, self.settings["min_chunk_ms"] / 1000 - held_for),
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                if not self._items:
+                    return None
+            first, received_at = self._items.popleft()
+            if isinstance(first, str):
+                self._cond.notify_all()
+                return first, received_at
+            parts = [first]
+            size = len(first)
+            max_bytes = self.settings["max_chunk_ms"] * self._bytes_per_ms
+            while self._items and not isinstance(self._items[0][0], str):
+                next_size = len(self._items[0][0])
+                if size + next_size > max_bytes:
+                    break
+                parts.append(self._items.popleft()[0])
+                size += next_size
+            self._release(size)
+            if len(parts) > 1:
+                self.merged_frames += len(parts)
+                if self.metrics is not None:
+                    self.metrics.merged_frames.inc(len(parts))
+            self._cond.notify_all()
+            return (parts[0] if len(parts) == 1 else b"".join(parts)), received_at
+
+    def close(self):
+        """Discards queued audio and wakes both ends. Queued control messages
+        (a ``final``, say) are still handed out by get() before it returns
+        None; put() takes nothing more."""
+        self._closed = True
+        self._release(self.queued_bytes)
+        self._items = deque(
+            item for item in self._items if isinstance(item[0], str)
+        )
+        asyncio.ensure_future(self._notify())
+
+    async def _notify(self):
+        async with self._cond:
+            self._cond.notify_all()
+
+    def _follow_audio_format(self, message):
+        try:
+            msg = json.loads(message)
+        except json.JSONDecodeError:
+            return
+        if (
+            isinstance(msg, dict)
+            and msg.get("type") == "audio_format"
+            and self._format.configure(msg) is None
+        ):
+            self._bytes_per_ms = self._format.bytes_per_ms()
+
+    def _append(self, message, size):
+        self._items.append((message, time.monotonic()))
+        self.queued_bytes += size
+        if self.metrics is not None:
+            self.metrics.queued_bytes.inc(size)
+        self._cond.notify_all()
+
+    def _release(self, size):
+        self.queued_bytes -= size
+        if self.metrics is not None:
+            self.metrics.queued_bytes.dec(size)
+
+    def _overfull(self, size):
+        # An empty queue always takes the frame, however large.
+        limit = self.settings["max_queued_ms"] * self._bytes_per_ms
+        return self.queued_bytes > 0 and self.queued_bytes + size > limit
+
+    def _chunk_ready(self, min_bytes):
+        if self._closed or self.queued_bytes >= min_bytes:
+            return True
+        return any(isinstance(message, str) for message, _ in self._items)
+
+    def _drop_oldest(self, size):
+        kept = deque()
+        for item in self._items:
+            message = item[0]
+            if isinstance(message, bytes) and self._overfull(size):
+                self._release(len(message))
+                self._count_drop(len(message))
+            else:
+                kept.append(item)
+        self._items = kept
+
+    def _count_drop(self, size):
+        self.dropped_bytes += size
+        self.dropped_frames += 1
+        if self.metrics is not None:
+            self.metrics.dropped_bytes.inc(size)
@@ -0,0 +1,43 @@
+"""Grammars the kana lessons send, used to pre-warm the recognizer cache.
+
+Lessons ask for one kana at a time, so each entry of HIRAGANA_ORDER is a
+single-word grammar. The order is copied from
+kana-loop/tools/kana_outline_utils.py (the service is bundled on its own and
+cannot import the tools); keep the two in sync.
+"""
+
+HIRAGANA_ORDER = [
+    "あ", "い", "う", "え", "お",
+    "か", "き", "く", "け", "こ",
+    "さ", "し", "す", "せ", "そ",
+    "た", "ち", "つ", "て", "と",
+    "な", "に", "ぬ", "ね", "の",
+    "は", "ひ", "ふ", "へ", "ほ",
+    "ま", "み", "む", "め", "も",
+    "や", "ゆ", "よ",
+    "ら", "り", "る", "れ", "ろ",
+    "わ", "を", "ん",
+    "が", "ぎ", "ぐ", "げ", "ご",
+    "ざ", "じ", "ず", "ぜ", "ぞ",
+    "だ", "ぢ", "づ", "で", "ど",
+    "ば", "び", "ぶ", "べ", "ぼ",
+    "ぱ", "ぴ", "ぷ", "ぺ", "ぽ",
+    "きゃ", "きゅ", "きょ",
+    "ぎゃ", "ぎゅ", "ぎょ",
+    "しゃ", "しゅ", "しょ",
+    "じゃ", "じゅ", "じょ",
+    "ちゃ", "ちゅ", "ちょ",
+    "にゃ", "にゅ", "にょ",
+    "ひゃ", "ひゅ", "ひょ",
+    "びゃ", "びゅ", "びょ",
+    "ぴゃ", "ぴゅ", "ぴょ",
+    "みゃ", "みゅ", "みょ",
+    "りゃ", "りゅ", "りょ",
+    "ぁ", "ぃ", "ぅ", "ぇ", "ぉ",
+    "ゃ", "ゅ", "ょ",
+]
+
+
+def standard_kana_grammars():
+    """Returns one grammar per kana, in lesson order."""
+    return [[kana] for kana in HIRAGANA_ORDER]
@@ -0,0 +1,251 @@
+"""Metrics for vosk_service, exported in the Prometheus text format.
+
+Metrics live in a ``MetricsRegistry``. ``snapshot()`` turns a registry into
+plain dicts that can cross a process boundary, so shard workers can report
+their decode metrics to the supervisor, which merges them with its own
+before rendering. ``serve_metrics`` answers ``GET /metrics`` from the same
+asyncio loop as the WebSocket server.
+"""
+import asyncio
+import bisect
+import threading
+
+DEFAULT_SECONDS_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+    def snapshot(self):
+        return self._value
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, fn=None):
+        self._fn = fn
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def snapshot(self):
+        if self._fn is not None:
+            return self._fn()
+        return self._value
+
+
+class Histogram:
+    """Fixed-bucket histogram that is safe to observe from decode threads."""
+
+    kind = "histogram"
+
+    def __init__(self, buckets=DEFAULT_SECONDS_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+            count = self._count
+        cumulative = []
+        running = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            running += bucket_count
+            cumulative.append([bound, running])
+        cumulative.append(["+Inf", count])
+        return {"buckets": cumulative, "sum": total, "count": count}
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._families = {}
+        self._collectors = []
+
+    def counter(self, name, help_text, labels=None):
+        return self._register(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=None, fn=None):
+        return self._register(Gauge, name, help_text, labels, fn=fn)
+
+    def histogram(self, name, help_text, labels=None, buckets=DEFAULT_SECONDS_BUCKETS):
+        return self._register(Histogram, name, help_text, labels, buckets=buckets)
+
+    def add_collector(self, collector):
+        """Adds a callable returning extra families in ``snapshot()`` form."""
+        self._collectors.append(collector)
+
+    def snapshot(self):
+        families = {}
+        for name, (kind, help_text, series) in self._families.items():
+            families[name] = {
+                "kind": kind,
+                "help": help_text,
+                "series": [
+                    [dict(labels), metric.snapshot()] for labels, metric in series.items()
+                ],
+            }
+        for collector in self._collectors:
+            families.update(collector())
+        return families
+
+    def _register(self, cls, name, help_text, labels, **kwargs):
+        family = self._families.setdefault(name, (cls.kind, help_text, {}))
+        key = tuple(sorted((labels or {}).items()))
+        if key not in family[2]:
+            family[2][key] = cls(**kwargs)
+        return family[2][key]
+
+
+def merge_snapshots(snapshots):
+    """Sums several registry snapshots series by series."""
+    merged = {}
+    for snapshot in snapshots:
+        for name, family in snapshot.items():
+            target = merged.setdefault(
+                name, {"kind": family["kind"], "help": family["help"], "series": []}
+            )
+            for labels, value in family["series"]:
+                for existing in target["series"]:
+                    if existing[0] == labels:
+                        existing[1] = _add_values(family["kind"], existing[1], value)
+                        break
+                else:
+                    target["series"].append([labels, value])
+    return merged
+
+
+def _add_values(kind, left, right):
+    if kind != "histogram":
+        return left + right
+    return {
+        "buckets": [
+            [bound, count + other]
+            for (bound, count), (_, other) in zip(left["buckets"], right["buckets"])
+        ],
+        "sum": left["sum"] + right["sum"],
+        "count": left["count"] + right["count"],
+    }
+
+
+def family_total(snapshot, name):
+    family = snapshot.get(name)
+    if family is None:
+        return 0.0
+    return sum(value for _, value in family["series"])
+
+
+def render_prometheus(snapshot):
+    lines = []
+    for name in sorted(snapshot):
+        family = snapshot[name]
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['kind']}")
+        for labels, value in family["series"]:
+            if family["kind"] != "histogram":
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+                continue
+            for bound, count in value["buckets"]:
+                bucket_labels = {**labels, "le": str(bound)}
+                lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {count}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(value['sum'])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+async def monitor_event_loop_lag(histogram, gauge, interval=0.5):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - expected)
+        histogram.observe(lag)
+        gauge.set(lag)
+
+
+async def serve_metrics(host, port, render):
+    """Serves ``render()`` at /metrics; any other path is a 404."""
+
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                (
+                    f"HTTP/1.1 {status}\r\n"
+                    f"Content-Type: {CONTENT_TYPE}\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    "Connection: close\r\n\r\n"
+                ).encode("latin-1")
+                + body
+            )
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,115 @@
+"""Wire format for recognizer results sent by vosk_service.
+
+Results go out as JSON text by default. The recognizer already produces a
+JSON object, so the envelope is built by splicing that string in rather than
+parsing and re-encoding it.
+
+Clients that request the ``kanaloop.binary.v1`` WebSocket subprotocol get
+results as binary frames instead: a fixed little-endian header followed by
+the recognizer's UTF-8 JSON. Control replies (acks, stats) stay JSON text.
+
+``status`` and ``ingest_policy`` messages are answered by the transport
+itself rather than queued for the session: status works while the model is
+still loading, and ingest_policy configures the queue in front of the
+session. Their replies may overtake results still being decoded.
+
+    offset  size  field
+    0       1     version (1)
+    1       1     kind (1 = partial, 2 = final)
+    2       2     stream id on multiplexed connections, else 0
+    4       4     payload length in bytes
+
+``kanaloop.mux.v1`` and ``kanaloop.mux.binary.v1`` carry several logical
+streams per connection (see stream_mux); results are JSON text or binary
+frames respectively, and every JSON reply carries a ``"stream"`` field.
+"""
+import json
+import struct
+
+BINARY_SUBPROTOCOL = "kanaloop.binary.v1"
+MUX_SUBPROTOCOL = "kanaloop.mux.v1"
+MUX_BINARY_SUBPROTOCOL = "kanaloop.mux.binary.v1"
+SUBPROTOCOLS = (BINARY_SUBPROTOCOL, MUX_SUBPROTOCOL, MUX_BINARY_SUBPROTOCOL)
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("<BBHI")
+RESULT_KINDS = {"partial": 1, "final": 2}
+RESULT_TYPES = {kind: name for name, kind in RESULT_KINDS.items()}
+# Prefix of each binary audio frame on a multiplexed connection: the stream id
+# and a reserved u16 that keeps the samples after it 4-byte aligned.
+STREAM_HEADER = struct.Struct("<HH")
+MAX_STREAM_ID = 0xFFFF
+
+
+def select_subprotocol(connection, subprotocols):
+    """Takes the client's first supported subprotocol; plain clients get None."""
+    for subprotocol in subprotocols:
+        if subprotocol in SUBPROTOCOLS:
+            return subprotocol
+    return None
+
+
+def uses_binary_results(subprotocol):
+    return subprotocol in (BINARY_SUBPROTOCOL, MUX_BINARY_SUBPROTOCOL)
+
+
+def is_multiplexed(subprotocol):
+    return subprotocol in (MUX_SUBPROTOCOL, MUX_BINARY_SUBPROTOCOL)
+
+
+TRANSPORT_CONTROL_TYPES = ("status", "ingest_policy")
+
+
+def parse_transport_control(message):
+    """Returns the parsed message if the transport answers it, else None."""
+    if not isinstance(message, str) or not any(
+        f'"{msg_type}"' in message for msg_type in TRANSPORT_CONTROL_TYPES
+    ):
+        return None
+    try:
+        msg = json.loads(message)
+    except json.JSONDecodeError:
+        return None
+    if isinstance(msg, dict) and msg.get("type") in TRANSPORT_CONTROL_TYPES:
+        return msg
+    return None
+
+
+def encode_result_text(result_type, raw_result, stream_id=None):
+    if stream_id is not None:
+        return '{"type": "%s", "stream": %d, "result": %s}' % (
+            result_type,
+            stream_id,
+            raw_result,
+        )
+    return '{"type": "%s", "result": %s}' % (result_type, raw_result)
+
+
+def encode_result_binary(result_type, raw_result, stream_id=None):
+    payload = raw_result.encode("utf-8")
+    header = FRAME_HEADER.pack(
+        FRAME_VERSION, RESULT_KINDS[result_type], stream_id or 0, len(payload)
+    )
+    return header + payload
+
+
+def tag_stream(reply, stream_id):
+    """Adds ``"stream"`` to an encoded JSON object reply, unless it is None."""
+    if stream_id is None:
+        return reply
+    return '{"stream": %d, %s' % (stream_id, reply[1:])
+
+
+def decode_result_binary(frame):
+    """Returns ``(result_type, raw_json)`` for a binary result frame."""
+    version, kind, _, length = FRAME_HEADER.unpack_from(frame)
+    if version != FRAME_VERSION:
+        raise ValueError(f"unsupported frame version {version}")
+    start = FRAME_HEADER.size
+    if len(frame) - start != length:
+        raise ValueError("frame length does not match header")
+    return RESULT_TYPES[kind], bytes(frame[start:]).decode("utf-8")
+
+
+def result_frame_stream(frame):
+    """Returns the stream id of a binary result frame, 0 if it has none."""
+    return FRAME_HEADER.unpack_from(frame)[2]
@@ -0,0 +1,198 @@
+"""Logical recognition streams over one WebSocket connection.
+
+A plain connection is one stream. Clients that negotiate ``kanaloop.mux.v1``
+(or ``kanaloop.mux.binary.v1`` for binary results) can open several, each
+with its own recognizer, grammar, ingest queue and decode lane, e.g. to load
+the next prompt's grammar while the current one is still listening, or to
+run two grammars side by side.
+
+On a multiplexed connection:
+
+- every JSON message names its stream with an integer ``"stream"`` field
+  (1-65535), and every JSON reply carries it back;
+- binary audio frames start with ``STREAM_HEADER``: the stream id as a
+  little-endian u16, then a reserved u16;
+- binary result frames carry the stream id in their header.
+
+``{"type": "stream_open", "stream": n}`` is answered with
+``stream_open_ack``. ``{"type": "stream_close", "stream": n}`` tears the
+stream down: queued audio is discarded, control messages queued before it
+(``set_grammar``, ``final``, ...) are still handled and answered, a decode in
+flight finishes and the recognizer goes back to the cache, then the server
+sends ``stream_closed``.
+The server also sends ``stream_closed`` when a stream ends by itself (after
+``eof``, or with an error); its id can then be opened again. Audio for a
+stream that is not open is dropped, since it may simply have crossed a
+``stream_closed`` on the wire. ``status`` is connection-wide.
+
+The reader is shared, so with the ``block`` overflow policy one full stream
+holds up every stream on the connection.
+"""
+import asyncio
+import json
+import logging
+
+from service_protocol import (
+    MAX_STREAM_ID,
+    STREAM_HEADER,
+    is_multiplexed,
+    parse_transport_control,
+    tag_stream,
+)
+
+MAX_STREAMS_PER_CONNECTION = 8
+
+
+def valid_stream_id(value):
+    return (
+        isinstance(value, int)
+        and not isinstance(value, bool)
+        and 1 <= value <= MAX_STREAM_ID
+    )
+
+
+def stream_closed_message(stream_id, reason):
+    return json.dumps({"type": "stream_closed", "stream": stream_id, "reason": reason})
+
+
+async def end_stream(websocket, stream_id, reason):
+    """Ends a stream the server is finished with; a plain connection closes."""
+    if stream_id is None:
+        await websocket.close()
+    else:
+        await websocket.send(stream_closed_message(stream_id, reason))
+
+
+async def serve_streams(websocket, open_stream, status_reply):
+    """Reads a connection and hands its messages to logical streams.
+
+    ``open_stream(stream_id)`` starts a stream and returns an object with an
+    ``ingest`` queue, ``done()`` (true once the stream ended by itself) and
+    an awaitable ``close()``. A plain connection gets one stream, id None.
+    """
+    if is_multiplexed(websocket.subprotocol):
+        await StreamMux(websocket, open_stream, status_reply).serve()
+        return
+    stream = open_stream(None)
+    try:
+        async for message in websocket:
+            # Answered here, ahead of any results still being decoded.
+            control = parse_transport_control(message)
+            if control is not None:
+                if control["type"] == "status" and status_reply is not None:
+                    await websocket.send(status_reply())
+                elif control["type"] == "ingest_policy":
+                    await websocket.send(stream.ingest.policy_ack(control))
+                continue
+            notice = await stream.ingest.put(message)
+            if notice is not None:
+                await websocket.send(notice)
+            if stream.done():
+                break
+    finally:
+        await stream.close()
+
+
+class StreamMux:
+    def __init__(self, websocket, open_stream, status_reply):
+        self.websocket = websocket
+        self._open_stream = open_stream
+        self._status_reply = status_reply
+        self.streams = {}
+
+    async def serve(self):
+        try:
+            async for message in self.websocket:
+                if isinstance(message, str):
+                    await self._handle_text(message)
+                else:
+                    await self._handle_audio(message)
+        finally:
+            streams, self.streams = list(self.streams.values()), {}
+            await asyncio.gather(*(stream.close() for stream in streams))
+
+    def _live_stream(self, stream_id):
+        stream = self.streams.get(stream_id)
+        if stream is None or stream.done():
+            return None
+        return stream
+
+    async def _handle_audio(self, message):
+        if len(message) < STREAM_HEADER.size:
+            return
+        stream_id, _ = STREAM_HEADER.unpack_from(message)
+        stream = self._live_stream(stream_id)
+        if stream is None:
+            return
+        notice = await stream.ingest.put(message[STREAM_HEADER.size :])
+        if notice is not None:
+            await self.websocket.send(tag_stream(notice, stream_id))
+
+    async def _handle_text(self, message):
+        try:
+            msg = json.loads(message)
+        except json.JSONDecodeError:
+            logging.warning("JSON decode failed on multiplexed connection: %s", message)
+            return
+        if not isinstance(msg, dict):
+            return
+        msg_type = msg.get("type")
+        if msg_type == "status":
+            if self._status_reply is not None:
+                await self.websocket.send(self._status_reply())
+            return
+        stream_id = msg.get("stream")
+        if not valid_stream_id(stream_id):
+            await self._send_error(
+                None, f"stream must be an integer from 1 to {MAX_STREAM_ID}"
+            )
+            return
+        if msg_type == "stream_open":
+            await self._open(stream_id)
+            return
+        if msg_type == "stream_close":
+            await self._close(stream_id)
+            return
+        stream = self._live_stream(stream_id)
+        if stream is None:
+            await self._send_error(stream_id, "stream is not open")
+            return
+        if msg_type == "ingest_policy":
+            await self.websocket.send(
+                tag_stream(stream.ingest.policy_ack(msg), stream_id)
+            )
+            return
+        # The session ignores the stream field, so the message goes as is.
+        notice = await stream.ingest.put(message)
+        if notice is not None:
+            await self.websocket.send(tag_stream(notice, stream_id))
+
+    async def _open(self, stream_id):
+        ended = [key for key, stream in self.streams.items() if stream.done()]
+        for key in ended:
+            await self.streams.pop(key).close()
+        ack = {"type": "stream_open_ack", "stream": stream_id, "ok": False}
+        if stream_id in self.streams:
+            ack["error"] = "stream is already open"
+        elif len(self.streams) >= MAX_STREAMS_PER_CONNECTION:
+            ack["error"] = (
+                f"at most {MAX_STREAMS_PER_CONNECTION} streams per connection"
+            )
+        else:
+            self.streams[stream_id] = self._open_stream(stream_id)
+            ack["ok"] = True
+        await self.websocket.send(json.dumps(ack))
+
+    async def _close(self, stream_id):
+        stream = self.streams.pop(stream_id, None)
+        if stream is None:
+            await self._send_error(stream_id, "stream is not open")
+            return
+        await stream.close()
+        await self.websocket.send(stream_closed_message(stream_id, "closed"))
+
+    async def _send_error(self, stream_id, error):
+        reply = {"type": "error", "error": error}
+        if stream_id is not None:
+            reply["stream"] = stream_id
+        await self.websocket.send(json.dumps(reply))
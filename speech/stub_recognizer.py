@@ -0,0 +1,86 @@
+"""Stand-in for vosk's Model and KaldiRecognizer, for load tests and CI.
+
+``vosk_service.py --stub-recognizer`` serves the normal protocol without the
+Japanese model or libvosk. The stub answers with the first grammar entry
+once it has heard enough loud audio, and fires an endpointer final after a
+run of quiet audio, so sessions see the same partial/final sequence shape
+as a real recognizer. Results are deterministic; the text means nothing.
+
+Set ``KANALOOP_STUB_RTF`` to make each call sleep for that fraction of the
+audio it was given (the sleep releases the GIL, as Kaldi does), so latency
+grows under load the way it does with a real model.
+"""
+import json
+import math
+import os
+import time
+from array import array
+
+STUB_RTF_ENV_VAR = "KANALOOP_STUB_RTF"
+DEFAULT_TEXT = "あ"
+# Mean-square level, in int16 units, above which a chunk counts as voiced.
+VOICED_POWER = 300.0**2
+# Voiced audio needed before partials carry text, and trailing quiet audio
+# after which AcceptWaveform reports an endpoint.
+MIN_VOICED_SECONDS = 0.2
+ENDPOINT_SILENCE_SECONDS = 0.5
+
+
+def read_stub_rtf():
+    try:
+        return max(0.0, float(os.environ.get(STUB_RTF_ENV_VAR, "0")))
+    except ValueError:
+        return 0.0
+
+
+class StubModel:
+    def __init__(self, model_path=None):
+        self.model_path = model_path
+
+
+class StubRecognizer:
+    accepts_buffers = True
+
+    def __init__(self, model, sample_rate, grammar=None):
+        self.sample_rate = sample_rate
+        words = json.loads(grammar) if grammar else []
+        self.text = next((word for word in words if word != "[unk]"), DEFAULT_TEXT)
+        self.rtf = read_stub_rtf()
+        self.Reset()
+
+    def AcceptWaveform(self, data):
+        seconds = len(data) / (2 * self.sample_rate)
+        if self.rtf:
+            time.sleep(seconds * self.rtf)
+        samples = array("h")
+        samples.frombytes(data[: len(data) - len(data) % 2])
+        power = math.fsum(sample * sample for sample in samples) / max(1, len(samples))
+        if power >= VOICED_POWER:
+            self._voiced += seconds
+            self._silence = 0.0
+            return False
+        self._silence += seconds
+        return (
+            self._voiced >= MIN_VOICED_SECONDS
+            and self._silence >= ENDPOINT_SILENCE_SECONDS
+        )
+
+    def Result(self):
+        result = self._result()
+        self.Reset()
+        return result
+
+    def PartialResult(self):
+        heard = self._voiced >= MIN_VOICED_SECONDS
+        return json.dumps({"partial": self.text if heard else ""}, ensure_ascii=False)
+
+    def FinalResult(self):
+        return self._result()
+
+    def Reset(self):
+        self._voiced = 0.0
+        self._silence = 0.0
+
+    def _result(self):
+        heard = self._voiced >= MIN_VOICED_SECONDS
+        return json.dumps({"text": self.text if heard else ""}, ensure_ascii=False)
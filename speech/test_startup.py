@@ -0,0 +1,36 @@
+"""Fails if the service's cold start regresses.
+
+Cold-starts vosk_service with --profile-startup and the stub recognizer, in
+process and with one shard worker, and checks the median time to ready
+against a budget. That covers imports, the event loop, bind and worker
+spawn, but not the model; time that with ``bench_startup.py`` and the real
+model. Run with ``python -m pytest speech/test_startup.py``.
+"""
+import socket
+import statistics
+
+import pytest
+
+from bench_startup import cold_start, parse_args, service_command
+
+RUNS = 3
+STUB_BUDGET_SECONDS = 2.0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.parametrize("workers", [0, 1], ids=["in_process", "workers_1"])
+def test_stub_cold_start_within_budget(workers):
+    args = parse_args(
+        ["--stub-recognizer", "--workers", str(workers), "--port", str(free_port())]
+    )
+    walls = []
+    for _ in range(RUNS):
+        wall_seconds, profile = cold_start(service_command(args))
+        assert profile["state"] == "ready", profile.get("error")
+        walls.append(wall_seconds)
+    assert statistics.median(walls) <= STUB_BUDGET_SECONDS, walls
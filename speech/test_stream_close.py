@@ -0,0 +1,90 @@
+"""Checks that stream_close answers what was queued before it.
+
+Starts vosk_service with the stub recognizer, in process and with two shard
+workers, and closes a multiplexed stream straight after ``set_grammar`` and
+``final``. Run with ``python -m pytest speech/test_stream_close.py``.
+"""
+import asyncio
+import json
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+import websockets
+
+SERVICE_PATH = Path(__file__).resolve().parent / "vosk_service.py"
+STARTUP_TIMEOUT_SECONDS = 60.0
+REPLY_TIMEOUT_SECONDS = 10.0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_ready(url):
+    deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+    while True:
+        try:
+            async with websockets.connect(url) as ws:
+                await ws.send(json.dumps({"type": "status"}))
+                if json.loads(await ws.recv())["state"] == "ready":
+                    return
+        except OSError:
+            pass
+        if time.monotonic() > deadline:
+            raise TimeoutError("vosk_service did not get ready")
+        await asyncio.sleep(0.2)
+
+
+async def close_after_control(url):
+    """Returns the message types the stream got, up to stream_closed."""
+    async with websockets.connect(url, subprotocols=["kanaloop.mux.v1"]) as ws:
+        for message in (
+            {"type": "stream_open", "stream": 1},
+            {"type": "set_grammar", "stream": 1, "grammar": ["か", "き"]},
+            {"type": "final", "stream": 1},
+            {"type": "stream_close", "stream": 1},
+        ):
+            await ws.send(json.dumps(message))
+        seen = []
+        while not seen or seen[-1] != "stream_closed":
+            reply = json.loads(await asyncio.wait_for(ws.recv(), REPLY_TIMEOUT_SECONDS))
+            seen.append(reply["type"])
+        return seen
+
+
+@pytest.fixture(params=[0, 2], ids=["in_process", "workers_2"])
+def service_url(request):
+    port = free_port()
+    service = subprocess.Popen(
+        [
+            sys.executable,
+            str(SERVICE_PATH),
+            "--stub-recognizer",
+            "--metrics-port",
+            "0",
+            "--port",
+            str(port),
+            "--workers",
+            str(request.param),
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"ws://localhost:{port}"
+    try:
+        asyncio.run(wait_until_ready(url))
+        yield url
+    finally:
+        service.terminate()
+        service.wait(timeout=STARTUP_TIMEOUT_SECONDS)
+
+
+def test_replies_arrive_before_stream_closed(service_url):
+    seen = asyncio.run(close_after_control(service_url))
+    assert seen == ["stream_open_ack", "grammar_ack", "final", "stream_closed"]
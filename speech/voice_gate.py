@@ -0,0 +1,134 @@
+"""Voice-activity gate that keeps pure silence away from Kaldi.
+
+Frames are split into 10 ms blocks and classified with NumPy: a block is
+voiced when its RMS energy clears ``energy_threshold``, or when it is quieter
+but has the high zero-crossing rate of a fricative (さ, し, ふ...). Silent
+frames are held in a short pre-roll buffer instead of being decoded, and that
+buffer is replayed ahead of the next voiced frame so onsets are not clipped.
+After speech the gate stays open for ``hangover_ms`` so Kaldi still sees
+enough trailing silence to fire its endpointer.
+
+NumPy is optional; without it the gate cannot be enabled. It is imported
+when a gate is first enabled.
+"""
+from collections import deque
+
+from audio_format import load_numpy
+
+# Bound by VoiceGate.configure() once a gate is enabled.
+np = None
+
+BLOCK_MS = 10
+# Fraction of the energy threshold a high-ZCR block must reach to count as a
+# fricative rather than background hiss.
+FRICATIVE_ENERGY_RATIO = 0.3
+DEFAULT_SETTINGS = {
+    "energy_threshold": 0.01,
+    "zcr_threshold": 0.3,
+    "preroll_ms": 300,
+    "hangover_ms": 800,
+}
+
+
+class VoiceGate:
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.enabled = False
+        self.settings = dict(DEFAULT_SETTINGS)
+        self._block_samples = sample_rate * BLOCK_MS // 1000
+        self._preroll = deque()
+        self._preroll_bytes = 0
+        self._hangover_left = 0
+        self.in_speech = False
+        self.last_frame_voiced = False
+        self.bytes_in = 0
+        self.bytes_skipped = 0
+
+    def configure(self, msg):
+        global np
+        enabled = msg.get("enabled", self.enabled)
+        if not isinstance(enabled, bool):
+            return "enabled must be true or false"
+        if enabled:
+            np = load_numpy()
+            if np is None:
+                return "voice gate needs numpy, which is not available"
+        settings = dict(self.settings)
+        for name in DEFAULT_SETTINGS:
+            value = msg.get(name, settings[name])
+            if (
+                isinstance(value, bool)
+                or not isinstance(value, (int, float))
+                or value < 0
+            ):
+                return f"{name} must be a non-negative number"
+            settings[name] = value
+        self.enabled = enabled
+        self.settings = settings
+        if not enabled:
+            self.reset()
+        return None
+
+    def describe(self):
+        return {"enabled": self.enabled, **self.settings}
+
+    def reset(self):
+        self._preroll.clear()
+        self._preroll_bytes = 0
+        self._hangover_left = 0
+        self.in_speech = False
+        self.last_frame_voiced = False
+
+    def process(self, data):
+        """Returns the PCM that should reach the recognizer for this frame."""
+        self.bytes_in += len(data)
+        if not self.enabled:
+            return data
+        self.last_frame_voiced = self.is_voiced(data)
+        if self.last_frame_voiced:
+            self._hangover_left = self._ms_to_bytes(self.settings["hangover_ms"])
+            if not self.in_speech:
+                self.in_speech = True
+                self._preroll.append(data)
+                data = b"".join(self._preroll)
+                self._preroll.clear()
+                self._preroll_bytes = 0
+            return data
+        if self.in_speech and self._hangover_left > 0:
+            self._hangover_left -= len(data)
+            return data
+        self.in_speech = False
+        self._hold_preroll(data)
+        self.bytes_skipped += len(data)
+        return b""
+
+    def is_voiced(self, data):
+        samples = np.frombuffer(data, dtype="<i2", count=len(data) // 2)
+        if samples.size == 0:
+            return False
+        usable = samples.size - samples.size % self._block_samples
+        if usable:
+            blocks = samples[:usable].reshape(-1, self._block_samples)
+        else:
+            blocks = samples.reshape(1, -1)
+        blocks = blocks.astype(np.float32) * (1.0 / 32768.0)
+        rms = np.sqrt(np.mean(blocks * blocks, axis=1))
+        signs = np.signbit(blocks)
+        crossings = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1)
+        zcr = crossings / max(1, blocks.shape[1] - 1)
+        energy = self.settings["energy_threshold"]
+        voiced = (rms >= energy) | (
+            (rms >= energy * FRICATIVE_ENERGY_RATIO)
+            & (zcr >= self.settings["zcr_threshold"])
+        )
+        return bool(voiced.any())
+
+    def _hold_preroll(self, data):
+        limit = self._ms_to_bytes(self.settings["preroll_ms"])
+        self._preroll.append(data)
+        self._preroll_bytes += len(data)
+        while self._preroll and self._preroll_bytes - len(self._preroll[0]) >= limit:
+            self._preroll_bytes -= len(self._preroll.popleft())
+
+    def _ms_to_bytes(self, milliseconds):
+        return int(self.sample_rate * milliseconds / 1000) * 2
@@ -1,17 +1,49 @@
 #!/usr/bin/env python3
+import argparse
 import asyncio
 import json
 import logging
+import multiprocessing
 import os
 import sys
+import threading
+import time
+
+# Taken before the heavy imports below so status can report their cost.
+STARTED_AT = time.perf_counter()
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 
-def make_recognizer(grammar=None):
-    if grammar:
-        grammar_json = json.dumps(grammar, ensure_ascii=False)
+from service_metrics import (
+    Histogram,
+    MetricsRegistry,
+    family_total,
+    merge_snapshots,
+    monitor_event_loop_lag,
+    render_prometheus,
+    serve_metrics,
+)
+from audio_format import AudioFormat
+from ingest_queue import IngestMetrics, IngestQueue
+from kana_grammars import standard_kana_grammars
+from voice_gate import VoiceGate
+from service_protocol import (
+    encode_result_binary,
+    encode_result_text,
+    select_subprotocol,
+    tag_stream,
+    uses_binary_results,
+)
+from stream_mux import end_stream, serve_streams
+
+def make_recognizer(model, grammar_json=""):
+    if grammar_json:
         logging.info("Setting grammar: %s", grammar_json)
-        return KaldiRecognizer(MODEL, SAMPLE_RATE, grammar_json)
-    return KaldiRecognizer(MODEL, SAMPLE_RATE)
+        return KaldiRecognizer(model, SAMPLE_RATE, grammar_json)
+    return KaldiRecognizer(model, SAMPLE_RATE)
 
 
 if getattr(sys, "frozen", False):
@@ -29,7 +61,36 @@ if getattr(sys, "frozen", False):
                 pass
 
 import websockets
-from vosk import KaldiRecognizer, Model
+
+# Bound by use_recognizer_backend(). vosk is only imported for the real
+# recognizer, so --stub-recognizer runs without the model or libvosk.
+Model = KaldiRecognizer = None
+# The bundled bindings' process-wide model registry and on-disk model
+# catalog, when available.
+MODEL_REGISTRY = ModelCatalog = None
+
+
+def use_recognizer_backend(stub=False):
+    global Model, KaldiRecognizer, MODEL_REGISTRY, ModelCatalog
+    if stub:
+        from stub_recognizer import StubModel as Model
+        from stub_recognizer import StubRecognizer as KaldiRecognizer
+
+        MODEL_REGISTRY = ModelCatalog = None
+    else:
+        import vosk
+        from vosk import KaldiRecognizer, Model
+
+        MODEL_REGISTRY = getattr(vosk, "model_registry", None)
+        ModelCatalog = getattr(vosk, "ModelCatalog", None)
+
+
+def acquire_model(model_path):
+    """Loads the model, sharing it with anything else in this process that
+    uses the same model through the bundled bindings' registry."""
+    if MODEL_REGISTRY is None:
+        return Model(str(model_path))
+    return MODEL_REGISTRY.acquire(str(model_path))
 
 
 MODEL_NAME = "vosk-model-small-ja-0.22"
@@ -38,6 +99,29 @@ DEFAULT_MODEL_ROOT = Path("models")
 HOST = "localhost"
 PORT = 2700
 SAMPLE_RATE = 16000
+DECODE_WORKERS_ENV_VAR = "KANALOOP_DECODE_WORKERS"
+SHARD_WORKERS_ENV_VAR = "KANALOOP_SHARD_WORKERS"
+METRICS_PORT_ENV_VAR = "KANALOOP_METRICS_PORT"
+METRICS_PORT = 2701
+PREWARM_ENV_VAR = "KANALOOP_PREWARM"
+CACHE_SIZE_ENV_VAR = "KANALOOP_RECOGNIZER_CACHE_SIZE"
+CACHE_MB_ENV_VAR = "KANALOOP_RECOGNIZER_CACHE_MB"
+DEFAULT_CACHE_SIZE = 16
+DEFAULT_CACHE_MB = 256
+# Kaldi does not report per-recognizer memory, so the cache budget is charged
+# with an estimate: a fixed decoder footprint plus the compiled grammar graph,
+# which grows roughly with the grammar text.
+RECOGNIZER_BASE_BYTES = 4 * 1024 * 1024
+RECOGNIZER_BYTES_PER_GRAMMAR_CHAR = 16 * 1024
+# Fed to pre-warmed recognizers so Kaldi's lazy per-decoder setup happens
+# before the first real frame: 100 ms of silence.
+WARMUP_AUDIO = bytes(SAMPLE_RATE // 10 * 2)
+PARTIAL_MODES = ("all", "changes", "off")
+# Bytes a partial message adds around the recognizer's own JSON; used to
+# estimate the bandwidth saved by suppressed partials without encoding them.
+PARTIAL_ENVELOPE_BYTES = len('{"type": "partial", "result": }')
+MODEL_FAILED_ERROR = json.dumps({"type": "error", "error": "model failed to load"})
+STARTUP_PROFILE_POLL_SECONDS = 0.01
 
 
 logging.basicConfig(level=logging.INFO, format="%(message)s")
@@ -54,57 +138,774 @@ def format_client_identity(websocket) -> str:
     return "unknown"
 
 
-async def handle_connection(websocket):
-    recognizer = make_recognizer()
-    async for message in websocket:
-        if isinstance(message, str):
-            try:
-                msg = json.loads(message)
-            except json.JSONDecodeError:
-                client = format_client_identity(websocket)
-                logging.warning(
-                    "JSON decode failed from %s: %s", client, message
-                )
-                continue
+def read_env_int(name: str, default: int, minimum: int = 0) -> int:
+    env_value = os.environ.get(name)
+    if env_value:
+        try:
+            return max(minimum, int(env_value))
+        except ValueError:
+            logging.warning("Ignoring invalid %s=%r", name, env_value)
+    return default
 
-            if msg.get("type") == "set_grammar":
-                grammar = msg.get("grammar", [])
-                if not (
-                    isinstance(grammar, list)
-                    and all(isinstance(item, str) for item in grammar)
-                ):
-                    await websocket.send(
-                        json.dumps(
-                            {
-                                "type": "grammar_ack",
-                                "ok": False,
-                                "error": "grammar must be a list of strings",
-                            }
-                        )
-                    )
+
+def resolve_decode_workers() -> int:
+    return read_env_int(DECODE_WORKERS_ENV_VAR, os.cpu_count() or 1, minimum=1)
+
+
+def canonical_grammar(grammar) -> str:
+    """Returns the cache key for a grammar; order and duplicates do not matter."""
+    if not grammar:
+        return ""
+    return json.dumps(sorted(set(grammar)), ensure_ascii=False)
+
+
+def estimate_recognizer_bytes(grammar_key: str) -> int:
+    return RECOGNIZER_BASE_BYTES + RECOGNIZER_BYTES_PER_GRAMMAR_CHAR * len(grammar_key)
+
+
+class RecognizerCache:
+    """LRU pool of idle recognizers keyed by canonical grammar JSON.
+
+    A connection checks a recognizer out with ``acquire`` and hands it back
+    with ``release`` when it switches grammar or disconnects. Checked-out
+    recognizers are never shared, so two connections on the same grammar get
+    two recognizers; only idle ones count against the size and memory caps.
+    """
+
+    def __init__(self, factory, max_entries, max_bytes):
+        self._factory = factory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._idle = OrderedDict()
+        self._idle_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prewarmed = 0
+        self.creation_seconds = Histogram()
+
+    def acquire(self, grammar_key):
+        with self._lock:
+            entry = self._idle.pop(grammar_key, None)
+            if entry is not None:
+                self._idle_bytes -= entry[1]
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is not None:
+            recognizer = entry[0]
+            recognizer.Reset()
+            return recognizer
+        start = time.perf_counter()
+        recognizer = self._factory(grammar_key)
+        self.creation_seconds.observe(time.perf_counter() - start)
+        return recognizer
+
+    def release(self, grammar_key, recognizer):
+        if self.max_entries <= 0:
+            return
+        size = estimate_recognizer_bytes(grammar_key)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if grammar_key in self._idle:
+                # Another connection already parked one for this grammar.
+                self._idle.move_to_end(grammar_key)
+                return
+            self._idle[grammar_key] = (recognizer, size)
+            self._idle_bytes += size
+            while (
+                len(self._idle) > self.max_entries
+                or self._idle_bytes > self.max_bytes
+            ):
+                _, (_, evicted_size) = self._idle.popitem(last=False)
+                self._idle_bytes -= evicted_size
+                self.evictions += 1
+
+    def prewarm(self, grammar_keys):
+        """Parks a fresh recognizer for each key until the cache is full.
+
+        Keys are taken in order, so list the likeliest first. Returns how many
+        recognizers were added.
+        """
+        added = 0
+        for grammar_key in grammar_keys:
+            size = estimate_recognizer_bytes(grammar_key)
+            with self._lock:
+                if grammar_key in self._idle:
                     continue
-                preview = grammar[:5]
-                logging.info(
-                    "Received grammar with %d entries; preview=%s",
-                    len(grammar),
-                    preview,
+                if (
+                    len(self._idle) >= self.max_entries
+                    or self._idle_bytes + size > self.max_bytes
+                ):
+                    break
+            start = time.perf_counter()
+            recognizer = self._factory(grammar_key)
+            recognizer.AcceptWaveform(WARMUP_AUDIO)
+            recognizer.Reset()
+            self.creation_seconds.observe(time.perf_counter() - start)
+            self.prewarmed += 1
+            self.release(grammar_key, recognizer)
+            added += 1
+        return added
+
+    def stats(self):
+        with self._lock:
+            entries = len(self._idle)
+            idle_bytes = self._idle_bytes
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "estimated_bytes": idle_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "prewarmed": self.prewarmed,
+            "creation_seconds": self.creation_seconds.snapshot(),
+        }
+
+    def metric_families(self):
+        stats = self.stats()
+
+        def family(kind, help_text, value):
+            return {"kind": kind, "help": help_text, "series": [[{}, value]]}
+
+        return {
+            "kanaloop_recognizer_creations_total": family(
+                "counter",
+                "Recognizers built, on a cache miss or by pre-warming.",
+                stats["misses"] + stats["prewarmed"],
+            ),
+            "kanaloop_recognizer_creation_seconds": family(
+                "histogram", "Time to build a recognizer.", stats["creation_seconds"]
+            ),
+            "kanaloop_grammar_cache_hits_total": family(
+                "counter", "Grammar switches served by an idle recognizer.", stats["hits"]
+            ),
+            "kanaloop_grammar_cache_evictions_total": family(
+                "counter", "Idle recognizers dropped by the cache caps.", stats["evictions"]
+            ),
+            "kanaloop_grammar_cache_entries": family(
+                "gauge", "Idle recognizers held by the cache.", stats["entries"]
+            ),
+            "kanaloop_grammar_cache_estimated_bytes": family(
+                "gauge", "Estimated memory of idle recognizers.", stats["estimated_bytes"]
+            ),
+        }
+
+
+def create_recognizer_cache(model):
+    cache = RecognizerCache(
+        partial(make_recognizer, model),
+        max_entries=read_env_int(CACHE_SIZE_ENV_VAR, DEFAULT_CACHE_SIZE),
+        max_bytes=read_env_int(CACHE_MB_ENV_VAR, DEFAULT_CACHE_MB) * 1024 * 1024,
+    )
+    METRICS.add_collector(cache.metric_families)
+    return cache
+
+
+def prewarm_grammar_keys():
+    # The unrestricted recognizer comes first: every session starts on it.
+    return [""] + [canonical_grammar(grammar) for grammar in standard_kana_grammars()]
+
+
+class ServiceStartup:
+    """Startup progress reported by the ``status`` message.
+
+    The socket is bound before the model loads, so clients connect at once and
+    poll ``status`` rather than retrying the connection. ``state`` goes
+    ``loading`` -> ``warming`` (sessions are served; recognizers are still
+    being pre-built) -> ``ready``, or ends in ``failed``. In shard mode the
+    state is derived from the workers instead.
+    """
+
+    def __init__(self):
+        self.state = "loading"
+        self.error = None
+        self.timings = {}
+        self.prewarmed = 0
+        self.model_task = None
+        self.worker_status = None
+
+    def record(self, phase, start):
+        self.timings[f"{phase}_seconds"] = round(time.perf_counter() - start, 3)
+
+    def finish(self, state):
+        self.state = state
+        self.timings["total_seconds"] = round(time.perf_counter() - STARTED_AT, 3)
+
+    def status_reply(self):
+        status = {
+            "type": "status",
+            "state": self.state,
+            "uptime_seconds": round(time.perf_counter() - STARTED_AT, 3),
+            "timings": dict(self.timings),
+            "prewarmed": self.prewarmed,
+        }
+        if MODEL_REGISTRY is not None:
+            status["models"] = MODEL_REGISTRY.footprints()
+        if self.worker_status is not None:
+            workers = self.worker_status()
+            states = {worker["state"] for worker in workers}
+            failed = [worker for worker in workers if worker["state"] == "failed"]
+            if failed:
+                # Workers share one model; if it fails for one, it fails.
+                status["state"] = "failed"
+                status["error"] = failed[0]["error"]
+            elif states == {"ready"}:
+                status["state"] = "ready"
+            elif states == {"loading"}:
+                status["state"] = "loading"
+            else:
+                status["state"] = "warming"
+            status["prewarmed"] = sum(worker["prewarmed"] for worker in workers)
+            status["workers"] = workers
+        if self.error is not None:
+            status["error"] = self.error
+        return json.dumps(status)
+
+
+class DecodeLane:
+    """Serializes one connection's recognizer calls onto the shared decode pool.
+
+    Kaldi calls release the GIL, so running them on worker threads keeps the
+    event loop free for socket I/O while frames from different connections
+    decode in parallel. Calls for a single connection still run one at a time
+    because a recognizer is not thread-safe.
+    """
+
+    def __init__(self, executor):
+        self._executor = executor
+        self._lock = asyncio.Lock()
+
+    async def run(self, func, *args):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+
+
+METRICS = MetricsRegistry()
+ACTIVE_SESSIONS = METRICS.gauge(
+    "kanaloop_active_sessions", "Open recognition sessions."
+)
+INGEST_METRICS = IngestMetrics(METRICS)
+# Audio and decode CPU are split by whether the session's voice gate was on,
+# so the saving can be read off as CPU seconds per minute of incoming audio.
+GATE_STATES = ("on", "off")
+AUDIO_SECONDS = {
+    state: METRICS.counter(
+        "kanaloop_audio_seconds_total",
+        "Seconds of audio received.",
+        {"voice_gate": state},
+    )
+    for state in GATE_STATES
+}
+DECODE_CPU_SECONDS = {
+    state: METRICS.counter(
+        "kanaloop_decode_cpu_seconds_total",
+        "Thread CPU time spent decoding.",
+        {"voice_gate": state},
+    )
+    for state in GATE_STATES
+}
+DECODE_WALL_SECONDS = METRICS.counter(
+    "kanaloop_decode_wall_seconds_total", "Wall time spent decoding."
+)
+DECODE_CHUNK_SECONDS = METRICS.histogram(
+    "kanaloop_decode_chunk_seconds",
+    "Wall time to decode one chunk of (possibly merged) frames.",
+)
+FRAME_TO_PARTIAL_SECONDS = METRICS.histogram(
+    "kanaloop_frame_to_partial_seconds",
+    "From receiving a frame to sending the partial it produced.",
+)
+# End of speech is the client's final/eof request, or the last voiced frame
+# when the voice gate is on and Kaldi's endpointer closes the utterance.
+SPEECH_END_TO_FINAL_SECONDS = METRICS.histogram(
+    "kanaloop_speech_end_to_final_seconds",
+    "From the end of speech to the final result.",
+)
+PARTIALS_SENT = METRICS.counter(
+    "kanaloop_partials_sent_total", "Partial results sent."
+)
+PARTIALS_SUPPRESSED = METRICS.counter(
+    "kanaloop_partials_suppressed_total", "Partial results dropped by partial policies."
+)
+PARTIALS_SUPPRESSED_BYTES = METRICS.counter(
+    "kanaloop_partials_suppressed_bytes_total",
+    "Estimated bytes saved by suppressed partials.",
+)
+EVENT_LOOP_LAG_SECONDS = METRICS.histogram(
+    "kanaloop_event_loop_lag_seconds", "How late event-loop timers fire."
+)
+EVENT_LOOP_LAG_LAST = METRICS.gauge(
+    "kanaloop_event_loop_lag_last_seconds", "Most recent event-loop lag sample."
+)
+
+
+def cpu_per_audio_minute(audio_seconds, cpu_seconds):
+    if audio_seconds <= 0:
+        return 0.0
+    return cpu_seconds * 60.0 / audio_seconds
+
+
+def partial_totals():
+    return {
+        "sent": int(PARTIALS_SENT.value),
+        "suppressed": int(PARTIALS_SUPPRESSED.value),
+        "suppressed_bytes": int(PARTIALS_SUPPRESSED_BYTES.value),
+    }
+
+
+def decode_totals_snapshot():
+    totals = {}
+    for state in GATE_STATES:
+        audio_seconds = AUDIO_SECONDS[state].value
+        cpu_seconds = DECODE_CPU_SECONDS[state].value
+        totals[f"gate_{state}"] = {
+            "audio_seconds": audio_seconds,
+            "cpu_seconds": cpu_seconds,
+            "cpu_seconds_per_audio_minute": cpu_per_audio_minute(
+                audio_seconds, cpu_seconds
+            ),
+        }
+    return totals
+
+
+def observe_result_latency(result_type, from_control, received_at):
+    """Records how long a sent result took from the message that caused it."""
+    elapsed = time.monotonic() - received_at
+    if result_type == "partial":
+        FRAME_TO_PARTIAL_SECONDS.observe(elapsed)
+    elif result_type == "final" and from_control:
+        SPEECH_END_TO_FINAL_SECONDS.observe(elapsed)
+
+
+def render_metrics(worker_snapshots=()):
+    snapshot = merge_snapshots([METRICS.snapshot(), *worker_snapshots])
+    audio_seconds = family_total(snapshot, "kanaloop_audio_seconds_total")
+    decode_seconds = family_total(snapshot, "kanaloop_decode_wall_seconds_total")
+    snapshot["kanaloop_real_time_factor"] = {
+        "kind": "gauge",
+        "help": "Decode wall time per second of audio received.",
+        "series": [[{}, decode_seconds / audio_seconds if audio_seconds else 0.0]],
+    }
+    return render_prometheus(snapshot)
+
+
+def count_active_sessions(handler):
+    async def counted(websocket):
+        ACTIVE_SESSIONS.inc()
+        try:
+            await handler(websocket)
+        finally:
+            ACTIVE_SESSIONS.dec()
+
+    return counted
+
+
+class PartialPolicy:
+    """Decides which partial results a session actually sends.
+
+    ``mode`` is ``all`` (every frame), ``changes`` (only when the partial text
+    differs from the last one sent) or ``off`` (finals only).
+    ``max_per_second`` additionally caps the send rate; 0 means no cap.
+    Partials are compared as the raw recognizer JSON, so suppressed ones never
+    pay for a parse or an encode. In uncapped ``changes`` mode, bindings that
+    can tell whether the partial changed skip even fetching an unchanged one.
+    """
+
+    def __init__(self):
+        self.mode = "all"
+        self.max_per_second = 0
+        self._last_sent_raw = None
+        self._last_sent_at = 0.0
+        self.sent = 0
+        self.suppressed = 0
+        self.suppressed_bytes = 0
+
+    def configure(self, msg):
+        mode = msg.get("mode", self.mode)
+        max_per_second = msg.get("max_per_second", self.max_per_second)
+        if mode not in PARTIAL_MODES:
+            return "mode must be one of: " + ", ".join(PARTIAL_MODES)
+        if (
+            isinstance(max_per_second, bool)
+            or not isinstance(max_per_second, (int, float))
+            or max_per_second < 0
+        ):
+            return "max_per_second must be a non-negative number"
+        self.mode = mode
+        self.max_per_second = max_per_second
+        return None
+
+    @property
+    def skips_unchanged(self):
+        # Only then is "changed since the last poll" the same test as
+        # "differs from the last partial sent".
+        return self.mode == "changes" and not self.max_per_second
+
+    def suppress_unchanged(self):
+        return self._suppress(self._last_sent_raw or "")
+
+    def should_send(self, raw_partial, now):
+        if self.mode == "off":
+            return self._suppress(raw_partial)
+        if self.mode == "changes" and raw_partial == self._last_sent_raw:
+            return self._suppress(raw_partial)
+        if (
+            self.max_per_second
+            and now - self._last_sent_at < 1.0 / self.max_per_second
+        ):
+            return self._suppress(raw_partial)
+        self._last_sent_raw = raw_partial
+        self._last_sent_at = now
+        self.sent += 1
+        PARTIALS_SENT.inc()
+        return True
+
+    def reset_utterance(self):
+        self._last_sent_raw = None
+
+    def _suppress(self, raw_partial):
+        size = len(raw_partial.encode("utf-8")) + PARTIAL_ENVELOPE_BYTES
+        self.suppressed += 1
+        self.suppressed_bytes += size
+        PARTIALS_SUPPRESSED.inc()
+        PARTIALS_SUPPRESSED_BYTES.inc(size)
+        return False
+
+
+def decode_frame(recognizer, data, skip_unchanged=False):
+    """Returns ``(result_type, raw_json)``. With ``skip_unchanged``, a partial
+    the bundled bindings report as unchanged comes back as None, undecoded."""
+    if recognizer.AcceptWaveform(data):
+        return "final", recognizer.Result()
+    if skip_unchanged and hasattr(recognizer, "PartialResultChanged"):
+        if not recognizer.PartialResultChanged():
+            return "partial", None
+        return "partial", recognizer.LastPartialResult()
+    return "partial", recognizer.PartialResult()
+
+
+def flush_utterance(recognizer):
+    """Forces out the final result without waiting for Kaldi's endpointer."""
+    raw_result = recognizer.FinalResult()
+    recognizer.Reset()
+    return raw_result
+
+
+class RecognitionSession:
+    """Recognition state for one client, independent of how it is connected.
+
+    ``handle`` takes one incoming WebSocket message (a JSON control message or
+    a binary PCM frame) and returns the replies to send plus whether the
+    stream should end. It blocks on Kaldi, so callers run it on a decode lane
+    or inside a shard worker process, never on the event loop. On a
+    multiplexed connection every reply is tagged with ``stream_id``.
+    """
+
+    def __init__(self, cache, client="unknown", binary_framing=False, stream_id=None):
+        self.cache = cache
+        self.client = client
+        self.stream_id = stream_id
+        self.encode_result = partial(
+            encode_result_binary if binary_framing else encode_result_text,
+            stream_id=stream_id,
+        )
+        self.partials = PartialPolicy()
+        self.audio_format = AudioFormat(
+            SAMPLE_RATE,
+            buffer_output=getattr(KaldiRecognizer, "accepts_buffers", False),
+        )
+        self.gate = VoiceGate(SAMPLE_RATE)
+        self.audio_seconds = 0.0
+        self.decode_cpu_seconds = 0.0
+        self.last_voiced_at = None
+        # The kind of result ("partial"/"final") the last handled message sent.
+        self.last_result_type = None
+        self.grammar_key = ""
+        self.recognizer = cache.acquire(self.grammar_key)
+
+    def handle(self, message):
+        self.last_result_type = None
+        if isinstance(message, str):
+            return self.handle_control(message)
+        return self.accept_audio(message), False
+
+    def accept_audio(self, data):
+        received_at = time.monotonic()
+        data = self.audio_format.convert(data)
+        audio_seconds = len(data) / (2 * SAMPLE_RATE)
+        gate_state = "on" if self.gate.enabled else "off"
+        self.audio_seconds += audio_seconds
+        AUDIO_SECONDS[gate_state].inc(audio_seconds)
+        data = self.gate.process(data)
+        if not data:
+            return []
+        if self.gate.enabled and self.gate.last_frame_voiced:
+            self.last_voiced_at = received_at
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        result_type, raw_result = decode_frame(
+            self.recognizer, data, self.partials.skips_unchanged
+        )
+        cpu_seconds = time.thread_time() - cpu_start
+        wall_seconds = time.perf_counter() - wall_start
+        self.decode_cpu_seconds += cpu_seconds
+        DECODE_CPU_SECONDS[gate_state].inc(cpu_seconds)
+        DECODE_WALL_SECONDS.inc(wall_seconds)
+        DECODE_CHUNK_SECONDS.observe(wall_seconds)
+        if result_type == "partial":
+            if raw_result is None:
+                self.partials.suppress_unchanged()
+                return []
+            if not self.partials.should_send(raw_result, time.monotonic()):
+                return []
+        else:
+            self.partials.reset_utterance()
+            if self.last_voiced_at is not None:
+                SPEECH_END_TO_FINAL_SECONDS.observe(
+                    time.monotonic() - self.last_voiced_at
                 )
-                recognizer = make_recognizer(grammar)
-                await websocket.send(
-                    json.dumps({"type": "grammar_ack", "ok": True, "grammar": grammar})
+                self.last_voiced_at = None
+        self.last_result_type = result_type
+        return [self.encode_result(result_type, raw_result)]
+
+    def handle_control(self, message):
+        try:
+            msg = json.loads(message)
+        except json.JSONDecodeError:
+            logging.warning("JSON decode failed from %s: %s", self.client, message)
+            return [], False
+
+        msg_type = msg.get("type")
+        if msg_type == "set_grammar":
+            return [self.set_grammar(msg.get("grammar", []))], False
+        if msg_type in ("final", "eof"):
+            raw_result = flush_utterance(self.recognizer)
+            self.partials.reset_utterance()
+            self.last_voiced_at = None
+            self.last_result_type = "final"
+            return [self.encode_result("final", raw_result)], msg_type == "eof"
+        if msg_type == "reset":
+            self.recognizer.Reset()
+            self.partials.reset_utterance()
+            self.gate.reset()
+            self.audio_format.reset()
+            self.last_voiced_at = None
+            return [self.reply({"type": "reset_ack", "ok": True})], False
+        if msg_type == "partial_policy":
+            error = self.partials.configure(msg)
+            ack = {
+                "type": "partial_policy_ack",
+                "ok": error is None,
+                "mode": self.partials.mode,
+                "max_per_second": self.partials.max_per_second,
+            }
+            if error is not None:
+                ack["error"] = error
+            return [self.reply(ack)], False
+        if msg_type == "audio_format":
+            error = self.audio_format.configure(msg)
+            ack = {
+                "type": "audio_format_ack",
+                "ok": error is None,
+                **self.audio_format.describe(),
+            }
+            if error is not None:
+                ack["error"] = error
+            return [self.reply(ack)], False
+        if msg_type == "vad":
+            error = self.gate.configure(msg)
+            ack = {"type": "vad_ack", "ok": error is None, **self.gate.describe()}
+            if error is not None:
+                ack["error"] = error
+            return [self.reply(ack)], False
+        if msg_type == "stats":
+            stats = {
+                "type": "stats",
+                "recognizer_cache": self.cache.stats(),
+                "partials": partial_totals(),
+                "decode_cpu": decode_totals_snapshot(),
+                "session": {
+                    "audio_seconds": self.audio_seconds,
+                    "decode_cpu_seconds": self.decode_cpu_seconds,
+                    "audio_format": self.audio_format.describe(),
+                    "vad": self.gate.describe(),
+                    "vad_skipped_bytes": self.gate.bytes_skipped,
+                },
+            }
+            return [self.reply(stats)], False
+        return [], False
+
+    def set_grammar(self, grammar):
+        if not (
+            isinstance(grammar, list)
+            and all(isinstance(item, str) for item in grammar)
+        ):
+            return self.reply(
+                {
+                    "type": "grammar_ack",
+                    "ok": False,
+                    "error": "grammar must be a list of strings",
+                }
+            )
+        preview = grammar[:5]
+        logging.info(
+            "Received grammar with %d entries; preview=%s",
+            len(grammar),
+            preview,
+        )
+        new_key = canonical_grammar(grammar)
+        if new_key != self.grammar_key:
+            self.cache.release(self.grammar_key, self.recognizer)
+            # Drop the reference first so a failed acquire cannot release the
+            # same recognizer twice from close().
+            self.grammar_key, self.recognizer = "", None
+            self.recognizer = self.cache.acquire(new_key)
+            self.grammar_key = new_key
+        return self.reply({"type": "grammar_ack", "ok": True, "grammar": grammar})
+
+    def reply(self, payload):
+        if self.stream_id is not None:
+            payload["stream"] = self.stream_id
+        return json.dumps(payload)
+
+    def close(self):
+        if self.audio_seconds > 0:
+            logging.info(
+                "Session %s decoded %.1fs of audio with %.2fs CPU "
+                "(%.2fs per audio minute, voice gate %s, %d bytes skipped)",
+                self.client,
+                self.audio_seconds,
+                self.decode_cpu_seconds,
+                cpu_per_audio_minute(self.audio_seconds, self.decode_cpu_seconds),
+                "on" if self.gate.enabled else "off",
+                self.gate.bytes_skipped,
+            )
+        if self.partials.suppressed:
+            logging.info(
+                "Session %s suppressed %d of %d partials (~%d bytes)",
+                self.client,
+                self.partials.suppressed,
+                self.partials.suppressed + self.partials.sent,
+                self.partials.suppressed_bytes,
+            )
+        if self.recognizer is not None:
+            self.cache.release(self.grammar_key, self.recognizer)
+            self.recognizer = None
+
+
+class LocalStream:
+    """One logical stream decoded in this process, on its own decode lane."""
+
+    def __init__(self, websocket, stream_id):
+        self.ingest = IngestQueue(SAMPLE_RATE, INGEST_METRICS)
+        self.decoder = asyncio.create_task(
+            decode_ingest(websocket, self.ingest, stream_id)
+        )
+
+    def done(self):
+        return self.decoder.done()
+
+    async def close(self):
+        self.ingest.close()
+        # Not cancelled: a decode in flight must finish before the session's
+        # recognizer goes back to the cache.
+        try:
+            await self.decoder
+        except websockets.ConnectionClosed:
+            # The client went away with control messages still queued.
+            pass
+
+
+async def handle_connection(websocket):
+    await serve_streams(
+        websocket, partial(LocalStream, websocket), STARTUP.status_reply
+    )
+
+
+async def decode_ingest(websocket, ingest, stream_id=None):
+    lane = DecodeLane(DECODE_EXECUTOR)
+    client = format_client_identity(websocket)
+    binary_framing = uses_binary_results(websocket.subprotocol)
+    session = None
+    try:
+        while True:
+            item = await ingest.get()
+            if item is None:
+                return
+            message, received_at = item
+            if session is None:
+                if not await asyncio.shield(STARTUP.model_task):
+                    await websocket.send(tag_stream(MODEL_FAILED_ERROR, stream_id))
+                    await end_stream(websocket, stream_id, "error")
+                    return
+                session = await lane.run(
+                    RecognitionSession,
+                    RECOGNIZER_CACHE,
+                    client,
+                    binary_framing,
+                    stream_id,
                 )
-            continue
+            replies, should_close = await lane.run(session.handle, message)
+            for reply in replies:
+                await websocket.send(reply)
+            observe_result_latency(
+                session.last_result_type, isinstance(message, str), received_at
+            )
+            if should_close:
+                await end_stream(websocket, stream_id, "eof")
+                return
+    finally:
+        ingest.close()
+        if session is not None:
+            session.close()
 
-        if recognizer.AcceptWaveform(message):
-            result = json.loads(recognizer.Result())
-            await websocket.send(json.dumps({"type": "final", "result": result}))
-        else:
-            result = json.loads(recognizer.PartialResult())
-            await websocket.send(json.dumps({"type": "partial", "result": result}))
 
+async def load_model(startup):
+    """Loads the model off the event loop; returns False if it failed."""
+    global MODEL, RECOGNIZER_CACHE
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    try:
+        MODEL = await loop.run_in_executor(DECODE_EXECUTOR, acquire_model, MODEL_PATH)
+    except Exception as e:
+        logging.error("Failed to load Vosk model or native libraries.")
+        logging.error(str(e))
+        startup.error = str(e)
+        startup.finish("failed")
+        return False
+    startup.record("model_load", start)
+    RECOGNIZER_CACHE = create_recognizer_cache(MODEL)
+    startup.state = "warming"
+    logging.info("Model loaded in %.2fs", startup.timings["model_load_seconds"])
+    return True
+
+
+async def prewarm_recognizers(startup, enabled):
+    if not await asyncio.shield(startup.model_task):
+        return
+    if enabled:
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        startup.prewarmed = await loop.run_in_executor(
+            DECODE_EXECUTOR, RECOGNIZER_CACHE.prewarm, prewarm_grammar_keys()
+        )
+        startup.record("prewarm", start)
+        logging.info(
+            "Pre-warmed %d recognizers in %.2fs",
+            startup.prewarmed,
+            startup.timings["prewarm_seconds"],
+        )
+    startup.finish("ready")
+    logging.info("Vosk server ready")
 
 
-def resolve_model_path() -> Path:
+def model_candidates():
     candidates = []
     env_value = os.environ.get(MODEL_ENV_VAR)
     if env_value:
@@ -123,30 +924,236 @@ def resolve_model_path() -> Path:
     executable_root = Path(sys.executable).resolve().parent
     candidates.append(executable_root / "models" / MODEL_NAME)
     candidates.append(executable_root.parent / "models" / MODEL_NAME)
+    return candidates
 
-    for candidate in candidates:
-        if candidate.is_dir():
-            return candidate
-    raise SystemExit(
-        "Model path not found. Checked:\n"
-        + "\n".join(str(candidate) for candidate in candidates)
+
+def resolve_model_path(verify=False, rebuild=False) -> Path:
+    """Finds the model and checks that it is complete. With the bundled
+    bindings the model comes from their cached catalog, which only lists
+    and stats files, so nothing here reads the model's data unless verify
+    asks to hash it against the catalog's checksum, or rebuild to record a
+    new one."""
+    candidates = model_candidates()
+    if ModelCatalog is None:
+        found = next((candidate for candidate in candidates if candidate.is_dir()), None)
+    else:
+        catalog = ModelCatalog([candidate.parent for candidate in candidates])
+        model = catalog.find(model_name=MODEL_NAME)
+        found = None if model is None else Path(model["path"])
+    if found is None:
+        raise SystemExit(
+            "Model path not found. Checked:\n"
+            + "\n".join(str(candidate) for candidate in candidates)
+        )
+    if ModelCatalog is not None:
+        if rebuild:
+            catalog.rebuild(found)
+        problems = catalog.validate(found, deep=verify)
+        if problems:
+            raise SystemExit(
+                f"Model at {found} is incomplete or corrupt; reinstall it.\n"
+                + "\n".join(problems)
+            )
+    return found
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="KanaLoop Vosk WebSocket service.")
+    parser.add_argument("--port", type=int, default=PORT, help="WebSocket port.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=read_env_int(SHARD_WORKERS_ENV_VAR, 0),
+        help=(
+            "Decode in this many worker processes, each loading the model "
+            "once. 0 (default) decodes in-process on a thread pool."
+        ),
+    )
+    parser.add_argument(
+        "--pin-cpus",
+        action="store_true",
+        help="Pin each worker process to its own CPU core.",
     )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=read_env_int(METRICS_PORT_ENV_VAR, METRICS_PORT),
+        help="Serve Prometheus metrics on this local port; 0 disables them.",
+    )
+    parser.add_argument(
+        "--prewarm",
+        action="store_true",
+        default=bool(read_env_int(PREWARM_ENV_VAR, 0)),
+        help=(
+            "Pre-build recognizers for the standard kana grammars, as many as "
+            "the recognizer cache holds, before reporting ready."
+        ),
+    )
+    parser.add_argument(
+        "--stub-recognizer",
+        action="store_true",
+        help=(
+            "Answer with a deterministic stand-in recognizer instead of Vosk; "
+            "no model is needed. For load tests and CI."
+        ),
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help=(
+            "Once startup finishes, print where the time went (imports, vosk "
+            "import and DLL open, model load, pre-warm, socket bind) as one "
+            "JSON line and exit; status 1 if startup failed."
+        ),
+    )
+    parser.add_argument(
+        "--verify-model",
+        action="store_true",
+        help=(
+            "Check the model's files against the checksum in the model "
+            "catalog (recording one on the first check), print the result "
+            "and exit; status 1 if it is corrupt."
+        ),
+    )
+    parser.add_argument(
+        "--rebuild-model-checksum",
+        action="store_true",
+        help=(
+            "Record the checksum of the model's current files in the model "
+            "catalog, after replacing them on purpose, and exit."
+        ),
+    )
+    return parser.parse_args()
 
 
-async def main():
-    async with websockets.serve(handle_connection, HOST, PORT):
-        logging.info("Vosk server ready")
-        logging.info("Listening on ws://%s:%s", HOST, PORT)
-        logging.info("Model path: %s", MODEL_PATH)
-        await asyncio.Future()
+async def report_startup_profile(stop):
+    while True:
+        status = json.loads(STARTUP.status_reply())
+        # Startup can finish before the bind is recorded with the stub.
+        bound = "bind_seconds" in status["timings"]
+        if status["state"] == "failed" or (status["state"] == "ready" and bound):
+            break
+        await asyncio.sleep(STARTUP_PROFILE_POLL_SECONDS)
+    profile = {
+        "type": "startup_profile",
+        "state": status["state"],
+        "frozen": bool(getattr(sys, "frozen", False)),
+        "seconds_since_start": round(time.perf_counter() - STARTED_AT, 3),
+        "timings": status["timings"],
+        "modules_loaded": len(sys.modules),
+    }
+    if "workers" in status:
+        profile["workers"] = [worker["timings"] for worker in status["workers"]]
+    if "error" in status:
+        profile["error"] = status["error"]
+    print(json.dumps(profile), flush=True)
+    stop.set_result(status["state"])
 
 
-if __name__ == "__main__":
-    MODEL_PATH = resolve_model_path()
+async def main(args):
+    """Serves until interrupted; with --profile-startup, returns the startup
+    state once it has been reported."""
+    bind_start = time.perf_counter()
+    stop = asyncio.get_running_loop().create_future()
+    handler = handle_connection
+    supervisor = None
+    background = []
+    if args.workers > 0:
+        from vosk_shards import ShardSupervisor
+
+        supervisor = ShardSupervisor(
+            MODEL_PATH,
+            args.workers,
+            format_client_identity,
+            partial(IngestQueue, SAMPLE_RATE, INGEST_METRICS),
+            pin_cpus=args.pin_cpus,
+            prewarm=args.prewarm,
+            stub=args.stub_recognizer,
+            observe_result=observe_result_latency,
+            status_reply=STARTUP.status_reply,
+        )
+        supervisor.start()
+        STARTUP.worker_status = supervisor.worker_status
+        handler = supervisor.handle_connection
+    else:
+        STARTUP.model_task = asyncio.create_task(load_model(STARTUP))
+        background.append(
+            asyncio.create_task(prewarm_recognizers(STARTUP, args.prewarm))
+        )
+    background.append(
+        asyncio.create_task(
+            monitor_event_loop_lag(EVENT_LOOP_LAG_SECONDS, EVENT_LOOP_LAG_LAST)
+        )
+    )
+    if args.profile_startup:
+        background.append(asyncio.create_task(report_startup_profile(stop)))
+    metrics_server = None
     try:
-        MODEL = Model(str(MODEL_PATH))
-    except Exception as e:
-        logging.error("Failed to load Vosk model or native libraries.")
-        logging.error(str(e))
-        raise
-    asyncio.run(main())
+        if args.metrics_port > 0:
+            worker_metrics = supervisor.worker_metrics if supervisor else tuple
+            metrics_server = await serve_metrics(
+                HOST, args.metrics_port, lambda: render_metrics(worker_metrics())
+            )
+        async with websockets.serve(
+            count_active_sessions(handler),
+            HOST,
+            args.port,
+            select_subprotocol=select_subprotocol,
+        ):
+            STARTUP.record("bind", bind_start)
+            logging.info("Listening on ws://%s:%s", HOST, args.port)
+            if metrics_server is not None:
+                logging.info(
+                    "Metrics on http://%s:%s/metrics", HOST, args.metrics_port
+                )
+            if args.stub_recognizer:
+                logging.info("Using the stub recognizer; no model is loaded")
+            else:
+                logging.info("Model path: %s", MODEL_PATH)
+            if supervisor is not None:
+                logging.info("Shard workers: %d", args.workers)
+            else:
+                logging.info("Decode workers: %d", DECODE_WORKERS)
+            return await stop
+    finally:
+        for task in background:
+            task.cancel()
+        if metrics_server is not None:
+            metrics_server.close()
+        if supervisor is not None:
+            supervisor.stop()
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    STARTUP = ServiceStartup()
+    ARGS = parse_args()
+    STARTUP.record("imports", STARTED_AT)
+    backend_start = time.perf_counter()
+    use_recognizer_backend(ARGS.stub_recognizer)
+    STARTUP.record("recognizer_import", backend_start)
+    # The bundled bindings time their own DLL open, which is part of the
+    # recognizer import.
+    dll_open_seconds = getattr(sys.modules.get("vosk"), "dll_open_seconds", None)
+    if dll_open_seconds is not None:
+        STARTUP.timings["dll_open_seconds"] = round(dll_open_seconds, 3)
+    if ARGS.stub_recognizer:
+        MODEL_PATH = None
+    else:
+        resolve_start = time.perf_counter()
+        MODEL_PATH = resolve_model_path(
+            ARGS.verify_model, ARGS.rebuild_model_checksum
+        )
+        STARTUP.record("model_resolve", resolve_start)
+        if ARGS.verify_model or ARGS.rebuild_model_checksum:
+            print(f"{MODEL_PATH}: OK")
+            sys.exit(0)
+    if ARGS.workers <= 0:
+        # Shard workers load their own copy; the supervisor never decodes.
+        # The model itself loads in the background once the socket is bound.
+        DECODE_WORKERS = resolve_decode_workers()
+        DECODE_EXECUTOR = ThreadPoolExecutor(
+            max_workers=DECODE_WORKERS, thread_name_prefix="vosk-decode"
+        )
+    if asyncio.run(main(ARGS)) == "failed":
+        sys.exit(1)
@@ -18,7 +18,9 @@ a = Analysis(
     datas=[
         (str(VOSK_DIR), "_internal/vosk"),
     ],
-    hiddenimports=[],
+    # audio_format and voice_gate import NumPy lazily; bundle it so clients
+    # can send float32 or non-16 kHz audio and use the service's voice gate.
+    hiddenimports=["numpy"],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,563 @@
+"""Multi-process recognition shards for vosk_service.
+
+The supervisor keeps the WebSocket server on its event loop and pins every
+session to one of N worker processes. Each worker loads the model once and
+runs the same RecognitionSession objects the single-process server uses, so
+the wire protocol is identical in both modes. Frames and replies travel over
+multiprocessing pipes; the supervisor pings workers and respawns any that
+crash or stop answering. Pongs carry the worker's metrics snapshot, which
+the supervisor merges into its own /metrics output. Each logical stream of
+a multiplexed connection is a session of its own, so a connection's streams
+may decode on different workers.
+"""
+import asyncio
+import collections
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from functools import partial
+
+from service_protocol import tag_stream, uses_binary_results
+from stream_mux import end_stream, serve_streams
+
+HEALTH_INTERVAL_SECONDS = 2.0
+HEALTH_TIMEOUT_SECONDS = 10.0
+STARTUP_TIMEOUT_SECONDS = 120.0
+RESPAWN_BACKOFF_SECONDS = 0.5
+RESPAWN_BACKOFF_MAX_SECONDS = 30.0
+# Frames a session may have queued on its worker before the supervisor stops
+# reading from that socket. Each forwarded message gets exactly one reply.
+MAX_IN_FLIGHT_PER_SESSION = 8
+# How long stream_close waits for a worker to answer what was already sent.
+STREAM_CLOSE_TIMEOUT_SECONDS = 5.0
+# Spawn everywhere so Linux workers start as clean as the Windows ones and do
+# not inherit the supervisor's event loop or threads.
+MP_CONTEXT = multiprocessing.get_context("spawn")
+WORKER_LOST_ERROR = json.dumps(
+    {"type": "error", "error": "recognition worker restarted"}
+)
+WORKER_FAILED_ERROR = json.dumps({"type": "error", "error": "model failed to load"})
+
+
+def pin_to_cpu(cpu):
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, {cpu})
+        elif sys.platform == "win32":
+            import ctypes
+
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetProcessAffinityMask(kernel32.GetCurrentProcess(), 1 << cpu)
+    except (OSError, ValueError) as error:
+        logging.warning("Could not pin worker to CPU %d: %s", cpu, error)
+
+
+def worker_main(conn, model_path, cpu, prewarm=False, stub=False):
+    # Imported here so spawned workers pick up the service module without
+    # running its __main__ block.
+    import vosk_service
+
+    vosk_service.use_recognizer_backend(stub)
+    if cpu is not None:
+        pin_to_cpu(cpu)
+    start = time.perf_counter()
+    try:
+        model = vosk_service.acquire_model(model_path)
+        cache = vosk_service.create_recognizer_cache(model)
+    except Exception as error:
+        # Every worker loads the same model, so a respawn would only fail
+        # again; report it and let the supervisor mark startup failed.
+        logging.exception("Failed to load Vosk model or native libraries.")
+        conn.send(("failed", os.getpid(), str(error)))
+        return
+    load_seconds = round(time.perf_counter() - start, 3)
+    models = vosk_service.MODEL_REGISTRY
+    conn.send(
+        (
+            "ready",
+            os.getpid(),
+            {
+                "model_load_seconds": load_seconds,
+                "models": models.footprints() if models is not None else [],
+            },
+        )
+    )
+    # Sessions opened meanwhile wait in the pipe until pre-warming is done.
+    start = time.perf_counter()
+    prewarmed = cache.prewarm(vosk_service.prewarm_grammar_keys()) if prewarm else 0
+    conn.send(
+        (
+            "warm",
+            os.getpid(),
+            {
+                "prewarm_seconds": round(time.perf_counter() - start, 3),
+                "prewarmed": prewarmed,
+            },
+        )
+    )
+    sessions = {}
+    while True:
+        try:
+            op, key, payload = conn.recv()
+        except (EOFError, OSError):
+            break
+        if op == "stop":
+            break
+        if op == "ping":
+            conn.send(("pong", key, vosk_service.METRICS.snapshot()))
+        elif op == "open":
+            try:
+                client, binary_framing, stream_id = payload
+                sessions[key] = vosk_service.RecognitionSession(
+                    cache, client, binary_framing, stream_id
+                )
+            except Exception:
+                logging.exception("Failed to open session %s", payload)
+        elif op == "close":
+            session = sessions.pop(key, None)
+            if session is not None:
+                session.close()
+        elif op == "message":
+            # Replies of None tell the supervisor the session is gone; it
+            # knows which stream to report that on.
+            session = sessions.get(key)
+            if session is None:
+                conn.send(("replies", key, (None, True, None)))
+                continue
+            try:
+                replies, should_close = session.handle(payload)
+                result_type = session.last_result_type
+            except Exception:
+                logging.exception("Session %s failed", session.client)
+                replies, should_close, result_type = None, True, None
+            conn.send(("replies", key, (replies, should_close, result_type)))
+    for session in sessions.values():
+        session.close()
+
+
+class SessionChannel:
+    def __init__(self, worker):
+        self.worker = worker
+        self.replies = asyncio.Queue()
+        self.credits = asyncio.Semaphore(MAX_IN_FLIGHT_PER_SESSION)
+        # (received_at, is_control) for each forwarded message, in reply order.
+        self.pending = collections.deque()
+        # Set whenever pending is empty.
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.lost = False
+
+    def mark_lost(self):
+        self.lost = True
+        self.replies.put_nowait(None)
+        # Wake the reader if it is waiting for credit from the dead worker.
+        self.credits.release()
+
+
+class ShardStream:
+    """Supervisor side of one logical stream: its ingest queue and the tasks
+    moving its messages to and from a worker session."""
+
+    def __init__(self, ingest, channel, writer, forwarder, release):
+        self.ingest = ingest
+        self.channel = channel
+        self.writer = writer
+        self.forwarder = forwarder
+        self._release = release
+
+    def done(self):
+        return self.channel.lost or self.writer.done() or self.forwarder.done()
+
+    async def close(self):
+        self.ingest.close()
+        # As in-process, control messages queued before the close still go
+        # to the worker and their replies reach the client; only then are
+        # the tasks cancelled and the worker session closed.
+        try:
+            await asyncio.wait_for(self._drain(), STREAM_CLOSE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            logging.warning("Stream closed with replies still pending")
+        for task in (self.writer, self.forwarder):
+            task.cancel()
+            if task.done() and not task.cancelled():
+                # Retrieved so a send to a closed socket is not logged.
+                task.exception()
+        self._release()
+
+    async def _drain(self):
+        await asyncio.wait([self.forwarder])
+        idle = asyncio.ensure_future(self.channel.idle.wait())
+        try:
+            await asyncio.wait(
+                [self.writer, idle], return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            idle.cancel()
+
+
+class ShardWorker:
+    """One worker process plus the supervisor-side threads that feed it."""
+
+    def __init__(self, index, model_path, cpu, prewarm=False, stub=False):
+        self.index = index
+        self.model_path = model_path
+        self.cpu = cpu
+        self.prewarm = prewarm
+        self.stub = stub
+        self.generation = 0
+        self.process = None
+        self.conn = None
+        self.pid = None
+        self.ready = False
+        self.warm = False
+        self.error = None
+        self.timings = {}
+        self.prewarmed = 0
+        self.models = []
+        self.started_at = 0.0
+        self.last_pong = 0.0
+        self.restarts = 0
+        self.respawning = False
+        self.backoff = RESPAWN_BACKOFF_SECONDS
+        self.sessions = set()
+        self.metrics = None
+        self._outbox = None
+
+    def start(self, loop, on_message, on_lost):
+        self.generation += 1
+        parent_conn, child_conn = MP_CONTEXT.Pipe()
+        self.process = MP_CONTEXT.Process(
+            target=worker_main,
+            args=(child_conn, self.model_path, self.cpu, self.prewarm, self.stub),
+            name=f"vosk-shard-{self.index}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.ready = False
+        self.warm = False
+        self.timings = {}
+        self.models = []
+        self.started_at = self.last_pong = time.monotonic()
+        self._outbox = queue.SimpleQueue()
+        generation = self.generation
+        threading.Thread(
+            target=self._send_loop,
+            args=(parent_conn, self._outbox),
+            name=f"vosk-shard-{self.index}-send",
+            daemon=True,
+        ).start()
+        threading.Thread(
+            target=self._receive_loop,
+            args=(parent_conn, generation, loop, on_message, on_lost),
+            name=f"vosk-shard-{self.index}-recv",
+            daemon=True,
+        ).start()
+
+    def status(self):
+        if self.error is not None:
+            state = "failed"
+        elif self.warm:
+            state = "ready"
+        elif self.ready:
+            state = "warming"
+        else:
+            state = "loading"
+        status = {
+            "index": self.index,
+            "pid": self.pid,
+            "state": state,
+            "restarts": self.restarts,
+            "timings": dict(self.timings),
+            "prewarmed": self.prewarmed,
+            "models": self.models,
+        }
+        if self.error is not None:
+            status["error"] = self.error
+        return status
+
+    def send(self, op, key, payload):
+        self._outbox.put((op, key, payload))
+
+    def stop(self):
+        """Stops the process; blocks for up to two seconds while it exits,
+        so the supervisor calls it off the event loop while serving."""
+        if self._outbox is not None:
+            self._outbox.put(None)
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=2.0)
+        if self.conn is not None:
+            self.conn.close()
+
+    @staticmethod
+    def _send_loop(conn, outbox):
+        while True:
+            item = outbox.get()
+            if item is None:
+                return
+            try:
+                conn.send(item)
+            except (OSError, ValueError):
+                return
+
+    def _receive_loop(self, conn, generation, loop, on_message, on_lost):
+        try:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    loop.call_soon_threadsafe(on_lost, self, generation)
+                    return
+                loop.call_soon_threadsafe(on_message, self, generation, message)
+        except RuntimeError:
+            return  # the supervisor's loop closed during shutdown
+
+
+class ShardSupervisor:
+    def __init__(
+        self,
+        model_path,
+        workers,
+        describe_client,
+        ingest_factory,
+        pin_cpus=False,
+        prewarm=False,
+        stub=False,
+        observe_result=None,
+        status_reply=None,
+    ):
+        self.describe_client = describe_client
+        self.ingest_factory = ingest_factory
+        self.observe_result = observe_result
+        self.status_reply = status_reply
+        cpu_count = os.cpu_count() or 1
+        self.workers = [
+            ShardWorker(
+                index,
+                model_path,
+                index % cpu_count if pin_cpus else None,
+                prewarm,
+                stub,
+            )
+            for index in range(workers)
+        ]
+        self._channels = {}
+        self._session_ids = itertools.count(1)
+        self._loop = None
+        self._health_task = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        for worker in self.workers:
+            worker.start(self._loop, self._on_message, self._on_lost)
+        self._health_task = asyncio.create_task(self._health_loop())
+
+    def stop(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+        for worker in self.workers:
+            worker.stop()
+
+    def worker_status(self):
+        return [worker.status() for worker in self.workers]
+
+    def worker_metrics(self):
+        return [worker.metrics for worker in self.workers if worker.metrics]
+
+    def pick_worker(self):
+        # Prefer workers that have finished loading the model, then the one
+        # with the fewest pinned sessions; failed workers only as a last resort.
+        return min(
+            self.workers,
+            key=lambda w: (w.error is not None, not w.ready, len(w.sessions)),
+        )
+
+    async def handle_connection(self, websocket):
+        await serve_streams(
+            websocket, partial(self.open_stream, websocket), self.status_reply
+        )
+
+    def open_stream(self, websocket, stream_id):
+        session_id = next(self._session_ids)
+        worker = self.pick_worker()
+        channel = SessionChannel(worker)
+        self._channels[session_id] = channel
+        worker.sessions.add(session_id)
+        worker.send(
+            "open",
+            session_id,
+            (
+                self.describe_client(websocket),
+                uses_binary_results(websocket.subprotocol),
+                stream_id,
+            ),
+        )
+        ingest = self.ingest_factory()
+        return ShardStream(
+            ingest,
+            channel,
+            asyncio.create_task(self._write_replies(websocket, channel, stream_id)),
+            asyncio.create_task(
+                self._forward_ingest(ingest, worker, session_id, channel)
+            ),
+            partial(self._close_session, worker, session_id),
+        )
+
+    def _close_session(self, worker, session_id):
+        self._channels.pop(session_id, None)
+        if session_id in worker.sessions:
+            worker.sessions.discard(session_id)
+            worker.send("close", session_id, None)
+
+    async def _forward_ingest(self, ingest, worker, session_id, channel):
+        while True:
+            item = await ingest.get()
+            if item is None:
+                return
+            message, received_at = item
+            await channel.credits.acquire()
+            if channel.lost:
+                return
+            if worker.error is not None:
+                # As in-process: the first message of a session, not the
+                # connection itself, gets the model failure.
+                channel.mark_lost()
+                return
+            channel.pending.append((received_at, isinstance(message, str)))
+            channel.idle.clear()
+            worker.send("message", session_id, message)
+
+    async def _write_replies(self, websocket, channel, stream_id):
+        while True:
+            item = await channel.replies.get()
+            if item is None or item[0] is None:
+                error = (
+                    WORKER_FAILED_ERROR
+                    if channel.worker.error is not None
+                    else WORKER_LOST_ERROR
+                )
+                await websocket.send(tag_stream(error, stream_id))
+                await end_stream(websocket, stream_id, "error")
+                return
+            replies, should_close, result_type = item
+            received_at, from_control = channel.pending.popleft()
+            channel.credits.release()
+            for reply in replies:
+                await websocket.send(reply)
+            if self.observe_result is not None:
+                self.observe_result(result_type, from_control, received_at)
+            if not channel.pending:
+                channel.idle.set()
+            if should_close:
+                await end_stream(websocket, stream_id, "eof")
+                return
+
+    def _on_message(self, worker, generation, message):
+        if generation != worker.generation:
+            return
+        kind, key, payload = message
+        if kind == "replies":
+            channel = self._channels.get(key)
+            if channel is not None:
+                channel.replies.put_nowait(payload)
+        elif kind == "pong":
+            worker.last_pong = time.monotonic()
+            worker.metrics = payload
+        elif kind == "ready":
+            worker.ready = True
+            worker.pid = key
+            worker.models = payload.pop("models")
+            worker.timings.update(payload)
+            worker.backoff = RESPAWN_BACKOFF_SECONDS
+            worker.last_pong = time.monotonic()
+            logging.info(
+                "Shard %d loaded the model (pid=%d, %.2fs)",
+                worker.index,
+                key,
+                worker.last_pong - worker.started_at,
+            )
+        elif kind == "failed":
+            worker.pid = key
+            worker.error = payload
+            logging.error("Shard %d failed to load the model: %s", worker.index, payload)
+            for session_id in worker.sessions:
+                channel = self._channels.get(session_id)
+                # Sessions still idle hear of it with their first message.
+                if channel is not None and channel.pending:
+                    channel.mark_lost()
+            # The process exits by itself; reap it off the event loop.
+            asyncio.ensure_future(self._loop.run_in_executor(None, worker.stop))
+        elif kind == "warm":
+            worker.warm = True
+            worker.prewarmed = payload.pop("prewarmed")
+            worker.timings.update(payload)
+            worker.timings["total_seconds"] = round(
+                time.monotonic() - worker.started_at, 3
+            )
+            logging.info(
+                "Shard %d ready (%d recognizers pre-warmed)",
+                worker.index,
+                worker.prewarmed,
+            )
+
+    def _on_lost(self, worker, generation):
+        if generation != worker.generation or worker.error is not None:
+            return
+        logging.warning("Shard %d exited; respawning", worker.index)
+        asyncio.ensure_future(self._respawn(worker))
+
+    async def _respawn(self, worker):
+        if worker.respawning:
+            return
+        worker.respawning = True
+        worker.generation += 1  # ignore anything the old process still sends
+        for session_id in list(worker.sessions):
+            channel = self._channels.get(session_id)
+            if channel is not None:
+                channel.mark_lost()
+        worker.sessions.clear()
+        worker.ready = False
+        worker.warm = False
+        # Joining the old process can take seconds; keep the loop serving.
+        await self._loop.run_in_executor(None, worker.stop)
+        worker.restarts += 1
+        delay = worker.backoff
+        worker.backoff = min(worker.backoff * 2.0, RESPAWN_BACKOFF_MAX_SECONDS)
+        try:
+            await asyncio.sleep(delay)
+            worker.start(self._loop, self._on_message, self._on_lost)
+        finally:
+            worker.respawning = False
+
+    async def _health_loop(self):
+        ping_ids = itertools.count(1)
+        while True:
+            await asyncio.sleep(HEALTH_INTERVAL_SECONDS)
+            now = time.monotonic()
+            for worker in self.workers:
+                if (
+                    worker.process is None
+                    or worker.respawning
+                    or worker.error is not None
+                ):
+                    continue
+                # Workers do not answer pings until pre-warming is done.
+                timeout = (
+                    HEALTH_TIMEOUT_SECONDS if worker.warm else STARTUP_TIMEOUT_SECONDS
+                )
+                if not worker.process.is_alive() or now - worker.last_pong > timeout:
+                    logging.warning(
+                        "Shard %d failed health check; respawning", worker.index
+                    )
+                    asyncio.ensure_future(self._respawn(worker))
+                    continue
+                if worker.warm:
+                    worker.send("ping", next(ping_ids), None)
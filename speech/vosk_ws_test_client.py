@@ -1,15 +1,18 @@
 import argparse
 import asyncio
 import json
+import time
 import wave
 
-import sounddevice as sd
 import websockets
 
+from service_protocol import BINARY_SUBPROTOCOL, decode_result_binary
+
 WS_URL = "ws://localhost:2700"
 SAMPLE_RATE = 16000
 CHANNELS = 1
 BLOCKSIZE = 8000  # 0.5s of audio per frame (16kHz * 0.5)
+FINAL_TIMEOUT_SECONDS = 10.0
 
 
 def parse_args():
@@ -32,6 +35,26 @@ def parse_args():
         action="store_true",
         help="Validate partial/final outputs against the grammar list.",
     )
+    parser.add_argument(
+        "--vad",
+        action="store_true",
+        help="Enable the service's voice-activity gate for this session.",
+    )
+    parser.add_argument(
+        "--binary-framing",
+        action="store_true",
+        help="Request binary result frames instead of JSON text envelopes.",
+    )
+    parser.add_argument(
+        "--final-mode",
+        choices=["flush", "endpoint", "compare"],
+        default="flush",
+        help=(
+            "How a WAV stream ends: 'flush' sends a final message, 'endpoint' "
+            "streams silence until Kaldi's endpointer fires, 'compare' runs "
+            "both and reports the end-of-speech to final time saved."
+        ),
+    )
     return parser.parse_args()
 
 
@@ -41,6 +64,11 @@ def parse_grammar(raw: str):
     return [item.strip() for item in raw.split(",") if item.strip()]
 
 
+async def send_vad(ws, enabled):
+    if enabled:
+        await ws.send(json.dumps({"type": "vad", "enabled": True}))
+
+
 async def send_grammar(ws, grammar):
     if not grammar:
         return
@@ -48,6 +76,9 @@ async def send_grammar(ws, grammar):
 
 
 async def stream_microphone(ws):
+    # Imported here so WAV runs and bench_load work without PortAudio.
+    import sounddevice as sd
+
     with sd.RawInputStream(
         samplerate=SAMPLE_RATE,
         blocksize=BLOCKSIZE,
@@ -60,8 +91,53 @@ async def stream_microphone(ws):
             await ws.send(bytes(data))
 
 
-async def stream_wav_file(ws, audio_path):
-    with wave.open(audio_path, "rb") as wav_file:
+class FinalTimer:
+    """Measures the gap between the last audio frame and the final result."""
+
+    def __init__(self):
+        self.audio_end = None
+        self.final_at = None
+        self.final_received = asyncio.Event()
+
+    def mark_audio_end(self):
+        self.audio_end = time.perf_counter()
+
+    def mark_final(self):
+        if self.audio_end is None or self.final_received.is_set():
+            return
+        self.final_at = time.perf_counter()
+        self.final_received.set()
+
+    def elapsed_ms(self):
+        if self.final_at is None:
+            return None
+        return (self.final_at - self.audio_end) * 1000.0
+
+
+async def finish_wav_stream(ws, final_mode, timer):
+    timer.mark_audio_end()
+    if final_mode == "flush":
+        await ws.send(json.dumps({"type": "final"}))
+    else:
+        silence = bytes(BLOCKSIZE * 2)
+        block_seconds = BLOCKSIZE / SAMPLE_RATE
+        deadline = timer.audio_end + FINAL_TIMEOUT_SECONDS
+        while not timer.final_received.is_set() and time.perf_counter() < deadline:
+            await ws.send(silence)
+            try:
+                await asyncio.wait_for(timer.final_received.wait(), block_seconds)
+            except asyncio.TimeoutError:
+                pass
+    try:
+        await asyncio.wait_for(timer.final_received.wait(), FINAL_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        print("!! No final result before timeout")
+    await ws.close()
+
+
+def read_wav_pcm(audio_path):
+    """Returns the PCM of a 16kHz mono 16-bit WAV file."""
+    with wave.open(str(audio_path), "rb") as wav_file:
         if (
             wav_file.getframerate() != SAMPLE_RATE
             or wav_file.getnchannels() != CHANNELS
@@ -73,11 +149,15 @@ async def stream_wav_file(ws, audio_path):
                 f"{wav_file.getnchannels()}ch, "
                 f"{wav_file.getsampwidth() * 8}-bit."
             )
-        while True:
-            data = wav_file.readframes(BLOCKSIZE)
-            if not data:
-                break
-            await ws.send(data)
+        return wav_file.readframes(wav_file.getnframes())
+
+
+async def stream_wav_file(ws, audio_path, final_mode, timer):
+    audio = read_wav_pcm(audio_path)
+    block_bytes = BLOCKSIZE * 2
+    for offset in range(0, len(audio), block_bytes):
+        await ws.send(audio[offset : offset + block_bytes])
+    await finish_wav_stream(ws, final_mode, timer)
 
 
 def is_text_in_grammar(text, grammar):
@@ -93,16 +173,29 @@ def token_outside_grammar(text, grammar):
     return [token for token in tokens if token not in grammar]
 
 
-async def receive_messages(ws, grammar, validate):
+def decode_message(message):
+    """Returns a service message as a dict, whichever framing it came in."""
+    if isinstance(message, bytes):
+        result_type, raw_result = decode_result_binary(message)
+        return {"type": result_type, "result": json.loads(raw_result)}
+    return json.loads(message)
+
+
+async def receive_messages(ws, grammar, validate, timer=None):
     async for message in ws:
-        print("<<", message)
-        if not validate:
-            continue
+        if isinstance(message, str):
+            print("<<", message)
         try:
-            payload = json.loads(message)
-        except json.JSONDecodeError:
+            payload = decode_message(message)
+        except (ValueError, KeyError):
             continue
+        if isinstance(message, bytes):
+            print("<<", payload["type"], json.dumps(payload["result"], ensure_ascii=False))
         payload_type = payload.get("type")
+        if timer is not None and payload_type == "final":
+            timer.mark_final()
+        if not validate:
+            continue
         result = payload.get("result", {})
         text = result.get("text", "") if payload_type == "final" else result.get("partial", "")
         if payload_type in {"final", "partial"} and text:
@@ -113,21 +206,45 @@ async def receive_messages(ws, grammar, validate):
                 print(f"!! Tokens outside grammar: {outside}")
 
 
+def connect(args):
+    subprotocols = [BINARY_SUBPROTOCOL] if args.binary_framing else None
+    return websockets.connect(args.ws_url, max_size=None, subprotocols=subprotocols)
+
+
+async def run_wav_session(args, grammar, final_mode):
+    timer = FinalTimer()
+    async with connect(args) as ws:
+        await send_vad(ws, args.vad)
+        await send_grammar(ws, grammar)
+        await asyncio.gather(
+            stream_wav_file(ws, args.audio_file, final_mode, timer),
+            receive_messages(ws, grammar, args.validate, timer),
+        )
+    elapsed = timer.elapsed_ms()
+    if elapsed is not None:
+        print(f"-- end of speech to final ({final_mode}): {elapsed:.1f} ms")
+    return elapsed
+
+
 async def main():
     args = parse_args()
     grammar = parse_grammar(args.grammar)
-    async with websockets.connect(args.ws_url, max_size=None) as ws:
+    if args.audio_file:
+        if args.final_mode != "compare":
+            await run_wav_session(args, grammar, args.final_mode)
+            return
+        endpoint_ms = await run_wav_session(args, grammar, "endpoint")
+        flush_ms = await run_wav_session(args, grammar, "flush")
+        if endpoint_ms is not None and flush_ms is not None:
+            print(f"-- time saved by explicit final: {endpoint_ms - flush_ms:.1f} ms")
+        return
+    async with connect(args) as ws:
+        await send_vad(ws, args.vad)
         await send_grammar(ws, grammar)
-        if args.audio_file:
-            await asyncio.gather(
-                stream_wav_file(ws, args.audio_file),
-                receive_messages(ws, grammar, args.validate),
-            )
-        else:
-            await asyncio.gather(
-                stream_microphone(ws),
-                receive_messages(ws, grammar, args.validate),
-            )
+        await asyncio.gather(
+            stream_microphone(ws),
+            receive_messages(ws, grammar, args.validate),
+        )
 
 
 if __name__ == "__main__":